@@ -1,9 +1,27 @@
+import logging
+
 import ee
 
+from gee_tools.exports import sharding
+from gee_tools.exports.sharding import add_grid_cell, SHARD_PROPERTY
+from gee_tools.exports.task_scheduler import TaskScheduler
 
-def tfexporter(samples, tocloud, selectors, dropselectors, mybucket, prefix, fname):
+logger = logging.getLogger(__name__)
 
-    if selectors is None:
+# The property holding the CRS of the UTM zone of every point, see add_utm_crs.
+UTM_PROPERTY = 'gee_tools_utm_crs'
+
+
+def tfexporter(samples, tocloud, selectors, dropselectors, mybucket, prefix, fname, start=True, schema=None):
+    """
+    Export samples to a TFRecord file.  If start is False, the task is returned without being started,
+    e.g. to add it to a TaskScheduler.  If schema (a TileSchema) is given and selectors is None,
+    the selectors are the bands and properties of the schema instead of those of the first sample.
+    """
+
+    if selectors is None and schema is not None:
+        selectors = ee.List(schema.selectors)
+    elif selectors is None:
         selectors = ee.Feature(samples.first()).propertyNames()
 
     if dropselectors is not None:
@@ -34,7 +52,8 @@ def tfexporter(samples, tocloud, selectors, dropselectors, mybucket, prefix, fna
 
         )
 
-    task.start()
+    if start:
+        task.start()
 
     return task
 
@@ -59,29 +78,81 @@ def _sample_patch(point, patchesarray, scale, projection='EPSG:3857'):
     return ee.Feature(arrays_samples.copyProperties(point))
 
 
+def _sample_patches_batched(points, patchesarray, scale, cell_size=None, projection='EPSG:3857'):
+    """
+    Sample patchesarray at all points with sampleRegions, instead of one sample call per point.
+    Masked points are dropped rather than failing the export.
+
+    Args:
+        points (ee.FeatureCollection):  Points, their geometry and properties are kept.
+        patchesarray (ee.Image):
+        scale (Union[int, float]):
+        cell_size (Optional[float]):  If given, every grid cell of cell_size degrees is sampled by its
+            own sampleRegions call, see gee_tools.exports.sharding.map_groups.
+        projection (str):
+    Returns:
+        (ee.FeatureCollection):
+    """
+    def sample(group):
+        # Without properties, sampleRegions copies all the non-system properties of every point.
+        return patchesarray.sampleRegions(
+            collection=group,
+            scale=scale,
+            projection=projection,
+            tileScale=12,
+            geometries=True
+        )
+
+    if cell_size is None:
+        return sample(points)
+
+    samples = sharding.map_groups(add_grid_cell(points, cell_size), SHARD_PROPERTY, lambda group, cell: sample(group))
+    # Only the grid cell is dropped, the samples keep the other properties of their point.
+    return samples.map(lambda f: f.select(f.propertyNames().remove(SHARD_PROPERTY)))
+
+
+def _sample_patches(points, patchesarray, scale, batched, cell_size, projection='EPSG:3857'):
+    if batched:
+        return _sample_patches_batched(points, patchesarray, scale, cell_size, projection)
+    # sample with dropNulls=False keeps masked points, at the cost of one sample call per point.
+    return points.map(lambda pt: _sample_patch(pt, patchesarray, scale, projection))  # .flatten();
+
+
 def get_array_patches(img, scale, ksize, points, doexport, tocloud,
-                      selectors, dropselectors, mybucket, prefix, fname):
+                      selectors, dropselectors, mybucket, prefix, fname, batched=False, cell_size=None,
+                      projection='EPSG:3857', schema=None):
     """
-    Will sample the img using the EPSG:3857 projection, make sure points are in EPSG:3857
+    Will sample the img using projection (EPSG:3857 by default), a CRS string or an ee.Projection.
+    ksize is in pixels of that projection.
+
+    If batched, points are sampled with a few sampleRegions calls (see _sample_patches_batched)
+    instead of one sample call per point.
+
+    If schema (a TileSchema) is given, the bands of img are cast to their schema dtype before
+    sampling, see TileSchema.cast, and the schema provides the export selectors.
     """
 
+    if schema is not None:
+        img = schema.cast(img)
+
     kern = ee.Kernel.square(ksize, 'pixels')
     patches_array = img.neighborhoodToArray(kern)
 
-    # sampleRegions does not cut it for larger collections; using mapped sample instead.
-    patches_samps = points.map(lambda pt: _sample_patch(pt, patches_array, scale))  # .flatten();
+    patches_samps = _sample_patches(points, patches_array, scale, batched, cell_size, projection)
 
     if doexport:
         # Export to a TFRecord file in Cloud Storage, creating a file
         # at gs://mybucket/prefix/fname.tfrecord
         # which you can load directly in TensorFlow.
-        task = tfexporter(patches_samps, tocloud, selectors, dropselectors, mybucket, prefix, fname)
+        task = tfexporter(patches_samps, tocloud, selectors, dropselectors, mybucket, prefix, fname, schema=schema)
 
     return patches_samps
 
 
 def get_reduced_patches(img, scale, ksize, points, doexport, tocloud,
-                        selectors, dropselectors, mybucket, prefix, fname):
+                        selectors, dropselectors, mybucket, prefix, fname, batched=False, cell_size=None,
+                        projection='EPSG:3857'):
+    """See get_array_patches for batched, cell_size and projection."""
 
     kern = ee.Kernel.square(ksize, 'pixels')
     reducer = ee.Reducer.mean().combine(ee.Reducer.sampleVariance(), "", True)
@@ -90,8 +161,7 @@ def get_reduced_patches(img, scale, ksize, points, doexport, tocloud,
                                              skipMasked=True,
                                              optimization=None)
 
-    # sampleRegions does not cut it for larger collections; using mapped sample instead.
-    patches_samps = points.map(lambda pt: _sample_patch(pt, patches_reduced, scale))  # .flatten();
+    patches_samps = _sample_patches(points, patches_reduced, scale, batched, cell_size, projection)
 
     if doexport:
         # Export to a TFRecord file in Cloud Storage, creating a file
@@ -99,4 +169,189 @@ def get_reduced_patches(img, scale, ksize, points, doexport, tocloud,
         # which you can load directly in TensorFlow.
         task = tfexporter(patches_samps, tocloud, selectors, dropselectors, mybucket, prefix, fname)
 
-    return patches_samps
\ No newline at end of file
+    return patches_samps
+
+
+def utm_crs(lon, lat):
+    """
+    Args:
+        lon (float):
+        lat (float):
+    Returns:
+        (str):  The CRS of the WGS 84 UTM zone containing the point, as set by add_utm_crs.
+    """
+    zone = min(int((lon + 180.0) // 6) + 1, 60)
+    return 'EPSG:{}'.format((32600 if lat >= 0 else 32700) + zone)
+
+
+def add_utm_crs(points):
+    """
+    Set UTM_PROPERTY to the CRS of the UTM zone of every point, see utm_crs.
+
+    Args:
+        points (ee.FeatureCollection):
+    Returns:
+        (ee.FeatureCollection):
+    """
+    def add_crs(feature):
+        coords = feature.geometry().coordinates()
+        lon, lat = ee.Number(coords.get(0)), ee.Number(coords.get(1))
+        zone = lon.add(180).divide(6).floor().add(1).min(60)
+        code = ee.Number(ee.Algorithms.If(lat.gte(0), 32600, 32700)).add(zone).int()
+        return feature.set(UTM_PROPERTY, ee.String('EPSG:').cat(code.format()))
+    return points.map(add_crs)
+
+
+def get_array_patches_by_zone(img, scale, ksize, points, batched=False, cell_size=None, schema=None):
+    """
+    Sample patches of img at every point in the UTM zone of the point, instead of one global projection.
+    Points are grouped by zone and every group is sampled in the projection of its zone, so img should
+    not be reprojected beforehand: it is computed in the zone projections directly.
+
+    Args:
+        img (ee.Image):
+        scale (Union[int, float]):
+        ksize (int):  The patch radius in pixels.
+        points (ee.FeatureCollection):
+        batched (bool):  See get_array_patches.
+        cell_size (Optional[float]):  See get_array_patches.
+        schema (Optional[TileSchema]):  See get_array_patches.
+    Returns:
+        (ee.FeatureCollection):  The samples, with the CRS they were sampled in as UTM_PROPERTY.
+    """
+    if schema is not None:
+        img = schema.cast(img)
+    return sharding.map_groups(add_utm_crs(points), UTM_PROPERTY, lambda group, crs: get_array_patches(
+        img, scale, ksize, group, False, False, None, None, None, None, None,
+        batched=batched, cell_size=cell_size, projection=ee.Projection(crs)
+    ))
+
+
+def feature_schema(properties):
+    """
+    Args:
+        properties (Dict[str, Any]):  The properties of one sample, e.g. ee.Feature(samples.first()).toDictionary().getInfo().
+    Returns:
+        (Dict[str, Dict[str, Any]]):  The stored 'dtype' ('float32', 'int64' or 'string') and 'shape' of every
+            property, as in TileSchema.parse_spec.  Patches are nested lists, e.g. of shape [2r + 1, 2r + 1].
+    """
+    schema = {}
+    for name, value in properties.items():
+        shape = []
+        while isinstance(value, list):
+            shape.append(len(value))
+            value = value[0] if len(value) > 0 else None
+        if isinstance(value, str):
+            dtype = 'string'
+        elif isinstance(value, int) and not isinstance(value, bool) and len(shape) == 0:
+            dtype = 'int64'
+        else:
+            # Arrays of numbers are exported as float lists, unless cast with a TileSchema.
+            dtype = 'float32'
+        schema[name] = {'dtype': dtype, 'shape': shape}
+    return schema
+
+
+def _shard_name(split, index, num_shards):
+    name = '{:05d}-of-{:05d}'.format(index, num_shards)
+    return name if split is None else '{}-{}'.format(split, name)
+
+
+def export_tfrecord_shards(samples, prefix, id_property, num_shards, splits=None, bucket=None, selectors=None,
+                           scheduler=None, manifest_path=None, jid_prefix='tfrecord_', seed=0, count_records=True,
+                           retry_policy=None, tile_schema=None):
+    """
+    Export samples as num_shards TFRecord shards per split, one TaskScheduler job per shard.
+
+    Samples are assigned to splits and shards by pseudorandom numbers derived from id_property,
+    so the assignment is deterministic and does not depend on the order of the collection.
+    Shards are balanced in expectation.
+
+    Args:
+        samples (ee.FeatureCollection):  E.g. the output of get_array_patches or ExportManager.sample_tiles.
+        prefix (str):  Prepended to the shard names, e.g. 'tiles/run1_' gives 'tiles/run1_train-00000-of-00010'.
+        id_property (str):  A property uniquely identifying every sample.
+        num_shards (int):  The number of shards of every split.
+        splits (Optional[List[Tuple[str, float]]]):  The name and fraction of every split,
+            e.g. [('train', 0.8), ('val', 0.1), ('test', 0.1)].  If None, samples are not split.
+        bucket (Optional[str]):  The Cloud Storage bucket.  If None, shards are exported to Drive.
+        selectors (Optional[List[str]]):  The properties to export.  Defaults to the properties of
+            the first sample.
+        scheduler (Optional[TaskScheduler]):  The scheduler to add the exports to.  Defaults to a new one.
+        manifest_path (Optional[str]):  If given, a manifest is written there, see sharding.write_manifest.
+            It lists the output of every shard and records its number of records, the splits and the
+            feature schema (see feature_schema).
+        jid_prefix (str):  Prepended to the shard names to form job ids.
+        seed (int):  Seeds the shard assignment, and seed + 1 the split assignment.
+        count_records (bool):  If True, count the records of every shard, stored as Shard.num_points.
+        retry_policy (Optional[RetryPolicy]):  Passed to TaskScheduler.add_task.
+        tile_schema (Optional[TileSchema]):  The schema samples were sampled with.  If given, it provides
+            the default selectors and the feature schema (see TileSchema.parse_spec) instead of the first sample.
+    Returns:
+        (Tuple[TaskScheduler, List[sharding.Shard], Dict[str, Dict[str, Any]]]):  The scheduler, the shards
+            and the feature schema.
+    """
+    if num_shards < 1:
+        raise sharding.ShardingError('num_shards must be at least 1.')
+    samples = sharding.add_hash_bucket(samples, num_shards, seed=seed, id_property=id_property)
+    split_names = [None]
+    if splits is not None:
+        split_names = [name for name, _ in splits]
+        samples = sharding.add_split(samples, splits, seed=seed + 1, id_property=id_property)
+        # Shards are filtered on SHARD_PROPERTY, which becomes '{split}_{bucket}'.
+        samples = samples.map(lambda f: f.set(SHARD_PROPERTY, ee.String(f.get(sharding.SPLIT_PROPERTY)).cat('_').cat(
+            ee.Number(f.get(SHARD_PROPERTY)).format()
+        )))
+
+    shards = []
+    for split in split_names:
+        for i in range(num_shards):
+            value = i if split is None else '{}_{}'.format(split, i)
+            shards.append(sharding.Shard(len(shards), [value], name=_shard_name(split, i, num_shards)))
+
+    # The schema and the record counts are fetched with a single request, if at all.
+    info = {}
+    if tile_schema is None:
+        info['first'] = ee.Feature(samples.first()).toDictionary()
+    if count_records:
+        info['counts'] = samples.aggregate_histogram(SHARD_PROPERTY)
+    info = ee.Dictionary(info).getInfo() if len(info) > 0 else {}
+
+    if tile_schema is not None:
+        schema = tile_schema.parse_spec()
+        default_selectors = tile_schema.selectors
+    else:
+        schema = feature_schema({
+            name: value for name, value in info['first'].items()
+            if not name.startswith(SHARD_PROPERTY) and not name.startswith(sharding.SPLIT_PROPERTY)
+        })
+        default_selectors = sorted(schema)
+    if selectors is None:
+        selectors = default_selectors
+    else:
+        schema = {name: schema[name] for name in selectors if name in schema}
+    if count_records:
+        counts = info['counts']
+        for shard in shards:
+            shard.num_points = int(counts.get(str(shard.values[0]), 0))
+
+    scheduler = TaskScheduler() if scheduler is None else scheduler
+    exporter = sharding.TableExporter(prefix, bucket=bucket, file_format='TFRecord', selectors=selectors)
+    jids = []
+    for shard in shards:
+        jid = jid_prefix + shard.name
+
+        def task_factory(shard=shard, jid=jid):
+            return exporter(shard.filter(samples), shard, jid)
+
+        scheduler.add_task(None, jid, retry_policy=retry_policy, task_factory=task_factory)
+        jids.append(jid)
+    logger.info('Exporting {} TFRecord shards'.format(len(shards)))
+
+    if manifest_path is not None:
+        sharding.write_manifest(
+            manifest_path, shards, jids, exporter,
+            id_property=id_property, num_shards=num_shards, seed=seed, schema=schema,
+            splits=None if splits is None else [list(split) for split in splits],
+        )
+    return scheduler, shards, schema
@@ -0,0 +1,342 @@
+"""
+Streaming reader for the tile tables exported by ExportManager.sample_tiles and ee_tf_exports.tfexporter.
+
+Every band of a tile is a column holding the (2 * export_radius + 1)^2 pixels of the patch,
+flattened row by row in TFRecord files and as a nested list in CSV files.  iter_tiles decodes
+the files in batches of records and yields NumPy arrays of shape (N, bands, 2r + 1, 2r + 1),
+so memory is bounded by the batch size whatever the size of the export.
+
+TFRecord files are parsed directly, without TensorFlow.  Files ending in .gz are decompressed.
+"""
+import io
+import os
+import csv
+import glob
+import gzip
+import json
+import struct
+import collections
+from concurrent import futures
+
+import numpy as np
+
+TFRECORD = 'TFRecord'
+CSV = 'CSV'
+
+DEFAULT_BATCH_SIZE = 256
+
+# Protobuf wire types.
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+class TileReaderError(RuntimeError):
+    pass
+
+
+def file_format(path):
+    """
+    Args:
+        path (str):
+    Returns:
+        (str):  TFRECORD or CSV, from the file extension.
+    """
+    name = path[:-len('.gz')] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension in ('.tfrecord', '.tfrecords'):
+        return TFRECORD
+    if extension == '.csv':
+        return CSV
+    raise TileReaderError('Unknown tile table format: {}'.format(path))
+
+
+def _expand_paths(paths):
+    if isinstance(paths, str):
+        expanded = sorted(glob.glob(paths))
+        if len(expanded) == 0:
+            raise TileReaderError('No files match {}'.format(paths))
+        return expanded
+    return list(paths)
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return io.open(path, 'rb')
+
+
+def iter_tfrecords(path):
+    """
+    Args:
+        path (str):  A TFRecord file, optionally gzip compressed.
+    Returns:
+        (Iterator[bytes]):  The serialized records.  CRCs are not checked.
+    """
+    with _open(path) as f:
+        while True:
+            header = f.read(12)
+            if len(header) == 0:
+                return
+            if len(header) < 12:
+                raise TileReaderError('Truncated record header in {}'.format(path))
+            length = struct.unpack('<Q', header[:8])[0]
+            record = f.read(length)
+            if len(record) < length or len(f.read(4)) < 4:
+                raise TileReaderError('Truncated record in {}'.format(path))
+            yield record
+
+
+def iter_csv_rows(path):
+    """
+    Args:
+        path (str):  A CSV file with a header, optionally gzip compressed.
+    Returns:
+        (Iterator[Dict[str, str]]):
+    """
+    with _open(path) as f:
+        for row in csv.DictReader(io.TextIOWrapper(f, encoding='utf-8', newline='')):
+            yield row
+
+
+def _iter_records(path):
+    if file_format(path) == TFRECORD:
+        return iter_tfrecords(path)
+    return iter_csv_rows(path)
+
+
+def _read_varint(buf, pos):
+    result, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf, pos=0, end=None):
+    """Yield (field_number, wire_type, value) for the fields of a serialized protobuf message.
+    value is an int for varints, and the (start, end) of the bytes of other fields."""
+    end = len(buf) if end is None else end
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == _VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _read_varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == _FIXED32:
+            value = (pos, pos + 4)
+            pos += 4
+        elif wire_type == _FIXED64:
+            value = (pos, pos + 8)
+            pos += 8
+        else:
+            raise TileReaderError('Unsupported protobuf wire type {}'.format(wire_type))
+        yield field, wire_type, value
+
+
+def _decode_values(buf, start, end):
+    """Decode a tf.train.Feature into a flat array, or a list of bytes for a BytesList."""
+    for kind, _, (list_start, list_end) in _iter_fields(buf, start, end):
+        if kind == 1:
+            return [bytes(buf[s:e]) for _, _, (s, e) in _iter_fields(buf, list_start, list_end)]
+        values = []
+        for _, wire_type, value in _iter_fields(buf, list_start, list_end):
+            if kind == 2:
+                # Packed or not, floats are little endian float32.
+                values.append(np.frombuffer(buf[value[0]:value[1]], dtype='<f4'))
+            elif wire_type == _LENGTH_DELIMITED:
+                pos, packed = value[0], []
+                while pos < value[1]:
+                    number, pos = _read_varint(buf, pos)
+                    packed.append(number)
+                values.append(np.array(packed, dtype=np.uint64).view(np.int64))
+            else:
+                values.append(np.array([value], dtype=np.uint64).view(np.int64))
+        dtype = np.float32 if kind == 2 else np.int64
+        return np.concatenate(values) if len(values) > 0 else np.zeros(0, dtype=dtype)
+    return np.zeros(0, dtype=np.float32)
+
+
+def parse_example(record, names=None):
+    """
+    Parse a serialized tf.train.Example.
+
+    Args:
+        record (bytes):
+        names (Optional[Collection[str]]):  The features to decode, all of them if None.
+            Other features are skipped without being decoded.
+    Returns:
+        (Dict[str, Union[np.ndarray, List[bytes]]]):  Float and int64 features as flat arrays,
+            bytes features as lists.
+    """
+    features = {}
+    for _, _, (start, end) in _iter_fields(record):
+        for _, _, (entry_start, entry_end) in _iter_fields(record, start, end):
+            key, value = None, None
+            for field, _, position in _iter_fields(record, entry_start, entry_end):
+                if field == 1:
+                    key = bytes(record[position[0]:position[1]]).decode('utf-8')
+                elif field == 2:
+                    value = position
+            if value is not None and (names is None or key in names):
+                features[key] = _decode_values(record, *value)
+    return features
+
+
+def _parse_csv_row(row, names):
+    return {
+        name: np.asarray(json.loads(row[name]), dtype=np.float32).ravel()
+        for name in names if row.get(name, '') not in ('', None)
+    }
+
+
+def decode_tiles(records, record_format, output_bands, export_radius, fill_value=None, dtype=np.float32,
+                 schema=None):
+    """
+    Args:
+        records (List[Union[bytes, Dict[str, str]]]):  Serialized examples, or CSV rows.
+        record_format (str):  TFRECORD or CSV.
+        output_bands (List[str]):  The band columns to decode, e.g. the output bands returned by
+            ExportManager.sample_tiles.
+        export_radius (int):  The export_radius the tiles were sampled with.
+        fill_value (Optional[float]):  The value of the pixels of missing or empty band columns.
+            If None, they raise a TileReaderError.
+        dtype (np.dtype):  Defaults to float32.
+        schema (Optional[TileSchema]):  The schema the tiles were exported with.  Quantized bands are
+            converted back to values, see BandSpec.dequantize.
+    Returns:
+        (np.ndarray):  Of shape (len(records), len(output_bands), 2 * export_radius + 1, 2 * export_radius + 1).
+    """
+    size = 2 * export_radius + 1
+    names = set(output_bands)
+    specs = [None if schema is None else schema.band(band) for band in output_bands]
+    tiles = np.empty((len(records), len(output_bands), size, size), dtype=dtype)
+    for i, record in enumerate(records):
+        if record_format == TFRECORD:
+            features = parse_example(record, names)
+        else:
+            features = _parse_csv_row(record, output_bands)
+        for j, band in enumerate(output_bands):
+            values = features.get(band, None)
+            if values is None or len(values) == 0:
+                if fill_value is None:
+                    raise TileReaderError('Record {} has no values for band {}.'.format(i, band))
+                tiles[i, j] = fill_value
+            elif len(values) != size * size:
+                raise TileReaderError('Band {} of record {} has {} values, expected {} for export_radius {}.'.format(
+                    band, i, len(values), size * size, export_radius
+                ))
+            elif specs[j] is not None:
+                tiles[i, j] = np.reshape(specs[j].dequantize(values, dtype), (size, size))
+            else:
+                tiles[i, j] = np.reshape(values, (size, size))
+    return tiles
+
+
+def _iter_batches(paths, batch_size):
+    """Yield (record_format, records) batches of at most batch_size records, spanning files of the same format."""
+    batch, batch_format = [], None
+    for path in paths:
+        record_format = file_format(path)
+        if record_format != batch_format and len(batch) > 0:
+            yield batch_format, batch
+            batch = []
+        batch_format = record_format
+        for record in _iter_records(path):
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield batch_format, batch
+                batch = []
+    if len(batch) > 0:
+        yield batch_format, batch
+
+
+def iter_tiles(paths, output_bands, export_radius, batch_size=DEFAULT_BATCH_SIZE, num_workers=1,
+               fill_value=None, dtype=np.float32, schema=None):
+    """
+    Stream the tiles of exported tile tables in batches.
+
+    Files are read sequentially and batches are decoded by num_workers processes.  At most
+    2 * num_workers batches are in flight, so memory is bounded whatever the number of files.
+
+    Args:
+        paths (Union[str, List[str]]):  TFRecord or CSV files, in order.  A str is a glob pattern.
+        output_bands (List[str]):  See decode_tiles.
+        export_radius (int):  See decode_tiles.
+        batch_size (int):  Defaults to DEFAULT_BATCH_SIZE.
+        num_workers (int):  The number of decoding processes.  If 1, batches are decoded in this process.
+        fill_value (Optional[float]):  See decode_tiles.
+        dtype (np.dtype):  Defaults to float32.
+        schema (Optional[TileSchema]):  See decode_tiles.
+    Returns:
+        (Iterator[np.ndarray]):  Arrays of shape (N, len(output_bands), 2r + 1, 2r + 1), N <= batch_size,
+            in the order of the records in the files.
+    """
+    if batch_size < 1:
+        raise TileReaderError('batch_size must be at least 1.')
+    paths = _expand_paths(paths)
+    args = (list(output_bands), export_radius, fill_value, dtype, schema)
+
+    if num_workers <= 1:
+        for record_format, records in _iter_batches(paths, batch_size):
+            yield decode_tiles(records, record_format, *args)
+        return
+
+    with futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = collections.deque()
+        for record_format, records in _iter_batches(paths, batch_size):
+            pending.append(executor.submit(decode_tiles, records, record_format, *args))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def count_records(paths):
+    """
+    Args:
+        paths (Union[str, List[str]]):  See iter_tiles.
+    Returns:
+        (int):  The number of records in the files.
+    """
+    return sum(sum(1 for _ in _iter_records(path)) for path in _expand_paths(paths))
+
+
+def read_tiles(paths, output_bands, export_radius, memmap_path=None, **kwargs):
+    """
+    Read all the tiles of exported tile tables into one array.
+
+    Args:
+        paths (Union[str, List[str]]):  See iter_tiles.
+        output_bands (List[str]):  See decode_tiles.
+        export_radius (int):  See decode_tiles.
+        memmap_path (Optional[str]):  If given, the tiles are written to a .npy file at this path,
+            opened as a memory map, so that exports larger than memory can be read.  The files are
+            read twice, once to count the records.
+        kwargs:  Passed to iter_tiles.
+    Returns:
+        (np.ndarray):  Of shape (N, len(output_bands), 2r + 1, 2r + 1), a np.memmap if memmap_path is given.
+    """
+    paths = _expand_paths(paths)
+    size = 2 * export_radius + 1
+    if memmap_path is None:
+        batches = list(iter_tiles(paths, output_bands, export_radius, **kwargs))
+        if len(batches) == 0:
+            return np.zeros((0, len(output_bands), size, size), dtype=kwargs.get('dtype', np.float32))
+        return np.concatenate(batches)
+
+    shape = (count_records(paths), len(output_bands), size, size)
+    tiles = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=kwargs.get('dtype', np.float32), shape=shape)
+    start = 0
+    for batch in iter_tiles(paths, output_bands, export_radius, **kwargs):
+        tiles[start:start + len(batch)] = batch
+        start += len(batch)
+    tiles.flush()
+    return tiles
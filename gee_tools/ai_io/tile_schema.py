@@ -0,0 +1,176 @@
+"""
+Typed schemas for tile exports.
+
+A TileSchema declares the dtype, scale and offset of every band of the tiles sampled by
+ee_tf_exports.get_array_patches.  Bands are quantized server side before they are sampled,
+value = stored * scale + offset, so integer bands are exported as compact int64 lists instead of
+float lists, and the same schema gives readers the parse spec to decode them, see tile_reader.
+It also provides the export selectors without querying the first sample.
+"""
+import numpy as np
+
+from gee_tools import imgtools
+
+# Maps dtypes to the ee.Image cast method.
+CASTS = {
+    'uint8': 'toUint8',
+    'int8': 'toInt8',
+    'uint16': 'toUint16',
+    'int16': 'toInt16',
+    'int32': 'toInt32',
+    'float32': 'toFloat',
+}
+
+
+class TileSchemaError(RuntimeError):
+    pass
+
+
+class BandSpec(object):
+    """The dtype and quantization of one band, value = stored * scale + offset."""
+
+    def __init__(self, name, dtype='float32', scale=1.0, offset=0.0):
+        """
+        Args:
+            name (str):
+            dtype (str):  One of CASTS.
+            scale (float):
+            offset (float):
+        """
+        if dtype not in CASTS:
+            raise TileSchemaError('Unsupported dtype {} for band {}, expected one of {}'.format(
+                dtype, name, sorted(CASTS)
+            ))
+        if scale == 0:
+            raise TileSchemaError('The scale of band {} must not be 0.'.format(name))
+        self.name = name
+        self.dtype = dtype
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def is_integer(self):
+        return self.dtype != 'float32'
+
+    @property
+    def quantized(self):
+        return self.scale != 1.0 or self.offset != 0.0
+
+    def cast(self, img):
+        """
+        Args:
+            img (ee.Image):  An image with a band named self.name.
+        Returns:
+            (ee.Image):  The band quantized to stored values, clamped to the range of the dtype.
+        """
+        band = img.select([self.name])
+        if self.quantized:
+            band = band.subtract(self.offset).divide(self.scale)
+        if self.is_integer:
+            info = np.iinfo(self.dtype)
+            band = band.round().clamp(int(info.min), int(info.max))
+        return getattr(band, CASTS[self.dtype])()
+
+    def dequantize(self, values, dtype=np.float32):
+        """
+        Args:
+            values (np.ndarray):  Stored values.
+            dtype (np.dtype):
+        Returns:
+            (np.ndarray):  values * scale + offset.
+        """
+        values = np.asarray(values)
+        if self.quantized:
+            values = values * self.scale + self.offset
+        return values.astype(dtype, copy=False)
+
+    def to_dict(self):
+        return {'name': self.name, 'dtype': self.dtype, 'scale': self.scale, 'offset': self.offset}
+
+    @staticmethod
+    def from_dict(d):
+        return BandSpec(d['name'], d.get('dtype', 'float32'), d.get('scale', 1.0), d.get('offset', 0.0))
+
+    def __repr__(self):
+        return 'BandSpec({}, {}, scale={}, offset={})'.format(self.name, self.dtype, self.scale, self.offset)
+
+
+class TileSchema(object):
+    """The bands of (2 * export_radius + 1) square tiles and the scalar properties exported with them."""
+
+    def __init__(self, bands, export_radius, properties=None):
+        """
+        Args:
+            bands (List[Union[BandSpec, str]]):  In output order.  A str is a float32 band.
+            export_radius (int):
+            properties (Optional[Dict[str, str]]):  Scalar properties to export with the tiles, e.g. ids
+                or labels, and their dtype: 'float32', 'int64' or 'string'.
+        """
+        self.bands = [BandSpec(band) if isinstance(band, str) else band for band in bands]
+        self.export_radius = export_radius
+        self.properties = dict(properties) if properties is not None else {}
+        names = self.band_names + list(self.properties)
+        if len(set(names)) != len(names):
+            raise TileSchemaError('Duplicate band or property names: {}'.format(names))
+
+    @property
+    def band_names(self):
+        return [band.name for band in self.bands]
+
+    @property
+    def shape(self):
+        size = 2 * self.export_radius + 1
+        return [size, size]
+
+    @property
+    def selectors(self):
+        """The export selectors, the bands and properties of the schema."""
+        return self.band_names + sorted(self.properties)
+
+    def band(self, name):
+        for band in self.bands:
+            if band.name == name:
+                return band
+        raise TileSchemaError('Band {} is not in the schema.'.format(name))
+
+    def cast(self, img):
+        """
+        Args:
+            img (ee.Image):
+        Returns:
+            (ee.Image):  The bands of the schema, in order and cast to their dtype.  Other bands are dropped.
+        """
+        return imgtools.concat_bands([band.cast(img) for band in self.bands])
+
+    def parse_spec(self):
+        """
+        Returns:
+            (Dict[str, Dict[str, Any]]):  How every feature is stored in the exported TFRecord files:
+                its stored 'dtype' ('int64', 'float32' or 'string'), 'shape', and for bands the 'scale' and
+                'offset' to apply, e.g. to build tf.io.FixedLenFeature(shape, dtype) parsers.
+        """
+        spec = {}
+        for band in self.bands:
+            spec[band.name] = {
+                'dtype': 'int64' if band.is_integer else 'float32',
+                'shape': self.shape,
+                'scale': band.scale,
+                'offset': band.offset,
+            }
+        for name, dtype in self.properties.items():
+            spec[name] = {'dtype': dtype, 'shape': []}
+        return spec
+
+    def to_dict(self):
+        return {
+            'bands': [band.to_dict() for band in self.bands],
+            'export_radius': self.export_radius,
+            'properties': self.properties,
+        }
+
+    @staticmethod
+    def from_dict(d):
+        return TileSchema([BandSpec.from_dict(band) for band in d['bands']], d['export_radius'], d.get('properties'))
+
+    def __repr__(self):
+        return 'TileSchema({} bands, export_radius={})'.format(len(self.bands), self.export_radius)
@@ -1,6 +1,8 @@
 import ee
 import json
 import re
+import collections
+from concurrent import futures
 from gee_tools.googlecloud import list_objects as lobjs
 
 
@@ -17,6 +19,143 @@ def asset_exists(asset_id):
     return ee.data.getInfo(asset_id) != None
 
 
+def asset_id_of(asset):
+    """
+    :param asset: asset metadata, as returned by ee.data.listAssets
+    :return: the asset id, e.g. "users/georgeazzari/eedir/myasset"
+    """
+    if 'id' in asset:
+        return asset['id']
+    return re.sub('^projects/earthengine-legacy/assets/', '', asset['name'])
+
+
+def is_not_found(error):
+    """
+    :param error: an ee.EEException
+    :return: True if the error says that an asset does not exist
+    """
+    message = str(error).lower()
+    return 'not found' in message or 'does not exist' in message
+
+
+class AssetAPI(object):
+    """
+    The asset operations used by the export cache, implemented with ee.data.
+    LocalAssetAPI implements the same methods in memory.
+    """
+
+    def list_assets(self, parent):
+        """
+        :param parent: id of a folder or image collection
+        :return: the metadata of the assets in parent, as returned by ee.data.listAssets.
+            Empty if parent does not exist.
+        """
+        try:
+            return ee.data.listAssets({'parent': parent}).get('assets', [])
+        except ee.EEException as e:
+            # Permission, quota and transient errors must not look like an empty folder.
+            if is_not_found(e):
+                return []
+            raise
+
+    def set_properties(self, asset_id, properties):
+        """
+        :param asset_id:
+        :param properties: dict of properties to update, a value of None deletes the property
+        """
+        ee.data.setAssetProperties(asset_id, properties)
+
+    def delete_asset(self, asset_id):
+        ee.data.deleteAsset(asset_id)
+
+
+class LocalAssetAPI(AssetAPI):
+    """
+    In memory stand-in for the GEE asset API, e.g. for tests.
+    Folders are implied by the ids of the assets they contain.
+    """
+
+    def __init__(self):
+        self.assets = dict()
+
+    def add_asset(self, asset_id, size_bytes=0, properties=None, asset_type='IMAGE'):
+        """
+        :param asset_id:
+        :param size_bytes: reported as the sizeBytes field, a string like in the Cloud API
+        :param properties: dict of asset properties
+        :param asset_type: e.g. IMAGE or TABLE
+        """
+        self.assets[asset_id] = {
+            'id': asset_id,
+            'name': 'projects/earthengine-legacy/assets/' + asset_id,
+            'type': asset_type,
+            'sizeBytes': str(size_bytes),
+            'properties': dict(properties or {}),
+        }
+
+    def list_assets(self, parent):
+        parent = parent.rstrip('/')
+        children = dict()
+        for asset_id, asset in self.assets.items():
+            if not asset_id.startswith(parent + '/'):
+                continue
+            child = asset_id[len(parent) + 1:].split('/')[0]
+            if '/' in asset_id[len(parent) + 1:]:
+                children.setdefault(child, {'id': parent + '/' + child, 'type': 'FOLDER'})
+            else:
+                children[child] = dict(asset, properties=dict(asset['properties']))
+        return [children[child] for child in sorted(children)]
+
+    def set_properties(self, asset_id, properties):
+        if asset_id not in self.assets:
+            raise ee.EEException('Asset {} does not exist.'.format(asset_id))
+        asset_properties = self.assets[asset_id]['properties']
+        for key, value in properties.items():
+            if value is None:
+                asset_properties.pop(key, None)
+            else:
+                asset_properties[key] = value
+
+    def delete_asset(self, asset_id):
+        if asset_id not in self.assets:
+            raise ee.EEException('Asset {} does not exist.'.format(asset_id))
+        del self.assets[asset_id]
+
+
+def get_assets(asset_ids, max_workers=8, api=None):
+    """
+    Look up the metadata (including properties) of many assets with one listAssets call
+    per parent folder, made concurrently.
+
+    :param asset_ids: iterable of asset ids, e.g. "users/georgeazzari/eedir/myasset"
+    :param max_workers: maximum number of concurrent listAssets calls
+    :param api: an AssetAPI, defaults to the GEE asset API
+    :return: dict mapping the asset ids that exist to their metadata, as returned by ee.data.listAssets
+    """
+    api = AssetAPI() if api is None else api
+
+    def list_assets(parent):
+        # Maps the name (last path component) of the assets in parent to their metadata.
+        return {asset_id_of(asset).split('/')[-1]: asset for asset in api.list_assets(parent)}
+
+    by_parent = collections.defaultdict(list)
+    for asset_id in asset_ids:
+        parent, _, name = asset_id.rstrip('/').rpartition('/')
+        by_parent[parent].append((asset_id, name))
+    if len(by_parent) == 0:
+        return {}
+
+    parents = list(by_parent.keys())
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(parents)))) as executor:
+        listed = executor.map(list_assets, parents)
+        return {
+            asset_id: assets[name]
+            for parent, assets in zip(parents, listed)
+            for asset_id, name in by_parent[parent]
+            if name in assets
+        }
+
+
 def upload_asset_core(gsfilepath, eefolderpath, nodata=-32768):
     """
     Upload and ingest asset in EE starting from its path in Google Cloud Storage.
@@ -26,6 +26,21 @@ class ImageDatasource(object):
         """Return one image collection"""
         raise NotImplementedError
 
+    def get_img_coll_bands(self, bands):
+        """
+        Return get_img_coll() restricted to bands, in that order.
+
+        Datasources that derive many bands (indices, QA maps, textures...) override this to
+        only build the expressions needed for bands and their dependencies.
+        By default everything is built and the other bands are dropped.
+
+        Args:
+            bands (List[str]):  Band names of the collection.
+        Returns:
+            (ee.ImageCollection):
+        """
+        return self.get_img_coll().select(list(bands))
+
 
 class MultiImageDatasource(ImageDatasource):
 
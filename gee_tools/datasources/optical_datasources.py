@@ -271,6 +271,54 @@ class LandsatSR(MultiImageDatasource):
     def get_img_coll(self):
         return self.mergedqam
 
+    # Scale factors applied by rescale_l8 and rescale_l57, bands that are not listed are not rescaled.
+    L8_SCALES = dict([(b, 0.0001) for b in ['AEROS', 'BLUE', 'GREEN', 'RED', 'NIR', 'SWIR1', 'SWIR2']] +
+                     [(b, 0.1) for b in ['TEMP1', 'TEMP2']])
+    L57_SCALES = dict([(b, 0.0001) for b in ['BLUE', 'GREEN', 'RED', 'NIR', 'SWIR1', 'SWIR2']] +
+                      [('sr_atmos_opacity', 0.001), ('TEMP1', 0.1)])
+
+    def get_img_coll_bands(self, bands):
+        """
+        Same as get_img_coll().select(bands), but only bands are rescaled, and the clear
+        pixel mask is computed from pixel_qa without decoding the other QA flags.
+
+        Args:
+            bands (List[str]):
+        Returns:
+            (ee.ImageCollection):
+        """
+        bands = list(bands)
+
+        def process(scales):
+            def _process(scene):
+                return self._rescale_bands(scene, bands, scales).updateMask(self._qaclear(scene))
+            return _process
+
+        l8 = self.init_coll8('LANDSAT/LC08/C01/T1_SR').map(self.rename_l8).map(process(self.L8_SCALES))
+        l7 = self.init_coll('LANDSAT/LE07/C01/T1_SR').map(self.rename_l57).map(process(self.L57_SCALES))
+        l5 = self.init_coll('LANDSAT/LT05/C01/T1_SR').map(self.rename_l57).map(process(self.L57_SCALES))
+        return ee.ImageCollection(l5.merge(l7).merge(l8)).sort('system:time_start')
+
+    @staticmethod
+    def _rescale_bands(scene, bands, scales):
+        """Select bands, rescaling them as rescale_l8 or rescale_l57 would."""
+        by_factor = {}
+        for band in bands:
+            by_factor.setdefault(scales.get(band, None), []).append(band)
+        parts = [
+            scene.select(group) if factor is None else scene.select(group).multiply(factor)
+            for factor, group in by_factor.items()
+        ]
+        scaled = ee.Image(ee.Image.cat(parts).select(bands).copyProperties(scene))
+        # System properties are not copied (?)
+        return scaled.set('system:time_start', scene.get('system:time_start'))
+
+    @staticmethod
+    def _qaclear(scene):
+        """The pxqa_clear band of decode_qamask_l8 and decode_qamask_l57."""
+        clear = scene.select('pixel_qa').bitwiseAnd(2).neq(0)
+        return clear.updateMask(clear)
+
     def init_coll(self, name):
         return ee.ImageCollection(name).filterBounds(self.filterpoly).filterDate(self.s, self.e).map(self.rename_l57)
 
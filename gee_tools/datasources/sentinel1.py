@@ -1,11 +1,18 @@
 import numpy as np
 import ee
 from gee_tools.datasources.interface import MultiImageDatasource
+from gee_tools.datasources.util import requested
 from gee_tools.imgtools import appendBand, getGLCMTexture
 
 
 class Sentinel1(MultiImageDatasource):
 
+    # Back-scatter bands, see getPolBands.
+    POL_BANDS = ['VV', 'VH', 'HH', 'HV']
+    # Bands added by addBands, without and with the speckle filter suffix.
+    EXTRA_BANDS = ['DIFF', 'RATIO']
+    SPECKLE_EXTRA_BANDS = ['DIFF_RLSPCK', 'RATIO_RLSPCK']
+
     def build_img_coll(self, correctlia=False, addbands=True, addspeckle=True, addtexture=False, orbit='ascending'):
         """
 
@@ -43,6 +50,78 @@ class Sentinel1(MultiImageDatasource):
         addtexture = self._addtexture if addtexture is None else addtexture
         orbit = self._orbit if orbit is None else orbit
 
+        iw = self._filter_iw(orbit, correctlia)
+
+        if addspeckle:
+            iw = iw.map(lambda img: self.RefinedLeeMulti(img))
+
+        if addbands:
+            iw = iw.map(lambda img: self.addBands(img, ''))
+
+            if addspeckle:
+                iw = iw.map(lambda img: self.addBands(img, '_RLSPCK'))
+
+        if addtexture:
+            iw = iw.map(lambda img: img.addBands(self.getS1Texture(img, 4, '')))
+
+            if addspeckle:
+                iw = iw.map(lambda img: img.addBands(self.getS1Texture(img, 4, '_RLSPCK')))
+
+        return iw
+
+    def get_img_coll_bands(self, bands, correctlia=None, addbands=None, addspeckle=None, addtexture=None,
+                           orbit=None):
+        """
+        Same as get_img_coll(correctlia, addbands, addspeckle, addtexture, orbit).select(bands), but the
+        speckle filter only runs on the polarizations needed for bands, and DIFF and RATIO bands
+        are only computed if they are in bands.
+        Texture bands are not pushed down: with addtexture, get_img_coll is used as is.
+
+        Args:
+            bands (List[str]):
+            correctlia, addbands, addspeckle, addtexture, orbit:  See get_img_coll.
+        Returns:
+            (ee.ImageCollection):
+        """
+        correctlia = self._correctlia if correctlia is None else correctlia
+        addbands = self._addbands if addbands is None else addbands
+        addspeckle = self._addspeckle if addspeckle is None else addspeckle
+        addtexture = self._addtexture if addtexture is None else addtexture
+        orbit = self._orbit if orbit is None else orbit
+        bands = list(bands)
+
+        speckle_bands = [b + '_RLSPCK' for b in self.POL_BANDS]
+        known = self.POL_BANDS + ['angle'] + (['LIA'] if correctlia else [])
+        if addspeckle:
+            known += speckle_bands
+        if addbands:
+            known += self.EXTRA_BANDS + (self.SPECKLE_EXTRA_BANDS if addspeckle else [])
+        if addtexture or not set(bands).issubset(known):
+            return self.get_img_coll(correctlia, addbands, addspeckle, addtexture, orbit).select(bands)
+
+        iw = self._filter_iw(orbit, correctlia)
+
+        # The polarizations to speckle filter, including the ones DIFF_RLSPCK and RATIO_RLSPCK are computed from.
+        polbands = [b for b in self.POL_BANDS if b + '_RLSPCK' in bands]
+        if addbands and requested(bands, self.SPECKLE_EXTRA_BANDS):
+            polbands = sorted(set(polbands).union(['VV', 'VH']), key=self.POL_BANDS.index)
+
+        if addspeckle and len(polbands) > 0:
+            iw = iw.map(lambda img: self.RefinedLeeMulti(img, polbands))
+
+        if addbands and requested(bands, self.EXTRA_BANDS):
+            iw = iw.map(lambda img: self.addBands(img, ''))
+
+        if addbands and addspeckle and requested(bands, self.SPECKLE_EXTRA_BANDS):
+            iw = iw.map(lambda img: self.addBands(img, '_RLSPCK'))
+
+        return iw.select(bands)
+
+    def _filter_iw(self, orbit, correctlia):
+        """
+        Filter the collection to high resolution IW images with a VH band in the orbit pass,
+        and apply the local incidence angle correction if correctlia.
+        """
         # Filter to get images from different look angles.
         if orbit == 'ascending':
             orbfilter = ee.Filter.eq('orbitProperties_pass', 'ASCENDING')
@@ -67,21 +146,6 @@ class Sentinel1(MultiImageDatasource):
             terrain = terrain.reproject('EPSG:4326', None, 10)
             iw = iw.map(lambda img: self.correctLIA(img, terrain.select('SLO'), terrain.select('ASP')))
 
-        if addspeckle:
-            iw = iw.map(lambda img: self.RefinedLeeMulti(img))
-
-        if addbands:
-            iw = iw.map(lambda img: self.addBands(img, ''))
-
-            if addspeckle:
-                iw = iw.map(lambda img: self.addBands(img, '_RLSPCK'))
-
-        if addtexture:
-            iw = iw.map(lambda img: img.addBands(self.getS1Texture(img, 4, '')))
-
-            if addspeckle:
-                iw = iw.map(lambda img: img.addBands(self.getS1Texture(img, 4, '_RLSPCK')))
-
         return iw
 
     @staticmethod
@@ -369,14 +433,18 @@ class Sentinel1(MultiImageDatasource):
 
         return self.toDB(spck.select([0], [band.cat('_RLSPCK')]))
 
-    def RefinedLeeMulti(self, dbimg):
+    def RefinedLeeMulti(self, dbimg, polbands=None):
         """
 
         :param dbimg:
+        :param polbands: the bands to filter, defaults to all back-scatter bands of dbimg (see getPolBands)
         :return:
         """
 
-        polbands = self.getPolBands(dbimg, '')
+        if polbands is None:
+            polbands = self.getPolBands(dbimg, '')
+        else:
+            polbands = ee.List(polbands)
 
         splist = polbands.map(lambda b: self._apply_rl(dbimg, b))
         spimg = ee.Image(ee.ImageCollection.fromImages(splist).iterate(appendBand))
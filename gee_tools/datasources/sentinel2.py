@@ -1,11 +1,29 @@
 import numpy as np
 import ee
 from gee_tools.datasources.interface import MultiImageDatasource, DatasourceError
+from gee_tools.datasources.util import requested
 from gee_tools.imgtools import appendBand, getGLCMTexture, addDOY
 
 
 class Sentinel2TOA(MultiImageDatasource):
 
+    # Bands of the renamed COPERNICUS/S2 images, see rename.
+    BASE_BANDS = ['AEROS', 'BLUE', 'GREEN', 'RED', 'RDED1', 'RDED2', 'RDED3',
+                  'NIR', 'RDED4', 'VAPOR', 'CIRRU', 'SWIR1', 'SWIR2', 'QA10',
+                  'QA20', 'QA60']
+    # Bands added by addAllQAMaps.
+    QA_MAP_BANDS = ['QA60_DECODED', 'DOY', 'QA_HOLLST', 'QA_FSEV1']
+    # Bands added by addSWVIs.
+    SWVI_BANDS = ['NBR1', 'NBR2', 'STI', 'NDTI', 'CRC']
+    # Bands added by every step of addRededgeExtras, in order.
+    REDEDGE_STEPS = [
+        ('addREIP', ['REIP']),
+        ('addChloropIndx', ['GCVI', 'RDGCVI1', 'RDGCVI2']),
+        ('addMTCI', ['MTCI', 'MTCI2']),
+        ('addWDRVI', ['WDRVI', 'GRWDRVI', 'RDWDRVI']),
+        ('addNDVI', ['RDNDVI1', 'RDNDVI2', 'NDVI', 'SNDVI']),
+    ]
+
     def build_img_coll(self, addVIs=True, addCloudMasks=True, corr_coeffs=None):
         """
         Args:
@@ -84,6 +102,56 @@ class Sentinel2TOA(MultiImageDatasource):
 
         return s2
 
+    def get_img_coll_bands(self, bands, addVIs=None, addCloudMasks=None, corr_coeffs=None):
+        """
+        Same as get_img_coll(addVIs, addCloudMasks, corr_coeffs).select(bands), but the QA maps
+        and indices are only computed if they are in bands.
+
+        Args:
+            bands (List[str]):
+            addVIs (Optional[bool]):  See get_img_coll.
+            addCloudMasks (Optional[bool]):  See get_img_coll.
+            corr_coeffs (Optional[pandas dataframe]):  See get_img_coll.
+        Returns:
+            (ee.ImageCollection):
+        """
+        addVIs = self._addVIs if addVIs is None else addVIs
+        addCloudMasks = self._addCloudMasks if addCloudMasks is None else addCloudMasks
+        corr_coeffs = self._corr_coeffs if corr_coeffs is None else corr_coeffs
+        bands = list(bands)
+
+        known = list(self.BASE_BANDS)
+        if addCloudMasks:
+            known += self.QA_MAP_BANDS
+        if addVIs:
+            known += self.SWVI_BANDS + [b for _, names in self.REDEDGE_STEPS for b in names]
+        if not set(bands).issubset(known):
+            # Let select raise the usual error for unknown bands.
+            return self.get_img_coll(addVIs, addCloudMasks, corr_coeffs).select(bands)
+
+        s2 = self.coll
+
+        if addCloudMasks and requested(bands, self.QA_MAP_BANDS):
+            s2 = s2.map(self.addAllQAMaps)
+
+        if corr_coeffs is not None:
+            s2 = s2.map(lambda image: self.correctBands(image, corr_coeffs))
+
+        if addVIs:
+            # Base bands are in reflectance units whenever VIs are added.
+            s2 = s2.map(self.refl_scale)
+            if requested(bands, self.SWVI_BANDS):
+                s2 = s2.map(self.addSWVIs)
+            steps = [getattr(self, step) for step, names in self.REDEDGE_STEPS if requested(bands, names)]
+            if len(steps) > 0:
+                def add_rededge(img):
+                    for step in steps:
+                        img = step(img)
+                    return img
+                s2 = s2.map(add_rededge)
+
+        return s2.select(bands)
+
     def correctBands(self, img, corr_coeffs):
         
         bandnames = corr_coeffs['band'].values.tolist()
@@ -2,6 +2,8 @@ from calendar import monthrange
 
 import ee
 
+from gee_tools.imgtools import concat_bands, merge_collections
+
 
 def get_closest_to_date(img_coll, date):
 
@@ -19,6 +21,17 @@ def get_closest_to_date(img_coll, date):
     return ee.Image(img_coll.iterate(closest, img_coll.first()))
 
 
+def requested(bands, names):
+    """
+    Args:
+        bands (Iterable[str]):  The requested bands.
+        names (Iterable[str]):  The bands a processing step adds.
+    Returns:
+        (bool):  True if any band of names is requested, i.e. the step cannot be skipped.
+    """
+    return len(set(bands).intersection(names)) > 0
+
+
 def get_center_date(start_date, end_date):
     start_date = ee.Date(start_date)
     end_date = ee.Date(end_date)
@@ -52,34 +65,24 @@ def compute_monthly_seasonal_annual_and_long_running(base_img_coll, long_running
         bands.extend(_bands)
 
     for month in range(1, 12 + 1):
-        long_running_img_coll = None
-
-        for year in long_running_years:
-            img_coll = base_img_coll.filterDate(
+        long_running_img_coll = merge_collections([
+            base_img_coll.filterDate(
                 '{}-{:02d}-01'.format(year, month),
                 '{}-{:02d}-{}'.format(year, month, monthrange(year, month)[1])
             )
-
-            if long_running_img_coll is None:
-                long_running_img_coll = img_coll
-            else:
-                long_running_img_coll = long_running_img_coll.merge(img_coll)
+            for year in long_running_years
+        ])
 
         _process_img_coll(long_running_img_coll, 'month_{}_long_running_average'.format(month))
 
     for season, months in season_to_int_months.items():
-        long_running_img_coll = None
-
-        for year in long_running_years:
-            img_coll = base_img_coll.filterDate(
+        long_running_img_coll = merge_collections([
+            base_img_coll.filterDate(
                 '{}-{:02d}-01'.format(year, min(months)),
                 '{}-{:02d}-{}'.format(year, max(months), monthrange(year, max(months))[1])
             )
-
-            if long_running_img_coll is None:
-                long_running_img_coll = img_coll
-            else:
-                long_running_img_coll = long_running_img_coll.merge(img_coll)
+            for year in long_running_years
+        ])
 
         _process_img_coll(long_running_img_coll, '{}_long_running_average'.format(season))
 
@@ -89,9 +92,7 @@ def compute_monthly_seasonal_annual_and_long_running(base_img_coll, long_running
     )
     _process_img_coll(long_running_img_coll, 'long_running_average')
 
-    # Final computation
-    final_img = imgs.pop()
-    for img in imgs:
-        final_img = final_img.addBands(img)
+    # Final computation, the last image first as it carries the properties of the result.
+    final_img = concat_bands(imgs[-1:] + imgs[:-1])
 
     return final_img, bands
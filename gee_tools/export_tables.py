@@ -9,6 +9,8 @@ Edited by: Shruti Jain
 
 import ee
 
+from gee_tools.exports.sharding import add_grid_cell, map_groups, SHARD_PROPERTY
+
 
 def export_features(features, fname, export_to='drive', bucket_name=None):
 
@@ -47,15 +49,58 @@ def get_point(image, point, scale, depth):
     })
 
 
-def reducegrid_core(image, grid, scale):
+def reducegrid_batched(image, grid, scale, cell_size=None):
+    """
+    Reduce image at all points of grid with reduceRegions, instead of one reduceRegion call per point.
+    The samples have the same properties as the ones of get_point: the first value of every band,
+    the properties of image and of the point, PTLON and PTLAT, and no geometry.
+
+    Args:
+        image (ee.Image):
+        grid (ee.FeatureCollection):  Points.
+        scale (Union[int, float]):
+        cell_size (Optional[float]):  If given, every grid cell of cell_size degrees is reduced by its
+            own reduceRegions call, see gee_tools.exports.sharding.map_groups.
+    Returns:
+        (ee.FeatureCollection):
+    """
+    band_names = image.bandNames()
+    # Outputs are named after the bands, even for single band images.
+    reducer = ee.Reducer.first().forEachBand(image)
+
+    def reduce(points):
+        return image.reduceRegions(collection=points, reducer=reducer, scale=scale, tileScale=16)
+
+    def to_sample(feature):
+        coords = ee.List(feature.geometry().coordinates())
+        exclude = [SHARD_PROPERTY] if cell_size is not None else None
+        sample = ee.Feature(None).copyProperties(image, None, band_names).copyProperties(feature, None, exclude)
+        return ee.Feature(sample).set({
+            'PTLON': ee.Number(coords.get(0)),
+            'PTLAT': ee.Number(coords.get(1))
+        })
+
+    if cell_size is None:
+        samples = reduce(grid)
+    else:
+        samples = map_groups(add_grid_cell(grid, cell_size), SHARD_PROPERTY, lambda group, cell: reduce(group))
+
+    return samples.map(to_sample)
+
+
+def reducegrid_core(image, grid, scale, batched=False, cell_size=None):
+    """If batched, see reducegrid_batched, otherwise the grid is mapped with one get_point per point."""
+    if batched:
+        return reducegrid_batched(image, grid, scale, cell_size)
     depth = image.bandNames().length()
     samples = grid.map(lambda point: get_point(image, point, scale, depth))
     return samples
 
 
-def reducegrid_image(image, grid, scale, control, doexport, fname, export_to='drive', bucket_name=None):
+def reducegrid_image(image, grid, scale, control, doexport, fname, export_to='drive', bucket_name=None,
+                     batched=False, cell_size=None):
 
-    samples = reducegrid_core(image, grid, scale)
+    samples = reducegrid_core(image, grid, scale, batched, cell_size)
 
     if doexport:
         t = export_features(samples, fname, export_to=export_to, bucket_name=bucket_name)
@@ -65,10 +110,11 @@ def reducegrid_image(image, grid, scale, control, doexport, fname, export_to='dr
         return samples
 
 
-def reducegrid_imgcoll(imagecoll, grid, scale, control, doexport, fname, export_to='drive', bucket_name=None):
+def reducegrid_imgcoll(imagecoll, grid, scale, control, doexport, fname, export_to='drive', bucket_name=None,
+                       batched=False, cell_size=None):
 
     samples = imagecoll.map(
-       lambda image: reducegrid_core(image, grid, scale)
+       lambda image: reducegrid_core(image, grid, scale, batched, cell_size)
     ).flatten()
   
     samples = samples.filter(ee.Filter.neq(control, None))
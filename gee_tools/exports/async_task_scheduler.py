@@ -0,0 +1,212 @@
+"""
+An asyncio front end for the TaskScheduler.
+
+Status lookups and task.start() calls are blocking RPCs, so they are
+run in an executor while the event loop keeps serving other coroutines.
+"""
+import time
+import asyncio
+
+import ee
+
+from gee_tools.exports.concurrency import ConcurrencyController, FixedConcurrency
+from gee_tools.exports.task_scheduler import (
+    TaskScheduler, TaskSchedulerError, Job, batch_task_status, _backoff_sleep_times, _DependencyTracker
+)
+
+
+class AsyncTaskScheduler(TaskScheduler):
+    """
+    A TaskScheduler whose run, wait_for_existing_tasks and _wait_any_tasks
+    methods have coroutine counterparts.  Several schedulers can be run on the
+    same event loop, e.g. with asyncio.gather, and share a global concurrency
+    cap by passing them the same asyncio.Semaphore.
+    """
+
+    @staticmethod
+    async def _in_executor(fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, fn, *args)
+
+    @staticmethod
+    async def wait_for_existing_tasks_async(sleep_time=120.0, verbose=0, min_sleep_time=None):
+        """
+        Coroutine version of TaskScheduler.wait_for_existing_tasks.
+        Waits until all tasks have finished in the currently authenticated GEE account.
+        """
+        def task_is_queued(task):
+            status = task.config.get('state', None)
+            return status in [task.State.READY, task.State.RUNNING]
+
+        tasks = await AsyncTaskScheduler._in_executor(ee.batch.Task.list)
+        jobs = [
+            Job(task=task, jid=i, dependencies=[], started=True)
+            for i, task in enumerate(tasks)
+            if task_is_queued(task)
+        ]
+        while len(jobs) > 0:
+            jobs, _finished = await AsyncTaskScheduler._wait_any_tasks_async(
+                jobs, sleep_time=sleep_time, status_fn=batch_task_status, min_sleep_time=min_sleep_time
+            )
+            if verbose > 0:
+                print('Tasks remaining: {}'.format(len(jobs)))
+
+    @staticmethod
+    async def _wait_any_tasks_async(jobs, sleep_time=120.0, status_fn=None, min_sleep_time=None, wake_fn=None,
+                                    metrics=None):
+        """
+        Coroutine version of TaskScheduler._wait_any_tasks.
+
+        Args:
+            wake_fn (Optional[Callable[[], bool]]):  Called once after every poll,
+                return early if it returns True even if no job has finished.
+            metrics (Optional[SchedulerMetrics]):  Records every poll.
+        Returns:
+            (Tuple[List[Job], List[Job]]):  The running and the finished jobs.
+        """
+        if len(jobs) == 0:
+            return [], []
+        sleep_times = _backoff_sleep_times(sleep_time, min_sleep_time)
+        while True:
+            await AsyncTaskScheduler._in_executor(TaskScheduler._poll_jobs, jobs, status_fn, metrics)
+            running_tasks = [job for job in jobs if not job._finished]
+            finished_tasks = [job for job in jobs if job._finished]
+            woken = wake_fn is not None and wake_fn()
+            if len(finished_tasks) > 0 or woken:
+                return running_tasks, finished_tasks
+
+            await asyncio.sleep(next(sleep_times))
+
+    async def run_async(self, max_processes=8, sleep_time=120.0, verbose=0,
+                        error_on_fail=False, status_fn=None, min_sleep_time=None,
+                        semaphore=None, journal=None, metrics=None):
+        """
+        Coroutine version of TaskScheduler.run.
+        Runs all tasks in order of dependency, starting all tasks that
+        are ready concurrently.  If a task fails, its dependents will not be run.
+
+        Args:
+            max_processes (Union[int, ConcurrencyController]):  The maximum number of tasks from this
+                scheduler that are allowed to run simultaneously.
+            sleep_time (float):  See TaskScheduler.run
+            verbose (int):  See TaskScheduler.run
+            error_on_fail (bool):  raises an error if any task fails.
+            status_fn (Optional[Callable[[List[ee.batch.Task]], List[Dict[str, Any]]]]):  See TaskScheduler.run
+            min_sleep_time (Optional[float]):  See TaskScheduler.run
+            semaphore (Optional[asyncio.Semaphore]):  A semaphore shared between schedulers running on the
+                same event loop.  Each running task holds one slot, which caps the total number of running
+                tasks across all schedulers.
+            journal (Optional[TaskJournal]):  See TaskScheduler.run
+            metrics (Optional[SchedulerMetrics]):  See TaskScheduler.run
+        Returns:
+            (List[ee.batch.Task]):  All tasks, including finished tasks.
+        """
+        if len(self.tasks) == 0:
+            raise TaskSchedulerError('Tried to run tasks with no tasks')
+        self._validate()
+        if journal is not None:
+            journal.record_jobs(self.tasks.values())
+        if not isinstance(max_processes, ConcurrencyController):
+            max_processes = FixedConcurrency(max_processes)
+        if metrics is not None:
+            metrics.run_started(max_processes.limit)
+            try:
+                return await self._run_async(max_processes, sleep_time, verbose, error_on_fail,
+                                             status_fn, min_sleep_time, semaphore, journal, metrics)
+            finally:
+                metrics.run_finished()
+        return await self._run_async(max_processes, sleep_time, verbose, error_on_fail,
+                                     status_fn, min_sleep_time, semaphore, journal, metrics)
+
+    async def _run_jobs(self, tracker, running, holding, concurrency, sleep_time, verbose, error_on_fail,
+                        status_fn, min_sleep_time, semaphore, journal, metrics):
+        if semaphore is not None:
+            # Reattached jobs take the free slots, those that do not fit run without one.
+            for job in running:
+                if semaphore.locked():
+                    break
+                await semaphore.acquire()
+                holding.add(job.jid)
+        sleep_times = _backoff_sleep_times(sleep_time, min_sleep_time)
+
+        def has_free_slot():
+            return semaphore is not None and not semaphore.locked()
+
+        while True:
+            tracker.release_retries(time.time())
+            to_start = []
+            while len(running) + len(to_start) < concurrency.limit:
+                if semaphore is not None and semaphore.locked():
+                    break
+                job = tracker.pop_ready()
+                if job is None:
+                    break
+                if semaphore is not None:
+                    await semaphore.acquire()
+                    holding.add(job.jid)
+                to_start.append(job)
+
+            if len(to_start) > 0:
+                await asyncio.gather(*[self._in_executor(job.start) for job in to_start])
+                running.extend(to_start)
+                for job in to_start:
+                    self._job_started(job, verbose=verbose, journal=journal, metrics=metrics)
+                sleep_times = _backoff_sleep_times(sleep_time, min_sleep_time)
+            if metrics is not None:
+                metrics.sample(len(tracker.ready), len(running), concurrency.limit)
+
+            waiting_for_slot = len(tracker.ready) > 0 and len(running) < concurrency.limit
+            next_retry_time = tracker.next_retry_time()
+            if len(running) == 0:
+                if waiting_for_slot:
+                    # Every slot of the shared semaphore is held by other schedulers.
+                    await asyncio.sleep(next(sleep_times))
+                elif next_retry_time is not None:
+                    await asyncio.sleep(max(next_retry_time - time.time(), 0.0))
+                else:
+                    break
+                continue
+
+            def wake_fn():
+                # Wake up early if a slot of the shared semaphore frees up while jobs are waiting for it,
+                # if the concurrency limit increases or if a job waiting for a retry becomes ready.
+                if concurrency.update(running, len(tracker.ready)) and len(tracker.ready) > 0:
+                    return True
+                if waiting_for_slot and has_free_slot():
+                    return True
+                return (next_retry_time is not None and len(running) < concurrency.limit and
+                        time.time() >= next_retry_time)
+
+            running, finished = await self._wait_any_tasks_async(
+                running, sleep_time=sleep_time, status_fn=status_fn, min_sleep_time=min_sleep_time,
+                wake_fn=wake_fn, metrics=metrics
+            )
+            for job in finished:
+                if job.jid in holding:
+                    holding.remove(job.jid)
+                    semaphore.release()
+            for job in finished:
+                self._job_finished(job, tracker, verbose=verbose, error_on_fail=error_on_fail,
+                                   journal=journal, metrics=metrics)
+
+    async def _run_async(self, concurrency, sleep_time, verbose, error_on_fail,
+                         status_fn, min_sleep_time, semaphore, journal, metrics):
+        tracker = _DependencyTracker(self.tasks, self.group_weights, metrics)
+        running = [job for job in self.tasks.values() if job._started and not job._finished]
+        # The jids of the jobs holding a slot of the semaphore, all of them are released on exit,
+        # including on errors and cancellation.
+        holding = set()
+        try:
+            await self._run_jobs(tracker, running, holding, concurrency, sleep_time, verbose, error_on_fail,
+                                 status_fn, min_sleep_time, semaphore, journal, metrics)
+        finally:
+            if semaphore is not None:
+                # Tasks that are still running keep running on GEE, but no longer count against the cap.
+                for _ in holding:
+                    semaphore.release()
+
+        if len(tracker) > 0:
+            # This should be unreachable since the dependency graph was validated.
+            raise TaskSchedulerError('{} jobs could not be run'.format(len(tracker)))
+
+        return [job.task for job in self.tasks.values()]
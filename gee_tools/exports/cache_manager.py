@@ -0,0 +1,188 @@
+"""
+Lifecycle of the cache assets exported by the ExportManager.
+
+Every cache asset records, as asset properties, the cache key of the computation it
+was exported from, when it was exported and when it was last used.  The CacheManager
+reads them back to keep the assets under a prefix within a size or count budget,
+evicting the least recently used first, and to delete orphans, i.e. cache assets
+no current configuration refers to.
+"""
+import time
+import logging
+
+from gee_tools.assetsmanager import AssetAPI, asset_id_of
+
+logger = logging.getLogger(__name__)
+
+# Asset property holding the fingerprint of the computation a cache asset was exported from.
+CACHE_KEY_PROPERTY = 'gee_tools_cache_key'
+# Asset properties holding when a cache asset was exported and last used, in seconds since the epoch.
+CACHE_CREATED_PROPERTY = 'gee_tools_cache_created'
+CACHE_LAST_USED_PROPERTY = 'gee_tools_cache_last_used'
+
+# Asset types that contain other assets.
+_CONTAINER_TYPES = ('FOLDER', 'Folder')
+
+
+class CacheEntry(object):
+    """A cache asset."""
+
+    def __init__(self, asset_id, size_bytes, cache_key, created, last_used):
+        self.asset_id = asset_id
+        self.size_bytes = size_bytes
+        self.cache_key = cache_key
+        self.created = created
+        self.last_used = last_used
+
+    @staticmethod
+    def from_asset(asset):
+        """
+        Args:
+            asset (Dict[str, Any]):  Asset metadata, as returned by ee.data.listAssets.
+        Returns:
+            (Optional[CacheEntry]):  None if the asset was not exported by the cache.
+        """
+        properties = asset.get('properties', None) or {}
+        cache_key = properties.get(CACHE_KEY_PROPERTY, None)
+        if cache_key is None:
+            return None
+        created = properties.get(CACHE_CREATED_PROPERTY, None)
+        created = float(created) if created is not None else 0.0
+        last_used = properties.get(CACHE_LAST_USED_PROPERTY, None)
+        last_used = float(last_used) if last_used is not None else created
+        return CacheEntry(asset_id_of(asset), int(asset.get('sizeBytes', 0) or 0), cache_key, created, last_used)
+
+    def __repr__(self):
+        return 'CacheEntry({}, {} bytes, last used {})'.format(self.asset_id, self.size_bytes, self.last_used)
+
+
+class CacheManager(object):
+    """
+    Tracks usage of the cache assets under a prefix and enforces a budget on them.
+    Only assets with a CACHE_KEY_PROPERTY are managed, other assets under the prefix are never touched.
+    """
+
+    def __init__(self, prefix, max_bytes=None, max_count=None, api=None, clock=time.time):
+        """
+        Args:
+            prefix (str):  The folder containing the cache assets, e.g. 'users/someone/cache'.
+                Sub folders are included.
+            max_bytes (Optional[int]):  The maximum total size of the cache assets.  None for no limit.
+            max_count (Optional[int]):  The maximum number of cache assets.  None for no limit.
+            api (Optional[AssetAPI]):  Defaults to the GEE asset API.  Pass a LocalAssetAPI for tests.
+            clock (Callable[[], float]):  Returns the current time in seconds.
+        """
+        self.prefix = prefix.rstrip('/')
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.api = AssetAPI() if api is None else api
+        self.clock = clock
+
+    def entries(self):
+        """
+        Returns:
+            (List[CacheEntry]):  All cache assets under the prefix.
+        """
+        entries = []
+        folders = [self.prefix]
+        while len(folders) > 0:
+            for asset in self.api.list_assets(folders.pop()):
+                if asset.get('type', None) in _CONTAINER_TYPES:
+                    folders.append(asset_id_of(asset))
+                    continue
+                entry = CacheEntry.from_asset(asset)
+                if entry is not None:
+                    entries.append(entry)
+        return entries
+
+    def usage(self):
+        """
+        Returns:
+            (Tuple[int, int]):  The number and total size in bytes of the cache assets.
+        """
+        entries = self.entries()
+        return len(entries), sum(entry.size_bytes for entry in entries)
+
+    def export_properties(self, cache_key):
+        """
+        Args:
+            cache_key (str):
+        Returns:
+            (Dict[str, Any]):  The properties to set on an image exported to the cache.
+        """
+        now = self.clock()
+        return {CACHE_KEY_PROPERTY: cache_key, CACHE_CREATED_PROPERTY: now, CACHE_LAST_USED_PROPERTY: now}
+
+    def touch(self, asset_ids):
+        """
+        Record that cache assets were used.
+
+        Args:
+            asset_ids (Iterable[str]):
+        """
+        now = self.clock()
+        for asset_id in asset_ids:
+            self.api.set_properties(asset_id, {CACHE_LAST_USED_PROPERTY: now})
+
+    def _delete(self, entries, dry_run, reason):
+        for entry in entries:
+            logger.info('{} {} ({})'.format('Would delete' if dry_run else 'Deleting', entry.asset_id, reason))
+            if not dry_run:
+                self.api.delete_asset(entry.asset_id)
+        return entries
+
+    def enforce_budget(self, protected=(), dry_run=False):
+        """
+        Delete the least recently used cache assets until the cache is within max_bytes and max_count.
+
+        Args:
+            protected (Iterable[str]):  Asset ids that must not be deleted, e.g. the ones about to be read.
+                The budget may be exceeded if the protected assets alone exceed it.
+            dry_run (bool):  If True, nothing is deleted.
+        Returns:
+            (List[CacheEntry]):  The evicted cache assets.
+        """
+        protected = set(protected)
+        entries = self.entries()
+        count = len(entries)
+        total_bytes = sum(entry.size_bytes for entry in entries)
+
+        def over_budget():
+            return ((self.max_count is not None and count > self.max_count) or
+                    (self.max_bytes is not None and total_bytes > self.max_bytes))
+
+        evicted = []
+        candidates = sorted(
+            (entry for entry in entries if entry.asset_id not in protected),
+            key=lambda entry: (entry.last_used, entry.created, entry.asset_id)
+        )
+        for entry in candidates:
+            if not over_budget():
+                break
+            evicted.append(entry)
+            count -= 1
+            total_bytes -= entry.size_bytes
+        if over_budget():
+            logger.warning('The protected cache assets alone exceed the budget of {}'.format(self.prefix))
+        return self._delete(evicted, dry_run, 'least recently used')
+
+    def collect_garbage(self, live_asset_ids, min_age=86400.0, dry_run=False):
+        """
+        Delete orphans: cache assets that are not in live_asset_ids.
+
+        Args:
+            live_asset_ids (Iterable[str]):  The cache assets still in use,
+                e.g. from ExportManager.get_cache_asset_ids for every current configuration.
+            min_age (float):  Orphans exported or used less than min_age seconds ago are kept,
+                so that assets of concurrent runs are not deleted.  Defaults to one day.
+            dry_run (bool):  If True, nothing is deleted.
+        Returns:
+            (List[CacheEntry]):  The deleted orphans.
+        """
+        live_asset_ids = set(live_asset_ids)
+        cutoff = self.clock() - min_age
+        orphans = [
+            entry for entry in self.entries()
+            if entry.asset_id not in live_asset_ids and max(entry.created, entry.last_used) <= cutoff
+        ]
+        return self._delete(orphans, dry_run, 'orphan')
@@ -0,0 +1,116 @@
+"""
+Controllers for the number of tasks a TaskScheduler keeps submitted to GEE.
+
+Pass a controller as the max_processes argument of TaskScheduler.run.
+"""
+import time
+
+import ee
+
+
+class ConcurrencyController(object):
+    """
+    Interface for concurrency controllers.
+    The scheduler starts tasks while fewer than limit tasks are running.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+
+    def update(self, jobs, queue_depth):
+        """
+        Called after every status lookup.
+
+        Args:
+            jobs (List[Job]):  The started jobs, with their latest status.  May contain finished jobs.
+            queue_depth (int):  The number of jobs that are ready to start.
+        Returns:
+            (bool):  True if the limit increased.
+        """
+        return False
+
+
+class FixedConcurrency(ConcurrencyController):
+    """A constant limit, equivalent to passing an int as max_processes."""
+    pass
+
+
+class AIMDConcurrency(ConcurrencyController):
+    """
+    Additive-increase / multiplicative-decrease controller that keeps the GEE queue just saturated.
+
+    GEE only runs a limited number of tasks per account at a time, the rest wait in the READY state.
+    While every submitted task starts RUNNING within ready_threshold seconds, GEE has spare capacity:
+    if all slots are used and more jobs are ready, the limit increases by increase every
+    increase_interval seconds.  As soon as a task waits READY for longer than ready_threshold seconds,
+    the GEE queue is saturated and the limit is multiplied by decrease_factor, at most once per cooldown.
+    """
+
+    def __init__(self, min_processes=1, max_processes=64, initial=8, increase=1, decrease_factor=0.5,
+                 ready_threshold=300.0, increase_interval=60.0, cooldown=None, clock=time.time):
+        """
+        Args:
+            min_processes (int):  Lower bound for the limit.
+            max_processes (int):  Upper bound for the limit.
+            initial (int):  The starting limit.
+            increase (int):  Added to the limit on every increase.
+            decrease_factor (float):  Between 0 and 1, the limit is multiplied by it on every decrease.
+            ready_threshold (float):  Seconds a task may stay READY before GEE is considered saturated.
+            increase_interval (float):  Minimum number of seconds between two changes before an increase.
+            cooldown (Optional[float]):  Minimum number of seconds between two decreases.
+                Defaults to ready_threshold, so that the effect of a decrease can be observed first.
+            clock (Callable[[], float]):  Returns the current time in seconds.
+        """
+        if not 1 <= min_processes <= initial <= max_processes:
+            raise ValueError('Expected 1 <= min_processes <= initial <= max_processes, got {}, {}, {}'.format(
+                min_processes, initial, max_processes
+            ))
+        if not 0 < decrease_factor < 1:
+            raise ValueError('decrease_factor must be between 0 and 1, got {}'.format(decrease_factor))
+        super(AIMDConcurrency, self).__init__(initial)
+        self.min_processes = min_processes
+        self.max_processes = max_processes
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.ready_threshold = ready_threshold
+        self.increase_interval = increase_interval
+        self.cooldown = ready_threshold if cooldown is None else cooldown
+        self.clock = clock
+        self.history = [(clock(), initial)]
+        self._first_seen = dict()
+        self._last_change = clock()
+        self._last_decrease = None
+
+    def _set_limit(self, limit, now):
+        self.limit = limit
+        self._last_change = now
+        self.history.append((now, limit))
+
+    def update(self, jobs, queue_depth):
+        now = self.clock()
+        longest_ready = 0.0
+        num_running = 0
+        for job in jobs:
+            if job._finished:
+                self._first_seen.pop(id(job.task), None)
+                continue
+            num_running += 1
+            # Keyed by task since a job gets a new task when it is retried.
+            first_seen = self._first_seen.setdefault(id(job.task), now)
+            state = None if job.last_status is None else job.last_status['state']
+            if state != ee.batch.Task.State.RUNNING:
+                longest_ready = max(longest_ready, now - first_seen)
+
+        if longest_ready > self.ready_threshold:
+            if self._last_decrease is None or now - self._last_decrease >= self.cooldown:
+                limit = max(self.min_processes, int(self.limit * self.decrease_factor))
+                if limit != self.limit:
+                    self._set_limit(limit, now)
+                self._last_decrease = now
+            return False
+
+        saturated = num_running >= self.limit and queue_depth > 0
+        if saturated and self.limit < self.max_processes and now - self._last_change >= self.increase_interval:
+            self._set_limit(min(self.max_processes, self.limit + self.increase), now)
+            return True
+        return False
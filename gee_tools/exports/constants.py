@@ -1,2 +1,6 @@
 DATE_STR_FORMAT = "%Y-%m-%d"
-EPSG3857 = 'EPSG:3857'
\ No newline at end of file
+EPSG3857 = 'EPSG:3857'
+EPSG4326 = 'EPSG:4326'
+# ImageSpec projection to sample every point in the UTM zone it falls in, see ee_tf_exports.get_array_patches_by_zone.
+# Images are not reprojected, so it can only be used to sample tiles.
+UTM = 'UTM'
@@ -0,0 +1,158 @@
+"""
+Rough estimates of the EE compute an export will consume, computed without submitting anything.
+
+The estimate walks the serialized expression graph of the scene, and of every datasource on
+its own, to count function invocations and request bytes, and looks up the number of images
+of every collection, the area of the region and the number of points with a single getInfo call.
+See ExportManager.estimate_cost.
+"""
+import json
+import collections
+
+import ee
+
+# Bytes per band and pixel of the output, assuming float32 bands.
+BYTES_PER_BAND = 4
+
+
+def graph_stats(encoded):
+    """
+    Count the function invocations in a serialized expression graph.
+
+    Args:
+        encoded (Any):  The result of ee.serializer.encode(obj, for_cloud_api=True).
+    Returns:
+        (collections.Counter):  Maps function names to the number of times they are invoked.
+            Shared sub-graphs are serialized, and counted, once.
+    """
+    functions = collections.Counter()
+    stack = [encoded]
+    while len(stack) > 0:
+        value = stack.pop()
+        if isinstance(value, dict):
+            invocation = value.get('functionInvocationValue', None)
+            if isinstance(invocation, dict):
+                functions[invocation.get('functionName', invocation.get('functionReference', '?'))] += 1
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return functions
+
+
+def serialize(obj):
+    """
+    Args:
+        obj (ee.ComputedObject):
+    Returns:
+        (Tuple[int, collections.Counter]):  The size of the serialized request in bytes and the graph_stats.
+    """
+    encoded = ee.serializer.encode(obj, for_cloud_api=True)
+    return len(json.dumps(encoded, separators=(',', ':'))), graph_stats(encoded)
+
+
+class DatasourceCost(object):
+    """The cost of one datasource of a scene."""
+
+    def __init__(self, name, num_images, num_bands, request_bytes, num_invocations):
+        """
+        Args:
+            name (str):
+            num_images (int):  The number of images in the filtered collection.
+            num_bands (Optional[int]):  The number of output bands, None if unknown.
+            request_bytes (int):  The size of the serialized graph of the datasource image.
+            num_invocations (int):  The number of function invocations in that graph.
+        """
+        self.name = name
+        self.num_images = num_images
+        self.num_bands = num_bands
+        self.request_bytes = request_bytes
+        self.num_invocations = num_invocations
+
+    def summary(self):
+        return {
+            'name': self.name,
+            'num_images': self.num_images,
+            'num_bands': self.num_bands,
+            'request_bytes': self.request_bytes,
+            'num_invocations': self.num_invocations,
+        }
+
+    def __repr__(self):
+        return 'DatasourceCost({}, {} images, {} bands, {} bytes)'.format(
+            self.name, self.num_images, self.num_bands, self.request_bytes
+        )
+
+
+class CostEstimate(object):
+    """The estimated size of an export of a scene, or of tiles sampled from it."""
+
+    def __init__(self, datasources, num_bands, num_pixels, request_bytes, functions, num_points=None,
+                 export_radius=None):
+        """
+        Args:
+            datasources (List[DatasourceCost]):
+            num_bands (int):  The number of output bands.
+            num_pixels (float):  The number of output pixels per band.
+            request_bytes (int):  The size of the serialized request.
+            functions (collections.Counter):  See graph_stats.
+            num_points (Optional[int]):  The number of sampled points, None for a scene export.
+            export_radius (Optional[int]):  The tile radius in pixels, None for a scene export.
+        """
+        self.datasources = datasources
+        self.num_bands = num_bands
+        self.num_pixels = num_pixels
+        self.request_bytes = request_bytes
+        self.functions = functions
+        self.num_points = num_points
+        self.export_radius = export_radius
+
+    @property
+    def num_images(self):
+        """The number of images read by all datasources."""
+        return sum(ds.num_images for ds in self.datasources)
+
+    @property
+    def num_invocations(self):
+        return sum(self.functions.values())
+
+    @property
+    def output_bytes(self):
+        """The uncompressed size of the output, see BYTES_PER_BAND."""
+        return self.num_pixels * self.num_bands * BYTES_PER_BAND
+
+    def cache_candidates(self):
+        """
+        Returns:
+            (List[DatasourceCost]):  The datasources by decreasing number of images and graph size.
+                Expensive datasources read many images or have large composite graphs, and are the
+                first to consider for a cache_asset_id.
+        """
+        return sorted(self.datasources, key=lambda ds: (ds.num_images, ds.num_invocations), reverse=True)
+
+    def summary(self):
+        """
+        Returns:
+            (Dict[str, Any]):  The estimate as JSON serializable values.
+        """
+        return {
+            'num_datasources': len(self.datasources),
+            'num_images': self.num_images,
+            'num_bands': self.num_bands,
+            'num_pixels': self.num_pixels,
+            'output_bytes': self.output_bytes,
+            'request_bytes': self.request_bytes,
+            'num_invocations': self.num_invocations,
+            'num_points': self.num_points,
+            'export_radius': self.export_radius,
+            'datasources': [ds.summary() for ds in self.datasources],
+        }
+
+    def __repr__(self):
+        return 'CostEstimate({} datasources, {} images, {} bands, {:.3g} pixels, {} request bytes)'.format(
+            len(self.datasources), self.num_images, self.num_bands, self.num_pixels, self.request_bytes
+        )
+
+
+def tile_pixels(num_points, export_radius):
+    """The number of pixels per band sampled by sample_tiles."""
+    return num_points * (2 * export_radius + 1) ** 2
@@ -3,6 +3,7 @@ Author: Anthony Perez
 
 Defines the ExportManager class
 """
+import time
 import logging
 from enum import Enum as PythonEnum
 
@@ -10,12 +11,18 @@ import ee
 
 from gee_tools.datasources.generic_datasources import GenericSingleImageDatasource
 from gee_tools.datasources.interface import SingleImageDatasource
+from gee_tools.exports import sharding, cost_estimate, constants
 from gee_tools.exports.task_scheduler import TaskScheduler
 from gee_tools.exports.image_spec import ImageSpec, add_imagery
-from gee_tools.assetsmanager import asset_exists
+from gee_tools.exports.util import fingerprint
+from gee_tools.exports.cache_manager import CACHE_KEY_PROPERTY, CACHE_CREATED_PROPERTY, CACHE_LAST_USED_PROPERTY
+from gee_tools.assetsmanager import get_assets
 
 logger = logging.getLogger(__name__)
 
+# Number of characters of the cache key appended to content addressed cache asset ids.
+CACHE_KEY_LENGTH = 16
+
 
 class ExportManagerError(RuntimeError):
     pass
@@ -29,7 +36,7 @@ class ExportManager(object):
     different configurations.
     """
 
-    def __init__(self, datasources_config):
+    def __init__(self, datasources_config, content_addressed_cache=False, cache_manager=None):
         """
         Args:
             datasources_config (Dict[str, Dict[str, Any]]):
@@ -43,11 +50,15 @@ class ExportManager(object):
                         "composite_fn": (Callable[[ee.ImageCollection], ee.Image])  A function to convert the image collection to an image.
                             If None and the class inherits from SingleImageDatasource then .first() will be used.,
                         "bands": (List[str])  The list of expected band names,
+                        "input_bands": (Optional[List[str]])  The bands of the image collection read by composite_fn.
+                            If present, only these bands (and the bands they are derived from) are computed by the
+                            datasource, see ImageDatasource.get_img_coll_bands.  Defaults to all bands.,
                         "tag": (Optional[Union[str, Enum, List[str], List[Enum]]])  An ID or set of IDs
                             used for filtering as described in public methods.  Defaults to [].,
                         "cache_asset_id": (Optional[str])  If this is present and the class inherits from SingleImageDatasource
                             then the output will be saved to the asset ID represented by this string before exports occur.  This
-                            can be useful for jobs that would otherwise run out of memory.,
+                            can be useful for jobs that would otherwise run out of memory.  If content_addressed_cache
+                            is True, a hash of the computation is appended to the asset ID, see _populate_cache.,
                     }
 
                 {
@@ -68,7 +79,18 @@ class ExportManager(object):
                         "cache_asset_id": 'projects/atlasaipbc/clients/world_bank_et/linear_model_features/lm_worldpop',
                     },
                 }
+            content_addressed_cache (bool):  If True, cache assets are only reused if they were exported from
+                the same datasource class, args, composite_fn, dates, region, scale and projection, and the
+                first CACHE_KEY_LENGTH characters of the cache key are appended to every cache_asset_id.
+                Defaults to False, so that the cache assets exported before cache keys existed, at the
+                cache_asset_id itself, keep being used.  An existing asset whose cache key differs is then
+                reused with a warning.  Enabling it exports every cache again under new asset ids, the
+                assets at the old ids are not deleted.
+            cache_manager (Optional[CacheManager]):  If provided, records when cache assets are used and
+                evicts the least recently used cache assets once new cache exports are scheduled.
         """
+        self.content_addressed_cache = content_addressed_cache
+        self.cache_manager = cache_manager
         self.datasources_config = dict(datasources_config)
 
         for input_name in list(self.datasources_config.keys()):
@@ -127,10 +149,29 @@ class ExportManager(object):
 
 
     @staticmethod
-    def _populate_cache(image_spec, datasources):
-        scheduler = TaskScheduler()
-        export_region = None
+    def _cache_scene(image_spec_kwargs, input_config):
+        """The image exported to the cache asset of a datasource."""
+        image_spec = ImageSpec(**image_spec_kwargs)
+        image_spec.add_datasource(
+            datasource_class=input_config['class'],
+            composite_function=input_config['composite_fn'],
+            ds_kwargs=input_config['args'],
+            bands=input_config.get('input_bands', None),
+        )
+        scene = image_spec.get_scene(add_latlon=False)
+        return scene.clip(image_spec_kwargs['filterpoly'])
+
 
+    @staticmethod
+    def _resolve_cache(image_spec, datasources, content_addressed=True):
+        """
+        Compute the cache key and cache asset id of every cached datasource.
+
+        Returns:
+            (Tuple[Dict[str, Any], List[Tuple[str, str, ee.Image, str]]]):
+                First element:  The ImageSpec arguments of the cache exports.
+                Second element:  The name, cache asset id, exported image and cache key of every cached datasource.
+        """
         image_spec_kwargs = {
             'start_date': image_spec.start_date,
             'end_date': image_spec.end_date,
@@ -139,37 +180,104 @@ class ExportManager(object):
             'scale': image_spec.scale,
         }
 
-        for input_name, input_config in datasources.items():
-
-            output_asset_id = input_config.get('cache_asset_id', None)
-            if output_asset_id is None:
-                continue
-
-            if asset_exists(output_asset_id):
-                logger.warn('{} already exists.  Will not precompute.'.format(output_asset_id))
-                continue
-
+        cached = [
+            (input_name, input_config)
+            for input_name, input_config in datasources.items()
+            if input_config.get('cache_asset_id', None) is not None
+        ]
+        if len(cached) > 0 and image_spec.projection == constants.UTM:
+            raise ExportManagerError('Cannot cache datasources with the {} projection, cache assets '
+                                     'are exported in a single projection.'.format(constants.UTM))
+        for input_name, input_config in cached:
             if not issubclass(input_config['class'], SingleImageDatasource):
                 raise ExportManagerError(
                     'Cannot cache {}.  The provided class '
                     'is not a SingleImageDatasource.'.format(input_name)
                 )
 
-            image_spec = ImageSpec(**image_spec_kwargs)
-            image_spec.add_datasource(
-                datasource_class=input_config['class'],
-                composite_function=input_config['composite_fn'],
-                ds_kwargs=input_config['args'],
-            )
+        resolved = []
+        for input_name, input_config in cached:
+            scene = ExportManager._cache_scene(image_spec_kwargs, input_config)
+            cache_key = fingerprint(scene, image_spec_kwargs['scale'], image_spec_kwargs['projection'])
+            output_asset_id = input_config['cache_asset_id']
+            if content_addressed:
+                output_asset_id = '{}_{}'.format(output_asset_id, cache_key[:CACHE_KEY_LENGTH])
+            resolved.append((input_name, output_asset_id, scene, cache_key))
+        return image_spec_kwargs, resolved
+
+
+    @staticmethod
+    def _populate_cache(image_spec, datasources, scheduler=None, content_addressed=True, cache_manager=None):
+        """
+        Export every cached datasource whose cache asset does not exist yet.
 
-            scene = image_spec.get_scene(add_latlon=False)
-            scene = scene.clip(image_spec_kwargs['filterpoly'])
+        The cache key of a datasource is a fingerprint of the serialized expression graph of the exported
+        image and of the export scale and projection.  It is stored in the CACHE_KEY_PROPERTY property of
+        the cache asset.  With content_addressed, the first CACHE_KEY_LENGTH characters of the key are
+        appended to the cache_asset_id, so that a cache asset is only reused for the same computation.
+
+        Args:
+            image_spec (ImageSpec):
+            datasources (Dict[str, Dict[str, Any]]):
+            scheduler (Optional[TaskScheduler]):  If provided, the cache exports are added to it
+                and this returns immediately.  Otherwise they are run and this blocks until they finish.
+            content_addressed (bool):  If False, cache_asset_id is used as is and an existing asset is
+                reused even if its cache key differs.
+            cache_manager (Optional[CacheManager]):  If provided, cache hits are recorded as used and the
+                cache budget is enforced, without evicting any of the cache assets of datasources.
+        Returns:
+            (Tuple[Dict[str, str], List[str]]):
+                First element:  Maps the name of every cached datasource to its cache asset id.
+                Second element:  The job ids of the cache exports in scheduler that downstream exports
+                must depend on.  Cache exports that were already in scheduler are included.
+                Always empty if scheduler is None.
+        """
+        blocking = scheduler is None
+        if blocking:
+            scheduler = TaskScheduler()
+        export_region = None
+        image_spec_kwargs, resolved = ExportManager._resolve_cache(image_spec, datasources, content_addressed)
+
+        cache_asset_ids = dict()
+        dependencies = []
+        to_check = []
+        for input_name, output_asset_id, scene, cache_key in resolved:
+            cache_asset_ids[input_name] = output_asset_id
+            if output_asset_id in scheduler.tasks:
+                # Already scheduled by an earlier call sharing this scheduler.
+                dependencies.append(output_asset_id)
+            else:
+                to_check.append((input_name, output_asset_id, scene, cache_key))
+        existing = get_assets([output_asset_id for _, output_asset_id, _, _ in to_check])
+
+        hits = []
+        for input_name, output_asset_id, scene, cache_key in to_check:
+
+            if output_asset_id in existing:
+                asset_key = existing[output_asset_id].get('properties', {}).get(CACHE_KEY_PROPERTY, None)
+                if asset_key == cache_key:
+                    logger.info('{} is up to date.  Will not precompute.'.format(output_asset_id))
+                    hits.append(output_asset_id)
+                elif content_addressed:
+                    raise ExportManagerError(
+                        '{} exists but its {} property does not match the cache key {}.  '
+                        'Delete it to rebuild the cache.'.format(output_asset_id, CACHE_KEY_PROPERTY, cache_key)
+                    )
+                else:
+                    logger.warning('{} already exists but may be stale (cache key {}, expected {}).  '
+                                   'Will not precompute.'.format(output_asset_id, asset_key, cache_key))
+                continue
 
             if export_region is None:
-                export_region = image_spec.region.bounds().getInfo()['coordinates']
+                export_region = image_spec_kwargs['filterpoly'].bounds().getInfo()['coordinates']
 
+            if cache_manager is not None:
+                properties = cache_manager.export_properties(cache_key)
+            else:
+                now = time.time()
+                properties = {CACHE_KEY_PROPERTY: cache_key, CACHE_CREATED_PROPERTY: now, CACHE_LAST_USED_PROPERTY: now}
             task = ee.batch.Export.image.toAsset(**{
-                'image': scene,
+                'image': scene.set(properties),
                 'description': input_name,
                 'assetId': output_asset_id,
                 'region': export_region,
@@ -179,23 +287,42 @@ class ExportManager(object):
             })
             logger.info('Will precompute {}'.format(input_name))
             scheduler.add_task(task, output_asset_id)
+            dependencies.append(output_asset_id)
 
-        if len(scheduler) > 0:
-            scheduler.run(verbose=999, error_on_fail=True)
+        if cache_manager is not None:
+            cache_manager.touch(hits)
+            cache_manager.enforce_budget(protected=cache_asset_ids.values())
+
+        if blocking:
+            if len(scheduler) > 0:
+                scheduler.run(verbose=999, error_on_fail=True)
+            return cache_asset_ids, []
+        return cache_asset_ids, dependencies
 
 
     @staticmethod
-    def _populate_image_spec(image_spec, datasources):
+    def _populate_image_spec(image_spec, datasources, cache_asset_ids=None):
+        """
+        Args:
+            image_spec (ImageSpec):
+            datasources (Dict[str, Dict[str, Any]]):
+            cache_asset_ids (Optional[Dict[str, str]]):  The cache asset ids returned by _populate_cache.
+                Defaults to the cache_asset_id of every datasource.
+        Returns:
+            (List[str]):  The output bands.
+        """
+        cache_asset_ids = dict() if cache_asset_ids is None else cache_asset_ids
         output_bands = []
-        for _, input_config in datasources.items():
+        for input_name, input_config in datasources.items():
 
-            cache_asset_id = input_config.get('cache_asset_id', None)
+            cache_asset_id = cache_asset_ids.get(input_name, input_config.get('cache_asset_id', None))
 
             if cache_asset_id is None:
                 image_spec.add_datasource(
                     datasource_class=input_config['class'],
                     composite_function=input_config['composite_fn'],
                     ds_kwargs=input_config['args'],
+                    bands=input_config.get('input_bands', None),
                 )
             else:
                 image_spec.add_datasource(
@@ -216,15 +343,109 @@ class ExportManager(object):
         return output_bands
 
 
-    def _get_image_spec_helper(self, image_spec, tags=None):
+    def _get_image_spec_helper(self, image_spec, tags=None, scheduler=None):
+        datasources = self._get_datasources_by_tag(tags=tags)
+        image_spec = ExportManager._convert_to_image_spec(image_spec)
+        cache_asset_ids, cache_dependencies = ExportManager._populate_cache(
+            image_spec, datasources, scheduler, self.content_addressed_cache, self.cache_manager
+        )
+        output_bands = ExportManager._populate_image_spec(image_spec, datasources, cache_asset_ids)
+        return image_spec, output_bands, cache_dependencies
+
+    def get_cache_asset_ids(self, image_spec, tags=None):
+        """
+        The cache asset ids the datasources would be read from, without looking up or exporting anything.
+        Pass the ids of all current configurations to CacheManager.collect_garbage to delete stale cache assets.
+
+        Args:
+            image_spec (Union[ImageSpec, Dict[str, Any]]):  See get_scene.
+            tags (Optional[Union[str, Enum, Collection[str, Enum]]]):  See get_scene.
+        Returns:
+            (Dict[str, str]):  Maps the name of every cached datasource to its cache asset id.
+        """
         datasources = self._get_datasources_by_tag(tags=tags)
         image_spec = ExportManager._convert_to_image_spec(image_spec)
-        ExportManager._populate_cache(image_spec, datasources)
+        _, resolved = ExportManager._resolve_cache(image_spec, datasources, self.content_addressed_cache)
+        return {input_name: output_asset_id for input_name, output_asset_id, _, _ in resolved}
+
+
+    def estimate_cost(self, image_spec, tags=None, fc=None, export_radius=None, max_error=100.0):
+        """
+        A dry run of get_scene, or of sample_tiles if fc and export_radius are given:
+        builds the same expression graph and estimates its size, without submitting anything.
+        Cached datasources are estimated from their class, args and composite_fn, i.e. what their cache
+        export computes, since their cache assets may not exist yet.
+
+        The number of images of every datasource collection, and the area of the region or the
+        number of points, are looked up with a single getInfo call.
+
+        Args:
+            image_spec (Union[ImageSpec, Dict[str, Any]]):  See get_scene.
+            tags (Optional[Union[str, Enum, Collection[str, Enum]]]):  See get_scene.
+            fc (Optional[ee.FeatureCollection]):  The points passed to sample_tiles.
+            export_radius (Optional[int]):  The export_radius passed to sample_tiles.
+            max_error (float):  The error in meters tolerated when computing the area of the region.
+        Returns:
+            (CostEstimate):
+        """
+        if (fc is None) != (export_radius is None):
+            raise ExportManagerError('fc and export_radius must be provided together.')
+        # Content addressed cache ids of new configurations never exist before the first export.
+        datasources = {
+            input_name: dict(input_config, cache_asset_id=None)
+            for input_name, input_config in self._get_datasources_by_tag(tags=tags).items()
+        }
+        image_spec = ExportManager._convert_to_image_spec(image_spec)
+
+        num_existing = len(image_spec.data_sources)
         output_bands = ExportManager._populate_image_spec(image_spec, datasources)
-        return image_spec, output_bands
+        names = ['datasource{}'.format(i) for i in range(num_existing)] + list(datasources.keys())
+        num_bands = [None] * num_existing + [len(config['bands']) for config in datasources.values()]
+
+        num_images = dict()
+        images = []
+        for name, (ds_class, kwargs, comp_fn, bands) in zip(names, image_spec.data_sources):
+            ds, _ = ImageSpec._make_datasource(image_spec, ds_class, kwargs, comp_fn)
+            num_images[name] = ds.get_img_coll().size()
+            images.append(ImageSpec._datasource_image(image_spec, ds_class, kwargs, comp_fn, bands))
+
+        lookups = {'num_images': ee.Dictionary(num_images)}
+        if fc is None:
+            lookups['area'] = image_spec.region.area(max_error)
+        else:
+            lookups['num_points'] = fc.size()
+        info = ee.Dictionary(lookups).getInfo()
+
+        datasource_costs = []
+        for name, bands, image in zip(names, num_bands, images):
+            request_bytes, functions = cost_estimate.serialize(image)
+            datasource_costs.append(cost_estimate.DatasourceCost(
+                name, info['num_images'][name], bands, request_bytes, sum(functions.values())
+            ))
+
+        if fc is None:
+            request = image_spec.get_scene()
+            num_pixels = info['area'] / float(image_spec.scale) ** 2
+            num_points = None
+        else:
+            request = add_imagery(fc, image_spec, output_size=export_radius)
+            num_points = info['num_points']
+            num_pixels = cost_estimate.tile_pixels(num_points, export_radius)
+        request_bytes, functions = cost_estimate.serialize(request)
+        return cost_estimate.CostEstimate(
+            datasource_costs, len(output_bands), num_pixels, request_bytes, functions,
+            num_points=num_points, export_radius=export_radius,
+        )
 
 
-    def get_scene(self, image_spec, tags=None):
+    @staticmethod
+    def _with_cache_dependencies(result, cache_dependencies, scheduler):
+        if scheduler is None:
+            return result
+        return result + (cache_dependencies,)
+
+
+    def get_scene(self, image_spec, tags=None, scheduler=None):
         """
         Take a featureCollection (fc) where each row has point geometry and 
         return a featureCollection with image bands added.
@@ -243,22 +464,26 @@ class ExportManager(object):
                 the 'datasources_config' constructor argument.  Only tags contained in the tags argument
                 will be used when generating the return value.  If None, all datasources are included.
                 Defaults to None.
+            scheduler (Optional[TaskScheduler]):  If provided, exports of cache assets that do not exist yet
+                are added to scheduler instead of being run before this returns, and the job ids downstream
+                exports must depend on are returned as a third element.  Defaults to None.
 
         Returns:
             (Tuple[ee.Image, List[str]]):
                 First element: The image represented by combining datasources according to
                 the specifications in the image_spec argument.
                 Second element:  The list of output bands.
+                Third element, only if scheduler is provided:  The job ids of the cache exports in scheduler.
 
             If a collection in the constructor argument is filtered in such a way that it becomes the empty
             collection, it's bands will be omitted from the output but will still be included in the second
             return element.
         """
-        image_spec, output_bands = self._get_image_spec_helper(image_spec, tags)
-        return image_spec.get_scene(), output_bands
+        image_spec, output_bands, cache_dependencies = self._get_image_spec_helper(image_spec, tags, scheduler)
+        return self._with_cache_dependencies((image_spec.get_scene(), output_bands), cache_dependencies, scheduler)
 
 
-    def sample_tiles(self, fc, image_spec, export_radius, tags=None):
+    def sample_tiles(self, fc, image_spec, export_radius, tags=None, scheduler=None):
         """
         Take a featureCollection (fc) where each row has point geometry and 
         return a featureCollection with image bands added.
@@ -279,23 +504,27 @@ class ExportManager(object):
                 will be used when generating the return value.  If None, all datasources are included.
                 Defaults to None.
             export_radius (int): The outputsize in pixels (final output is an (2 * output_size + 1) by (2 * output_size + 1) square)
+            scheduler (Optional[TaskScheduler]):  If provided, exports of cache assets that do not exist yet
+                are added to scheduler instead of being run before this returns, and the job ids downstream
+                exports must depend on are returned as a third element.  Defaults to None.
 
         Returns:
             (Tuple[ee.FeatuerCollection, List[str]]): 
             First element: A new feature collection with an output_size by output_size tile added to each row.
             The tile's bands are stored in separate columns.
             Second element:  The list of output bands.
+            Third element, only if scheduler is provided:  The job ids of the cache exports in scheduler.
 
             If a collection in the constructor argument is filtered in such a way that it becomes the empty
             collection, it's bands will be omitted from the output but will still be included in the second
             return element.
         """
-        image_spec, output_bands = self._get_image_spec_helper(image_spec, tags)
+        image_spec, output_bands, cache_dependencies = self._get_image_spec_helper(image_spec, tags, scheduler)
         fc = add_imagery(fc, image_spec, output_size=export_radius)
-        return fc, output_bands
+        return self._with_cache_dependencies((fc, output_bands), cache_dependencies, scheduler)
 
 
-    def sample_tiles_unstacked(self, fc, image_spec, export_radius, tags=None):
+    def sample_tiles_unstacked(self, fc, image_spec, export_radius, tags=None, scheduler=None):
         """
         Take a featureCollection (fc) where each row has point geometry and 
         return a featureCollection with image bands added.  Identical to sample_tiles
@@ -317,12 +546,16 @@ class ExportManager(object):
                 the 'datasources_config' constructor argument.  Only tags contained in the tags argument
                 will be used when generating the return value.  If None, all datasources are included.
                 Defaults to None.
+            scheduler (Optional[TaskScheduler]):  If provided, exports of cache assets that do not exist yet
+                are added to scheduler instead of being run before this returns, and the job ids downstream
+                exports must depend on are returned as a third element.  Defaults to None.
 
         Returns:
             (Tuple[ee.FeatureCollection, List[str]]):
             First element: A new feature collection with an output_size by output_size tile added to each row.
             The tile's bands are stored in separate columns.
             Second element:  The list of output bands.
+            Third element, only if scheduler is provided:  The job ids of the cache exports in scheduler.
 
             If a collection in the constructor argument is filtered in such a way that it becomes the empty
             collection, it's bands will be omitted from the output but will still be included in the second
@@ -330,16 +563,17 @@ class ExportManager(object):
         """
         datasources = self._get_datasources_by_tag(tags=tags)
         image_spec = ExportManager._convert_to_image_spec(image_spec)
-        ExportManager._populate_cache(image_spec, datasources)
+        # The cache is looked up once for all datasources, and its budget enforced with all of them protected.
+        cache_asset_ids, cache_dependencies = ExportManager._populate_cache(
+            image_spec, datasources, scheduler, self.content_addressed_cache, self.cache_manager
+        )
 
         output_bands = []
         for i, (ds_name, ds_config) in enumerate(datasources.items()):
 
-            ds_config = dict(ds_config)
-            ds_config['tag'] = list(ds_config['tag'])
             small_config = {ds_name: ds_config}
-            _image_spec, small_output_bands = ExportManager(small_config)._get_image_spec_helper(image_spec, tags)
-            fc = add_imagery(fc, _image_spec, output_size=export_radius, add_latlon=(i == 0))
+            small_output_bands = ExportManager._populate_image_spec(image_spec, small_config, cache_asset_ids)
+            fc = add_imagery(fc, image_spec, output_size=export_radius, add_latlon=(i == 0))
 
             if i != 0:
                 small_output_bands.remove('LAT')
@@ -347,4 +581,82 @@ class ExportManager(object):
 
             output_bands.extend(small_output_bands)
 
-        return fc, output_bands
+        return self._with_cache_dependencies((fc, output_bands), cache_dependencies, scheduler)
+
+
+    def sample_tiles_sharded(self, fc, image_spec, export_radius, export_fn, shard_by=sharding.GRID,
+                             max_points_per_shard=5000, cell_size=1.0, num_shards=None, key_property=None,
+                             tags=None, scheduler=None, manifest_path=None, jid_prefix='sample_tiles_',
+                             retry_policy=None, cell_counts=None, num_points=None, id_property=None):
+        """
+        Like sample_tiles, but the points are split into shards exported by separate tasks, so that
+        every export stays within EE memory and time limits, shards run in parallel and a failed shard
+        can be retried on its own.
+
+        Args:
+            fc (ee.FeatureCollection):  See sample_tiles.
+            image_spec (Union[ImageSpec, Dict[str, Any]]):  See sample_tiles.
+            export_radius (int):  See sample_tiles.
+            export_fn (Callable[[ee.FeatureCollection, Shard, str], ee.batch.Task]):  Creates the unstarted
+                export task of the samples of a shard, given the shard and a task description.
+                See sharding.TableExporter.
+            shard_by (str):  sharding.GRID to shard by the cell of a grid of cell_size degrees,
+                packing neighbouring cells into shards of at most max_points_per_shard points,
+                or sharding.HASH to shard by a hash of the points.  Defaults to GRID.
+            max_points_per_shard (int):  Defaults to 5000.
+            cell_size (float):  The size of the grid cells in degrees.  Defaults to 1.
+            num_shards (Optional[int]):  The number of shards with HASH.
+                Defaults to the number of points divided by max_points_per_shard.
+            key_property (Optional[str]):  With HASH, an integer property to shard by, see sharding.add_hash_bucket.
+            tags (Optional[Union[str, Enum, Collection[str, Enum]]]):  See sample_tiles.
+            scheduler (Optional[TaskScheduler]):  If provided, the jobs are added to it.
+            manifest_path (Optional[str]):  If provided, a manifest of the shards is written to this file,
+                see sharding.read_manifest.
+            jid_prefix (str):  Prepended to shard names to form job ids and task descriptions.
+            retry_policy (Optional[RetryPolicy]):  If provided, failed shard exports are retried.
+            cell_counts (Optional[Dict[str, int]]):  The number of points per grid cell, if already known.
+                Otherwise they are computed with one getInfo call.
+            num_points (Optional[int]):  The number of points, if already known, for HASH without num_shards.
+            id_property (Optional[str]):  With HASH, a property uniquely identifying every point, e.g. a string id,
+                to shard by the pseudorandom number randomColumn derives from it, see sharding.add_hash_bucket.
+
+        Returns:
+            (Tuple[TaskScheduler, List[Shard], List[str]]):  The scheduler, in which every shard export
+                depends on the cache exports it reads, the shards and the list of output bands.
+        """
+        if shard_by == sharding.GRID:
+            fc = sharding.add_grid_cell(fc, cell_size)
+            if cell_counts is None:
+                cell_counts = fc.aggregate_histogram(sharding.SHARD_PROPERTY).getInfo()
+            shards = sharding.plan_grid_shards(cell_counts, max_points_per_shard)
+        elif shard_by == sharding.HASH:
+            if num_shards is None and num_points is None:
+                num_points = fc.size().getInfo()
+            shards = sharding.plan_hash_shards(num_points, max_points_per_shard, num_shards)
+            fc = sharding.add_hash_bucket(fc, len(shards), key_property, id_property=id_property)
+        else:
+            raise ExportManagerError('Unknown shard_by: {}'.format(shard_by))
+
+        scheduler = TaskScheduler() if scheduler is None else scheduler
+        image_spec, output_bands, cache_dependencies = self._get_image_spec_helper(image_spec, tags, scheduler)
+
+        jids = []
+        for shard in shards:
+            jid = jid_prefix + shard.name
+            samples = add_imagery(shard.filter(fc), image_spec, output_size=export_radius)
+
+            def task_factory(samples=samples, shard=shard, jid=jid):
+                return export_fn(samples, shard, jid)
+
+            scheduler.add_task(None, jid, cache_dependencies, retry_policy=retry_policy, task_factory=task_factory)
+            jids.append(jid)
+        logger.info('Sharded sample_tiles into {} exports'.format(len(shards)))
+
+        if manifest_path is not None:
+            sharding.write_manifest(
+                manifest_path, shards, jids, export_fn,
+                shard_by=shard_by, cell_size=cell_size if shard_by == sharding.GRID else None,
+                key_property=key_property, id_property=id_property, export_radius=export_radius,
+                output_bands=output_bands,
+            )
+        return scheduler, shards, output_bands
@@ -0,0 +1,420 @@
+"""
+Plans the export of one scene over many regions, e.g. thousands of admin regions.
+
+Instead of one get_scene and one export per region, the ExportPlanner builds the scene
+once and packs the regions into as few export tasks as the maxPixels limit allows:
+neighbouring small regions share a task, regions larger than the limit are split into
+tiles.  Planning only needs the bounding box of every region, fetched with one getInfo
+call per page of regions, after which pixel counts are estimated client side in the export CRS.
+
+Example:
+    planner = ExportPlanner(export_manager, max_pixels=1e9)
+    scheduler, groups = planner.schedule(
+        admin_regions, {'start_date': '2018-01-01', 'end_date': '2019-01-01', 'scale': 30,
+                        'projection': 'EPSG:4326'},
+        export_to_asset('users/someone/admin_exports/'), id_property='ADM2_CODE',
+    )
+    scheduler.run()
+"""
+import re
+import math
+import logging
+
+import ee
+
+from gee_tools.exports import constants
+from gee_tools.exports.image_spec import ImageSpec
+from gee_tools.exports.task_scheduler import TaskScheduler
+
+logger = logging.getLogger(__name__)
+
+# The maxPixels of an export when it is not specified.
+DEFAULT_MAX_PIXELS = 1e8
+
+# The maxPixels of an export is this many times the planned pixel budget, since the estimates are approximate.
+MAX_PIXELS_MARGIN = 2.0
+
+# The number of regions fetched by every getInfo call of fetch_regions, getInfo returns at most 5000 elements.
+FETCH_PAGE_SIZE = 5000
+
+# Meters per degree of latitude, and of longitude at the equator.
+_METERS_PER_DEGREE_LAT = 110574.0
+_METERS_PER_DEGREE_LON = 111320.0
+
+# The radius of the sphere of EPSG:3857.  EE converts scales in meters to degrees of EPSG:4326 at the equator.
+_EARTH_RADIUS = 6378137.0
+_METERS_PER_DEGREE_EQUATOR = math.radians(_EARTH_RADIUS)
+_MAX_MERCATOR_LAT = 85.0511
+
+
+class ExportPlannerError(RuntimeError):
+    pass
+
+
+def _mercator_y(lat):
+    lat = math.radians(max(min(lat, _MAX_MERCATOR_LAT), -_MAX_MERCATOR_LAT))
+    return _EARTH_RADIUS * math.log(math.tan(math.pi / 4.0 + lat / 2.0))
+
+
+def projected_size(bounds, projection=constants.EPSG3857):
+    """
+    Args:
+        bounds (Tuple[float, float, float, float]):  (west, south, east, north) in degrees.
+        projection (Optional[str]):  The export CRS.  EPSG:3857 and EPSG:4326 are exact, other projections
+            and None are assumed to preserve ground distances, like UTM zones do.
+    Returns:
+        (Tuple[float, float]):  The width and height of the bounding box in the units the export scale
+            is measured in, meters of projection for EPSG:3857.
+    """
+    west, south, east, north = bounds
+    if projection == constants.EPSG3857:
+        # Mercator stretches distances by sec(lat) in both directions.
+        return (math.radians(max(east - west, 0.0)) * _EARTH_RADIUS,
+                max(_mercator_y(north) - _mercator_y(south), 0.0))
+    if projection == constants.EPSG4326:
+        return (max(east - west, 0.0) * _METERS_PER_DEGREE_EQUATOR,
+                max(north - south, 0.0) * _METERS_PER_DEGREE_EQUATOR)
+    mean_lat = math.radians((south + north) / 2.0)
+    return (max(east - west, 0.0) * _METERS_PER_DEGREE_LON * math.cos(mean_lat),
+            max(north - south, 0.0) * _METERS_PER_DEGREE_LAT)
+
+
+def estimate_pixels(bounds, scale, projection=constants.EPSG3857):
+    """
+    Estimate the number of pixels in a bounding box.
+
+    Args:
+        bounds (Tuple[float, float, float, float]):  (west, south, east, north) in degrees.
+        scale (float):  The pixel size in meters.
+        projection (Optional[str]):  The export CRS, see projected_size.  Defaults to EPSG:3857,
+            the default projection of ImageSpec.
+    Returns:
+        (float):
+    """
+    width, height = projected_size(bounds, projection)
+    return max(math.ceil(width / scale), 1) * max(math.ceil(height / scale), 1)
+
+
+def union_bounds(bounds_list):
+    """
+    Args:
+        bounds_list (Iterable[Tuple[float, float, float, float]]):
+    Returns:
+        (Tuple[float, float, float, float]):  The bounding box of all bounding boxes.
+    """
+    wests, souths, easts, norths = zip(*bounds_list)
+    return min(wests), min(souths), max(easts), max(norths)
+
+
+def _safe_name(value):
+    """Replace characters that are not allowed in export descriptions."""
+    return re.sub(r'[^A-Za-z0-9_.,:;-]', '_', str(value))
+
+
+class PlannedRegion(object):
+    """A region to export, identified by the value of its id property."""
+
+    def __init__(self, region_id, bounds):
+        """
+        Args:
+            region_id (Any):
+            bounds (Tuple[float, float, float, float]):  (west, south, east, north) in degrees.
+        """
+        self.region_id = region_id
+        self.bounds = tuple(bounds)
+
+    @property
+    def center(self):
+        west, south, east, north = self.bounds
+        return (west + east) / 2.0, (south + north) / 2.0
+
+    def __repr__(self):
+        return 'PlannedRegion({}, {})'.format(self.region_id, self.bounds)
+
+
+class ExportGroup(object):
+    """The regions exported by one task."""
+
+    def __init__(self, name, region_ids, bounds, num_pixels, tile=None):
+        """
+        Args:
+            name (str):  Unique within a plan, used as the job id and export description.
+            region_ids (List[Any]):  The ids of the regions in the task.
+            bounds (Tuple[float, float, float, float]):  The export region, (west, south, east, north) in degrees.
+            num_pixels (float):  The estimated number of pixels of the export.
+            tile (Optional[Tuple[int, int, int]]):  (index, row, column) if this is a tile of a single
+                region that was too large for one task, otherwise None.
+        """
+        self.name = name
+        self.region_ids = region_ids
+        self.bounds = bounds
+        self.num_pixels = num_pixels
+        self.tile = tile
+
+    @property
+    def coordinates(self):
+        """The export region as a GeoJSON polygon ring."""
+        west, south, east, north = self.bounds
+        return [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+
+    def __repr__(self):
+        return 'ExportGroup({}, {} regions, {:.0f} pixels)'.format(self.name, len(self.region_ids), self.num_pixels)
+
+
+def _morton_key(x, y, bits=16):
+    """Interleave the bits of x and y, so that sorting by the key keeps nearby points together."""
+    key = 0
+    for i in range(bits):
+        key |= ((x >> i) & 1) << (2 * i) | ((y >> i) & 1) << (2 * i + 1)
+    return key
+
+
+def _spatial_order(regions):
+    """Sort regions along a Z-order curve over their centers."""
+    west, south, east, north = union_bounds([region.bounds for region in regions])
+    size = (1 << 16) - 1
+    width = max(east - west, 1e-12)
+    height = max(north - south, 1e-12)
+
+    def key(region):
+        x, y = region.center
+        return _morton_key(int((x - west) / width * size), int((y - south) / height * size))
+
+    return sorted(regions, key=key)
+
+
+def _split_region(region, scale, max_pixels, projection=constants.EPSG3857, index=0):
+    """
+    Split the bounding box of a region into a grid of tiles under max_pixels.
+    The tiles are named after the region and index, the position of the first tile in the plan,
+    since distinct region ids can be the same once sanitized.
+    """
+    num_pixels = estimate_pixels(region.bounds, scale, projection)
+    n = int(math.ceil(math.sqrt(num_pixels / float(max_pixels))))
+    while True:
+        west, south, east, north = region.bounds
+        dx, dy = (east - west) / n, (north - south) / n
+        tiles = [
+            (west + col * dx, south + row * dy, west + (col + 1) * dx, south + (row + 1) * dy)
+            for row in range(n) for col in range(n)
+        ]
+        if all(estimate_pixels(tile, scale, projection) <= max_pixels for tile in tiles):
+            break
+        # Rounding the tile sizes up to whole pixels can overshoot the limit.
+        n += 1
+    return [
+        ExportGroup('{}_group{}_tile{}'.format(_safe_name(region.region_id), index, i), [region.region_id],
+                    tile, estimate_pixels(tile, scale, projection), tile=(i, i // n, i % n))
+        for i, tile in enumerate(tiles)
+    ]
+
+
+def plan_groups(regions, scale, max_pixels=DEFAULT_MAX_PIXELS, max_regions_per_group=None,
+                projection=constants.EPSG3857):
+    """
+    Pack regions into export groups.
+
+    Regions are visited in Z-order of their centers, so that neighbours end up in the same group,
+    and added to the current group while the bounding box of the group stays under max_pixels.
+    Regions that are over max_pixels on their own are split into a grid of tiles, one group per tile.
+
+    Args:
+        regions (List[PlannedRegion]):
+        scale (float):  The export scale in meters.
+        max_pixels (float):  The maximum estimated number of pixels of a group.
+        max_regions_per_group (Optional[int]):  Limits the size of the region id list serialized
+            with every task.  None for no limit.
+        projection (Optional[str]):  The export CRS the pixels are counted in, see estimate_pixels.
+    Returns:
+        (List[ExportGroup]):
+    """
+    if max_pixels < 1:
+        raise ExportPlannerError('max_pixels must be at least 1.')
+    if max_regions_per_group is not None and max_regions_per_group < 1:
+        raise ExportPlannerError('max_regions_per_group must be at least 1.')
+    ids = [region.region_id for region in regions]
+    if len(set(ids)) != len(ids):
+        raise ExportPlannerError('Region ids must be unique.')
+    if len(regions) == 0:
+        return []
+
+    groups = []
+    current_ids, current_bounds, current_pixels = [], None, 0
+
+    def flush():
+        if len(current_ids) > 0:
+            groups.append(ExportGroup('group{}'.format(len(groups)), current_ids, current_bounds, current_pixels))
+
+    for region in _spatial_order(regions):
+        if estimate_pixels(region.bounds, scale, projection) > max_pixels:
+            groups.extend(_split_region(region, scale, max_pixels, projection, len(groups)))
+            continue
+
+        if len(current_ids) > 0:
+            bounds = union_bounds([current_bounds, region.bounds])
+            num_pixels = estimate_pixels(bounds, scale, projection)
+            full = max_regions_per_group is not None and len(current_ids) >= max_regions_per_group
+            if num_pixels <= max_pixels and not full:
+                current_ids.append(region.region_id)
+                current_bounds, current_pixels = bounds, num_pixels
+                continue
+            flush()
+
+        current_ids = [region.region_id]
+        current_bounds = region.bounds
+        current_pixels = estimate_pixels(region.bounds, scale, projection)
+    flush()
+    return groups
+
+
+def fetch_regions(regions_fc, id_property, max_error=100.0, page_size=FETCH_PAGE_SIZE):
+    """
+    Fetch the ids and bounding boxes of all features, with one getInfo call per page_size features.
+
+    Args:
+        regions_fc (ee.FeatureCollection):
+        id_property (str):  A property with a unique value per feature, e.g. 'system:index'.
+        max_error (float):  The error in meters tolerated when computing the bounding boxes.
+        page_size (int):  Defaults to FETCH_PAGE_SIZE, the most elements a getInfo call returns.
+    Returns:
+        (List[PlannedRegion]):
+    """
+    def summarize(feature):
+        bounds = feature.geometry().bounds(max_error).coordinates().get(0)
+        return ee.Feature(None, {'id': feature.get(id_property), 'bounds': bounds})
+
+    summaries = regions_fc.map(summarize)
+    regions = []
+    while True:
+        features = summaries.toList(page_size, len(regions)).getInfo()
+        for feature in features:
+            ring = feature['properties']['bounds']
+            regions.append(PlannedRegion(feature['properties']['id'], union_bounds(
+                [(lon, lat, lon, lat) for lon, lat in ring]
+            )))
+        if len(features) < page_size:
+            return regions
+
+
+def export_to_asset(asset_prefix):
+    """
+    Returns:
+        (Callable[[ee.Image, ExportGroup, Dict[str, Any]], ee.batch.Task]):  An export_fn for
+            ExportPlanner.schedule that exports every group to asset_prefix + group.name.
+    """
+    def export_fn(image, group, export_kwargs):
+        return ee.batch.Export.image.toAsset(image=image, assetId=asset_prefix + group.name, **export_kwargs)
+    return export_fn
+
+
+def export_to_cloud_storage(bucket, prefix):
+    """
+    Returns:
+        (Callable[[ee.Image, ExportGroup, Dict[str, Any]], ee.batch.Task]):  An export_fn for
+            ExportPlanner.schedule that exports every group to gs://bucket/prefix + group.name.
+    """
+    def export_fn(image, group, export_kwargs):
+        return ee.batch.Export.image.toCloudStorage(
+            image=image, bucket=bucket, fileNamePrefix=prefix + group.name, **export_kwargs
+        )
+    return export_fn
+
+
+class ExportPlanner(object):
+    """
+    Exports the scene of an ExportManager over many regions with as few tasks as possible.
+
+    The scene is built once, with the bounding box of all regions as filterpoly, so every task
+    shares the same expression graph and the same cache assets, and only differs by its export region.
+    """
+
+    def __init__(self, export_manager, max_pixels=DEFAULT_MAX_PIXELS, max_regions_per_group=500, tags=None):
+        """
+        Args:
+            export_manager (ExportManager):
+            max_pixels (float):  The maximum estimated number of pixels of a task.  Also passed as
+                maxPixels to every export, times MAX_PIXELS_MARGIN.  Lower it for scenes with many bands or heavy composites,
+                which run out of memory before reaching the maxPixels limit.
+            max_regions_per_group (Optional[int]):  See plan_groups.  Defaults to 500.
+            tags (Optional[Union[str, Enum, Collection[str, Enum]]]):  Passed to ExportManager.get_scene.
+        """
+        self.export_manager = export_manager
+        self.max_pixels = max_pixels
+        self.max_regions_per_group = max_regions_per_group
+        self.tags = tags
+
+    def plan(self, regions, scale, projection=constants.EPSG3857):
+        """
+        Args:
+            regions (List[PlannedRegion]):  See fetch_regions.
+            scale (float):  The export scale in meters.
+            projection (Optional[str]):  The export CRS, see estimate_pixels.
+        Returns:
+            (List[ExportGroup]):
+        """
+        groups = plan_groups(regions, scale, self.max_pixels, self.max_regions_per_group, projection)
+        logger.info('Planned {} export tasks for {} regions'.format(len(groups), len(regions)))
+        return groups
+
+    @staticmethod
+    def _clip_geometry(regions_fc, id_property, group):
+        """The union of the regions of a group, referenced by id rather than by coordinates."""
+        return regions_fc.filter(ee.Filter.inList(id_property, group.region_ids)).geometry()
+
+    def schedule(self, regions_fc, image_spec, export_fn, id_property='system:index', regions=None,
+                 scheduler=None, clip=True, jid_prefix='', job_group=None):
+        """
+        Plan the exports and add them to a TaskScheduler.
+
+        Args:
+            regions_fc (ee.FeatureCollection):  The regions to export.
+            image_spec (Union[ImageSpec, Dict[str, Any]]):  See ExportManager.get_scene.  If it is a dict
+                without 'filterpoly', the bounding box of all regions is used.
+            export_fn (Callable[[ee.Image, ExportGroup, Dict[str, Any]], ee.batch.Task]):  Creates the export
+                task of a group from the clipped scene, the group and the export arguments (description,
+                region, scale, crs and maxPixels).  See export_to_asset and export_to_cloud_storage.
+            id_property (str):  A property with a unique value per region.  Defaults to 'system:index'.
+            regions (Optional[List[PlannedRegion]]):  The result of fetch_regions, if it was already called.
+            scheduler (Optional[TaskScheduler]):  If provided, the jobs are added to it.
+            clip (bool):  If True, the scene is clipped to the regions of every task, so pixels of the
+                bounding box outside the regions are masked.  Defaults to True.
+            jid_prefix (str):  Prepended to group names to form job ids and export descriptions.
+            job_group (Any):  Passed to TaskScheduler.add_task as group.
+        Returns:
+            (Tuple[TaskScheduler, List[ExportGroup]]):  The scheduler, in which every export depends on the
+                exports of the cache assets it reads, and the planned groups.
+        """
+        if regions is None:
+            regions = fetch_regions(regions_fc, id_property)
+        if isinstance(image_spec, ImageSpec):
+            scale, projection = image_spec.scale, image_spec.projection
+        else:
+            image_spec = dict(image_spec)
+            scale, projection = image_spec['scale'], image_spec.get('projection', None)
+            if image_spec.get('filterpoly', None) is None and len(regions) > 0:
+                image_spec['filterpoly'] = ee.Geometry.Rectangle(
+                    list(union_bounds([region.bounds for region in regions])), None, False
+                )
+        if projection == constants.UTM:
+            raise ExportPlannerError('Scenes can not be exported with the {} projection.'.format(constants.UTM))
+        scheduler = TaskScheduler() if scheduler is None else scheduler
+
+        # Scenes are reprojected to the ImageSpec default projection when none is given.
+        groups = self.plan(regions, scale, constants.EPSG3857 if projection is None else projection)
+        if len(groups) == 0:
+            return scheduler, groups
+
+        scene, _, cache_dependencies = self.export_manager.get_scene(image_spec, tags=self.tags, scheduler=scheduler)
+        for group in groups:
+            image = scene.clip(self._clip_geometry(regions_fc, id_property, group)) if clip else scene
+            jid = jid_prefix + group.name
+            export_kwargs = {
+                'description': jid,
+                'region': group.coordinates,
+                'scale': scale,
+                'maxPixels': int(self.max_pixels * MAX_PIXELS_MARGIN),
+            }
+            if projection is not None:
+                export_kwargs['crs'] = projection
+            scheduler.add_task(export_fn(image, group, export_kwargs), jid, cache_dependencies, group=job_group)
+        return scheduler, groups
@@ -3,6 +3,10 @@ Author: Anthony Perez
 
 Implements the logic necessary to take an arbitrary FeatureCollection with point geomerty and gather tiles around it for down stream tasks.
 """
+import threading
+import importlib
+import collections
+
 import ee
 
 from gee_tools.datasources.interface import MultiImageDatasource, GlobalImageDatasource, SingleImageDatasource, ImageDatasource, DatasourceError
@@ -10,6 +14,135 @@ from gee_tools import imgtools
 from gee_tools.ai_io import ee_tf_exports as tfexp
 from gee_tools.exports import constants, util
 
+# Maximum number of datasource images memoized by _datasource_image.
+DATASOURCE_CACHE_SIZE = 256
+
+# Version of the ImageSpec.to_dict format.
+SPEC_VERSION = 1
+
+# Keys marking encoded ee objects and references to registered objects in ImageSpec.to_dict.
+_EE_KEY = '__ee__'
+_REF_KEY = '__ref__'
+
+# Maps registered names to datasource classes and composite functions, see register.
+_registry = dict()
+
+_datasource_cache = collections.OrderedDict()
+_datasource_cache_lock = threading.Lock()
+
+
+def clear_datasource_cache():
+    """Forget the datasource images memoized by ImageSpec._get_scene."""
+    with _datasource_cache_lock:
+        _datasource_cache.clear()
+
+
+def _datasource_cache_key(image_spec, ds_class, kwargs, comp_fn, bands=None):
+    """
+    The memoization key of a datasource image, or None if it cannot be memoized.
+    ee objects compare and hash by value, so equal dates or regions built separately share a key.
+    """
+    try:
+        key = (
+            ds_class, ee.ComputedObject.freeze(kwargs), comp_fn, bands,
+            image_spec.start_date, image_spec.end_date, image_spec.region,
+            image_spec.scale, image_spec.projection,
+        )
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def register(obj, name=None):
+    """
+    Register a datasource class or a composite function under a name, so that ImageSpec.to_dict
+    can reference it.  Module level classes and functions do not need to be registered, they are
+    referenced by their import path, but lambdas and nested functions do.
+
+    Args:
+        obj (Union[type, Callable]):
+        name (Optional[str]):  Defaults to the import path, '{module}:{qualname}'.
+    Returns:
+        (Union[type, Callable]):  obj, so that register can be used as a decorator.
+    """
+    name = _import_path(obj) if name is None else name
+    if _registry.get(name, obj) is not obj:
+        raise ValueError("{} is already registered as {}".format(name, _registry[name]))
+    _registry[name] = obj
+    return obj
+
+
+def _import_path(obj):
+    return '{}:{}'.format(obj.__module__, getattr(obj, '__qualname__', obj.__name__))
+
+
+def registered_name(obj):
+    """
+    Args:
+        obj (Union[type, Callable]):
+    Returns:
+        (str):  The name obj was registered under, or its import path if it is defined at module level.
+    """
+    for name, registered in _registry.items():
+        if registered is obj:
+            return name
+    path = _import_path(obj)
+    if '<' in path:
+        raise ValueError("{} cannot be referenced by its import path, register it with image_spec.register".format(obj))
+    return path
+
+
+def resolve(name):
+    """
+    Args:
+        name (str):  A name returned by registered_name.
+    Returns:
+        (Union[type, Callable]):
+    """
+    if name in _registry:
+        return _registry[name]
+    module_name, _, qualname = name.partition(':')
+    try:
+        obj = importlib.import_module(module_name)
+        for attr in qualname.split('.'):
+            obj = getattr(obj, attr)
+    except (ImportError, AttributeError, ValueError):
+        raise ValueError("Unknown datasource class or composite function: {}".format(name))
+    return obj
+
+
+def _encode_value(value):
+    """Encode ImageSpec arguments as JSON serializable values.  ee objects are encoded as their expression graph."""
+    if isinstance(value, ee.ComputedObject):
+        return {_EE_KEY: ee.serializer.encode(value, for_cloud_api=True), 'type': type(value).__name__}
+    if isinstance(value, dict):
+        return {str(k): _encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    if isinstance(value, type) or callable(value):
+        return {_REF_KEY: registered_name(value)}
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    raise ValueError("Cannot serialize {!r} in an ImageSpec".format(value))
+
+
+def _decode_value(value):
+    """Inverse of _encode_value."""
+    if isinstance(value, dict) and _EE_KEY in value:
+        obj = ee.deserializer.decodeCloudApi(value[_EE_KEY])
+        ee_type = getattr(ee, value.get('type', ''), None)
+        if isinstance(ee_type, type) and issubclass(ee_type, ee.ComputedObject) and not isinstance(obj, ee_type):
+            obj = ee_type(obj)
+        return obj
+    if isinstance(value, dict) and _REF_KEY in value:
+        return resolve(value[_REF_KEY])
+    if isinstance(value, dict):
+        return {k: _decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    return value
+
 
 class ImageSpec(object):
     """
@@ -35,6 +168,7 @@ class ImageSpec(object):
         :type filterpoly: ee.Geometry
         :param projection: A projection (crs) designation string.  All images are reprojected 
             using this projection. (default EPSG:3857)
+            With constants.UTM, images are not reprojected and tiles are sampled in the UTM zone of every point.
         :type projection: string
         :param scale:  The scale parameter passed to the reproject method
         :type scale: int
@@ -59,9 +193,11 @@ class ImageSpec(object):
         self.data_sources = []
         self._static_scenes = []
         self.scene = None
-        self._scene_has_latlon = False  # Consider moving to constructor arguments.
+        self._base_scene = None
+        # Maps add_latlon to the scene, so that both variants are kept.
+        self._scenes = dict()
 
-    def add_datasource(self, datasource_class, composite_function, ds_kwargs=None):
+    def add_datasource(self, datasource_class, composite_function, ds_kwargs=None, bands=None):
         """
         Add a data source to this Image Specification
         :param datasource_class: A class that inherits from ImageDatasource.
@@ -71,6 +207,8 @@ class ImageSpec(object):
             into a singe image.  The function must take an ee.ImageCollection
             as an argument and return an ee.Image
         :param ds_kwargs:  Key word arguments passed to the datasource_class at construction.
+        :param bands:  If provided, the bands of the image collection read by composite_function.
+            They are passed to the datasource's get_img_coll_bands, so that other bands are not computed.
         """
         if ds_kwargs is None:
             ds_kwargs = {}
@@ -78,8 +216,15 @@ class ImageSpec(object):
             raise ValueError("data_sources contained non ImageDatasource element: {}".format(datasource_class))
         if not isinstance(datasource_class, type):
             raise ValueError("data_sources elements should be classes, not instances: {}".format(datasource_class))
-        self.data_sources.append((datasource_class, ds_kwargs, composite_function))
-        self.scene = None  # Reset the scene so that it must be recomputed
+        if bands is not None:
+            bands = tuple(bands)
+        self.data_sources.append((datasource_class, ds_kwargs, composite_function, bands))
+        self._reset_scene()  # Reset the scene so that it must be recomputed
+
+    def _reset_scene(self):
+        self.scene = None
+        self._base_scene = None
+        self._scenes = dict()
 
     def add_static_scene(self, scene):
         """
@@ -91,7 +236,7 @@ class ImageSpec(object):
             scene (ee.Image):  The scene to add.
         """
         self._static_scenes.append(scene)
-        self.scene = None
+        self._reset_scene()
 
     def get_scene(self, add_latlon=True):
         """
@@ -100,12 +245,12 @@ class ImageSpec(object):
         if len(self.data_sources) == 0:
             raise ValueError("Empty data_sources.  No data sources were specified.")
 
-        if add_latlon != self._scene_has_latlon:
-            self.scene = None
-            self._scene_has_latlon = add_latlon
-
-        if self.scene is None:
-            self.scene = self._get_scene(self, add_latlon=add_latlon)
+        if add_latlon not in self._scenes:
+            # Both variants share the scene without lat/lon bands.
+            if self._base_scene is None:
+                self._base_scene = self._get_base_scene(self)
+            self._scenes[add_latlon] = self._add_latlon(self._base_scene) if add_latlon else self._base_scene
+        self.scene = self._scenes[add_latlon]
         return self.scene
 
     def set_specification(self, start_date=None, end_date=None,
@@ -126,31 +271,163 @@ class ImageSpec(object):
         self.region = self.region if filterpoly is None else filterpoly
         self.projection = self.projection if projection is None else projection
         self.scale = self.scale if scale is None else scale
-        self.scene = None
+        self._reset_scene()
+
+    def to_dict(self):
+        """
+        Serialize this ImageSpec, e.g. to ship it to worker processes or store it next to an export.
+
+        Datasource classes and composite functions are referenced by name, see register.
+        ee objects such as the region or ee.Date dates are stored as their serialized expression graph.
+
+        Returns:
+            (Dict[str, Any]):  JSON serializable, see from_dict.
+        """
+        datasources = []
+        for ds_class, kwargs, comp_fn, bands in self.data_sources:
+            datasources.append({
+                'class': registered_name(ds_class),
+                'kwargs': _encode_value(kwargs),
+                'composite_fn': None if comp_fn is None else registered_name(comp_fn),
+                'bands': None if bands is None else list(bands),
+            })
+        return {
+            'version': SPEC_VERSION,
+            'start_date': _encode_value(self.start_date),
+            'end_date': _encode_value(self.end_date),
+            'region': _encode_value(self.region),
+            'scale': _encode_value(self.scale),
+            'projection': _encode_value(self.projection),
+            'datasources': datasources,
+            'static_scenes': [_encode_value(scene) for scene in self._static_scenes],
+        }
+
+    @staticmethod
+    def from_dict(d):
+        """
+        Args:
+            d (Dict[str, Any]):  The result of ImageSpec.to_dict.
+        Returns:
+            (ImageSpec):
+        """
+        if d.get('version', None) != SPEC_VERSION:
+            raise ValueError("Unsupported ImageSpec version: {}".format(d.get('version', None)))
+        image_spec = ImageSpec(
+            _decode_value(d['start_date']), _decode_value(d['end_date']), _decode_value(d['region']),
+            _decode_value(d['scale']), _decode_value(d['projection']),
+        )
+        for datasource in d['datasources']:
+            comp_fn = datasource['composite_fn']
+            image_spec.add_datasource(
+                resolve(datasource['class']), None if comp_fn is None else resolve(comp_fn),
+                _decode_value(datasource['kwargs']), datasource['bands'],
+            )
+        for scene in d['static_scenes']:
+            image_spec.add_static_scene(_decode_value(scene))
+        return image_spec
+
+    def fingerprint(self):
+        """
+        A stable hash of to_dict.  Equal for specs built the same way, in any process.
+
+        Returns:
+            (str):  A SHA-256 hex digest.
+        """
+        return util.fingerprint(self.to_dict())
+
+    def scene_fingerprint(self, add_latlon=True):
+        """
+        A stable hash of the serialized expression graph of get_scene(add_latlon).
+        Two specs have the same scene fingerprint if and only if their scenes are the same computation,
+        even if they were built differently, so it can be used to dedupe exports or as a cache key.
+
+        Returns:
+            (str):  A SHA-256 hex digest.
+        """
+        return util.fingerprint(self.get_scene(add_latlon=add_latlon))
+
+    @staticmethod
+    def _make_datasource(image_spec, ds_class, kwargs, comp_fn):
+        """
+        Construct a datasource with the dates and region of image_spec.
+
+        Returns:
+            (Tuple[ImageDatasource, Callable[[ee.ImageCollection], ee.Image]]):  The datasource and its
+                composite function, .first() for a SingleImageDatasource without one.
+        """
+        start, end = image_spec.start_date, image_spec.end_date
+        if issubclass(ds_class, MultiImageDatasource):
+            ds_args = (image_spec.region, start, end)
+        elif issubclass(ds_class, GlobalImageDatasource):
+            ds_args = (start, end)
+        elif issubclass(ds_class, SingleImageDatasource):
+            ds_args = ()
+            if comp_fn is None:
+                comp_fn = lambda img_coll: ee.Image(img_coll.first())
+        else:
+            raise ValueError("Invalid image_spec.  {} was not a known datasource type".format(ds_class))
+        return ds_class(*ds_args, **kwargs), comp_fn
+
+    @staticmethod
+    def _datasource_image(image_spec, ds_class, kwargs, comp_fn, bands=None):
+        """
+        Return the reprojected composite of one datasource.
+        Memoized on (class, kwargs, composite_fn, bands, dates, region, scale, projection) across all ImageSpec instances,
+        so that the same client side graph objects are reused instead of being rebuilt.
+        """
+        key = _datasource_cache_key(image_spec, ds_class, kwargs, comp_fn, bands)
+        if key is not None:
+            with _datasource_cache_lock:
+                img = _datasource_cache.get(key, None)
+                if img is not None:
+                    _datasource_cache.move_to_end(key)
+                    return img
+
+        ds, comp_fn = ImageSpec._make_datasource(image_spec, ds_class, kwargs, comp_fn)
+        img_coll = ds.get_img_coll() if bands is None else ds.get_img_coll_bands(list(bands))
+        img = comp_fn(img_coll)
+        img = ImageSpec._reproject(image_spec, img)
+
+        if key is not None:
+            with _datasource_cache_lock:
+                _datasource_cache[key] = img
+                while len(_datasource_cache) > DATASOURCE_CACHE_SIZE:
+                    _datasource_cache.popitem(last=False)
+        return img
+
+    @staticmethod
+    def _reproject(image_spec, img):
+        """Reproject img to the projection and scale of image_spec.  Images are left as is with constants.UTM,
+        since every point is sampled in its own zone."""
+        if image_spec.projection == constants.UTM:
+            return img
+        return img.reproject(image_spec.projection, None, image_spec.scale)
+
+    @staticmethod
+    def _add_latlon(scene):
+        scene = ee.Algorithms.If(
+            scene.bandNames().size().eq(0),
+            scene,
+            imgtools.add_latlon(scene)
+        )
+        return ee.Image(scene)
 
     @staticmethod
     def _get_scene(image_spec, add_latlon=True, error_check=False):
         """Return the scene corresponding to an ImageSpec instance"""
+        scene = ImageSpec._get_base_scene(image_spec, error_check=error_check)
+        if add_latlon:
+            scene = ImageSpec._add_latlon(scene)
+        return scene
+
+    @staticmethod
+    def _get_base_scene(image_spec, error_check=False):
+        """Return the scene corresponding to an ImageSpec instance, without lat/lon bands"""
         processed_imagery = []
-        start, end = image_spec.start_date, image_spec.end_date
         for data_source in image_spec.data_sources:
-            ds_class, kwargs, comp_fn = data_source
-
-            if issubclass(ds_class, MultiImageDatasource):
-                ds_args = (image_spec.region, start, end)
-            elif issubclass(ds_class, GlobalImageDatasource):
-                ds_args = (start, end)
-            elif issubclass(ds_class, SingleImageDatasource):
-                ds_args = ()
-                if comp_fn is None:
-                    comp_fn = lambda img_coll: ee.Image(img_coll.first())
-            else:
-                raise ValueError("Invalid image_spec.  {} was not a known datasource type".format(ds_class))
-
-            ds = ds_class(*ds_args, **kwargs)
-            img_coll = ds.get_img_coll()
-            img = comp_fn(img_coll)
-            img = img.reproject(image_spec.projection, None, image_spec.scale)
+            ds_class, kwargs, comp_fn, bands = data_source
+
+            img = ImageSpec._datasource_image(image_spec, ds_class, kwargs, comp_fn, bands)
             processed_imagery.append(img)
 
             if error_check:
@@ -158,7 +435,7 @@ class ImageSpec(object):
 
         for img in image_spec._static_scenes:
 
-            img = img.reproject(image_spec.projection, None, image_spec.scale)
+            img = ImageSpec._reproject(image_spec, img)
             processed_imagery.append(img)
 
             if error_check:
@@ -168,17 +445,7 @@ class ImageSpec(object):
             # This should be unreachable since len(data_source) > 0
             raise ValueError("No Imagery Found")
 
-        scene = processed_imagery.pop(0)
-        for bands in processed_imagery:
-            scene = scene.addBands(bands)
-        if add_latlon:
-            scene = ee.Algorithms.If(
-                scene.bandNames().size().eq(0),
-                scene,
-                imgtools.add_latlon(scene)
-            )
-            scene = ee.Image(scene)
-        return scene
+        return imgtools.concat_bands(processed_imagery)
 
 
 def add_imagery_scene(ft, scene, scale, projection, output_size):
@@ -190,7 +457,8 @@ def add_imagery_scene(ft, scene, scale, projection, output_size):
     :type ft: ee.FeatureCollection
     :param scale: The projection's scale
     :type scale: int
-    :param projection: The projection's string designation
+    :param projection: The projection's string designation, the tiles are sampled in this projection.
+        With constants.UTM, every point is sampled in its UTM zone, see ee_tf_exports.get_array_patches_by_zone.
     :type string:
     :param output_size: The outputsize in pixels (final output is an (2 * output_size + 1) by (2 * output_size + 1) square)
     :type output_size: int
@@ -198,18 +466,19 @@ def add_imagery_scene(ft, scene, scale, projection, output_size):
     :returns: a new feature collection with an output_size by output_size tile added to each row.
     The tile's bands are stored in separate columns.
     """
-    if projection != constants.EPSG3857:
-        # gee_tools.ai_io.ee_tf_exports.get_array_patches currently only samples with projection EPSG3857
-        raise NotImplementedError("Projection must be EPSG:3857")
+    if projection == constants.UTM:
+        samples = tfexp.get_array_patches_by_zone(scene, scale, output_size, ft)
+    else:
+        samples = tfexp.get_array_patches(
+            scene, scale, output_size, ft,
+            False, False, None, None,
+            None, None, None, projection=projection
+        )
 
     ft = ee.Algorithms.If(
         scene.bandNames().size().eq(0),
         ft,
-        tfexp.get_array_patches(
-            scene, scale, output_size, ft,
-            False, False, None, None,
-            None, None, None
-        )
+        samples
     )
     ft = ee.FeatureCollection(ft)
 
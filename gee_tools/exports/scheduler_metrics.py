@@ -0,0 +1,254 @@
+"""
+Throughput and latency metrics for TaskScheduler runs.
+
+Pass a SchedulerMetrics instance to TaskScheduler.run to record, for every job,
+when it was enqueued (all dependencies completed), started (submitted to GEE),
+first seen RUNNING and finished, plus the queue depth, slot utilization and the
+number of status lookups.  The result can be dumped as JSON or as a Chrome trace
+(chrome://tracing or https://ui.perfetto.dev).
+"""
+import io
+import json
+import time
+
+from gee_tools.exports.task_journal import COMPLETED, FAILED, SKIPPED
+
+RETRY = 'RETRY'
+
+
+class SchedulerMetrics(object):
+    """
+    Collects events from a TaskScheduler run.
+
+    Time spent between started and running is spent waiting in the GEE queue,
+    time spent between enqueued and started is spent waiting for a free slot in the scheduler.
+    """
+
+    def __init__(self, callback=None, clock=time.time):
+        """
+        Args:
+            callback (Optional[Callable[[Dict[str, Any]], None]]):  Called with every event as it is recorded.
+                Events have a 'name' (run_started, job_enqueued, job_started, job_running, job_finished,
+                poll, sample or run_finished) and a 'time' plus event specific keys.
+            clock (Callable[[], float]):  Returns the current time in seconds.
+        """
+        self.callback = callback
+        self.clock = clock
+        self.jobs = dict()
+        self.samples = []
+        self.num_polls = 0
+        self.num_status_lookups = 0
+        self.poll_time = 0.0
+        self.max_processes = None
+        self.start_time = None
+        self.end_time = None
+
+    def _emit(self, name, **kwargs):
+        event = dict(kwargs, name=name, time=self.clock())
+        if self.callback is not None:
+            self.callback(event)
+        return event
+
+    def _job(self, jid):
+        record = self.jobs.get(jid, None)
+        if record is None:
+            record = self.jobs[jid] = {'enqueued': None, 'attempts': [], 'state': None}
+        return record
+
+    def run_started(self, max_processes):
+        event = self._emit('run_started', max_processes=max_processes)
+        self.max_processes = max_processes
+        if self.start_time is None:
+            self.start_time = event['time']
+
+    def run_finished(self):
+        self.end_time = self._emit('run_finished')['time']
+
+    def job_enqueued(self, job):
+        """Record the time at which all dependencies of a job completed.  Retries do not reset it."""
+        event = self._emit('job_enqueued', jid=job.jid)
+        record = self._job(job.jid)
+        if record['enqueued'] is None:
+            record['enqueued'] = event['time']
+
+    def job_started(self, job):
+        event = self._emit('job_started', jid=job.jid, task_id=getattr(job.task, 'id', None))
+        self._job(job.jid)['attempts'].append(
+            {'started': event['time'], 'running': None, 'finished': None, 'state': None}
+        )
+
+    def observe(self, job):
+        """Record the first time a job is seen in the RUNNING state."""
+        record = self.jobs.get(job.jid, None)
+        if record is None or len(record['attempts']) == 0 or job.last_status is None:
+            return
+        attempt = record['attempts'][-1]
+        if attempt['running'] is None and job.last_status['state'] == job.task.State.RUNNING:
+            attempt['running'] = self._emit('job_running', jid=job.jid)['time']
+
+    def job_finished(self, job, state):
+        """
+        Args:
+            job (Job):
+            state (str):  One of COMPLETED, FAILED, SKIPPED or RETRY.
+        """
+        event = self._emit('job_finished', jid=job.jid, state=state)
+        record = self._job(job.jid)
+        if len(record['attempts']) > 0 and record['attempts'][-1]['finished'] is None:
+            record['attempts'][-1]['finished'] = event['time']
+            record['attempts'][-1]['state'] = state
+        if state != RETRY:
+            record['state'] = state
+
+    def poll(self, num_jobs, num_lookups, duration):
+        """
+        Args:
+            num_jobs (int):  The number of jobs whose state was looked up.
+            num_lookups (int):  The number of status calls made.
+            duration (float):  The time spent in status calls, in seconds.
+        """
+        self._emit('poll', num_jobs=num_jobs, num_lookups=num_lookups, duration=duration)
+        self.num_polls += 1
+        self.num_status_lookups += num_lookups
+        self.poll_time += duration
+
+    def sample(self, queue_depth, running, max_processes):
+        """
+        Args:
+            queue_depth (int):  The number of jobs ready to start.
+            running (int):  The number of started jobs that have not finished.
+            max_processes (int):  The current number of slots.
+        """
+        event = self._emit('sample', queue_depth=queue_depth, running=running, max_processes=max_processes)
+        self.samples.append((event['time'], queue_depth, running, max_processes))
+
+    def summary(self):
+        """
+        Returns:
+            (Dict[str, float]):  Aggregate metrics.  Durations are in seconds, utilization is between 0 and 1.
+                slot_idle_time is the total time slots were free, summed over all slots.
+        """
+        attempts = [attempt for record in self.jobs.values() for attempt in record['attempts']]
+
+        def mean(values):
+            values = [v for v in values if v is not None]
+            return sum(values) / len(values) if len(values) > 0 else None
+
+        def diff(end, start):
+            return None if end is None or start is None else end - start
+
+        queue_waits = []
+        for record in self.jobs.values():
+            if len(record['attempts']) > 0:
+                queue_waits.append(diff(record['attempts'][0]['started'], record['enqueued']))
+
+        end_time = self.end_time if self.end_time is not None else self.clock()
+        makespan = diff(end_time, self.start_time)
+
+        # Integrate the number of running jobs and slots over time, using the last sample as the value until the next.
+        busy, capacity = 0.0, 0.0
+        for (t0, _, running, slots), (t1, _, _, _) in zip(self.samples, self.samples[1:] + [(end_time, 0, 0, 0)]):
+            busy += running * (t1 - t0)
+            capacity += slots * (t1 - t0)
+
+        states = [record['state'] for record in self.jobs.values()]
+        return {
+            'makespan': makespan,
+            'num_jobs': len(self.jobs),
+            'num_completed': states.count(COMPLETED),
+            'num_failed': states.count(FAILED),
+            'num_skipped': states.count(SKIPPED),
+            'num_retries': sum(1 for attempt in attempts if attempt['state'] == RETRY),
+            'num_polls': self.num_polls,
+            'num_status_lookups': self.num_status_lookups,
+            'poll_time': self.poll_time,
+            'mean_scheduler_wait': mean(queue_waits),
+            'mean_gee_queue_wait': mean([diff(a['running'], a['started']) for a in attempts]),
+            'mean_run_time': mean([diff(a['finished'], a['running']) for a in attempts]),
+            'mean_queue_depth': mean([s[1] for s in self.samples]),
+            'slot_utilization': busy / capacity if capacity > 0 else None,
+            'slot_idle_time': capacity - busy,
+        }
+
+    def to_dict(self):
+        """A JSON serializable timeline of the run."""
+        return {
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'max_processes': self.max_processes,
+            'summary': self.summary(),
+            'jobs': [dict(record, jid=str(jid)) for jid, record in self.jobs.items()],
+            'samples': [
+                {'time': t, 'queue_depth': depth, 'running': running, 'max_processes': slots}
+                for t, depth, running, slots in self.samples
+            ],
+        }
+
+    def to_json(self, path):
+        """Write the timeline returned by to_dict to path."""
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    def to_chrome_trace(self, path=None):
+        """
+        Convert the timeline to the Chrome trace event format.
+        Each attempt of a job is drawn on its own row with a 'scheduler queue', 'gee queue'
+        and 'running' span, and the queue depth and running jobs are drawn as counters.
+
+        Args:
+            path (Optional[str]):  If provided, the trace is written to path.
+        Returns:
+            (Dict[str, Any]):  The trace.
+        """
+        origin = self.start_time if self.start_time is not None else 0.0
+
+        def us(t):
+            return int(round((t - origin) * 1e6))
+
+        events = []
+        spans = []
+        for jid, record in self.jobs.items():
+            for attempt_index, attempt in enumerate(record['attempts']):
+                queued_since = record['enqueued'] if attempt_index == 0 else None
+                spans.append((jid, queued_since, attempt))
+
+        # Assign each span to the lowest free row so that concurrent jobs do not overlap.
+        spans.sort(key=lambda span: span[2]['started'])
+        row_free_at = []
+        for jid, queued_since, attempt in spans:
+            end = attempt['finished']
+            if end is None:
+                end = self.end_time if self.end_time is not None else attempt['started']
+            begin = attempt['started'] if queued_since is None else queued_since
+            row = next((i for i, free_at in enumerate(row_free_at) if free_at <= begin), len(row_free_at))
+            if row == len(row_free_at):
+                row_free_at.append(end)
+            else:
+                row_free_at[row] = end
+
+            running = attempt['running'] if attempt['running'] is not None else end
+            phases = [
+                ('scheduler queue', queued_since, attempt['started']),
+                ('gee queue', attempt['started'], running),
+                ('running', running, end),
+            ]
+            for phase, t0, t1 in phases:
+                if t0 is None or t1 is None:
+                    continue
+                events.append({
+                    'name': str(jid), 'cat': phase, 'ph': 'X', 'pid': 1, 'tid': row,
+                    'ts': us(t0), 'dur': max(us(t1) - us(t0), 0),
+                    'args': {'phase': phase, 'state': attempt['state']},
+                })
+
+        for t, depth, running, slots in self.samples:
+            events.append({
+                'name': 'slots', 'ph': 'C', 'pid': 1, 'ts': us(t),
+                'args': {'queue_depth': depth, 'running': running, 'max_processes': slots},
+            })
+
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path is not None:
+            with io.open(path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(trace))
+        return trace
@@ -0,0 +1,324 @@
+"""
+Sharding of large point FeatureCollections into table exports of bounded size.
+
+Points are assigned a shard property server side, either the cell of a spatial grid
+or a hash bucket, and each shard is exported by its own task.  A JSON manifest records
+which cells or buckets every shard covers and where it was exported, so that the
+outputs can be reassembled and failed shards re-run on their own.
+"""
+import io
+import json
+import math
+import logging
+
+import ee
+
+logger = logging.getLogger(__name__)
+
+GRID = 'grid'
+HASH = 'hash'
+
+# The property holding the grid cell or hash bucket of every point.
+SHARD_PROPERTY = 'gee_tools_shard'
+# The property holding the split (e.g. train, val or test) of every point, see add_split.
+SPLIT_PROPERTY = 'gee_tools_split'
+
+MANIFEST_VERSION = 1
+
+
+class ShardingError(RuntimeError):
+    pass
+
+
+class Shard(object):
+    """A subset of the points, exported by one task."""
+
+    def __init__(self, index, values, num_points=None, name=None):
+        """
+        Args:
+            index (int):
+            values (List[Union[str, int]]):  The grid cells or hash buckets in the shard.
+            num_points (Optional[int]):  The number of points, if known.
+            name (Optional[str]):  Defaults to 'shard{index}'.
+        """
+        self.index = index
+        self.values = values
+        self.num_points = num_points
+        self.name = 'shard{}'.format(index) if name is None else name
+
+    def filter(self, fc):
+        """
+        Args:
+            fc (ee.FeatureCollection):  Points with a SHARD_PROPERTY, see add_grid_cell and add_hash_bucket.
+        Returns:
+            (ee.FeatureCollection):  The points of this shard.
+        """
+        return fc.filter(ee.Filter.inList(SHARD_PROPERTY, self.values))
+
+    def to_dict(self):
+        return {'index': self.index, 'name': self.name, 'values': self.values, 'num_points': self.num_points}
+
+    @staticmethod
+    def from_dict(d):
+        return Shard(d['index'], d['values'], d.get('num_points', None), d['name'])
+
+    def __repr__(self):
+        return 'Shard({}, {} values, {} points)'.format(self.name, len(self.values), self.num_points)
+
+
+def grid_cell_id(lon, lat, cell_size):
+    """
+    Args:
+        lon (float):
+        lat (float):
+        cell_size (float):  In degrees.
+    Returns:
+        (str):  The id of the grid cell containing the point, as assigned by add_grid_cell.
+    """
+    return '{}_{}'.format(int(math.floor(lon / cell_size)), int(math.floor(lat / cell_size)))
+
+
+def add_grid_cell(fc, cell_size):
+    """
+    Set SHARD_PROPERTY to the id of the grid cell of every point, see grid_cell_id.
+
+    Args:
+        fc (ee.FeatureCollection):  Points.
+        cell_size (float):  In degrees.
+    Returns:
+        (ee.FeatureCollection):
+    """
+    def add_cell(feature):
+        coords = feature.geometry().coordinates()
+        x = ee.Number(coords.get(0)).divide(cell_size).floor().int()
+        y = ee.Number(coords.get(1)).divide(cell_size).floor().int()
+        return feature.set(SHARD_PROPERTY, ee.String(x.format()).cat('_').cat(y.format()))
+    return fc.map(add_cell)
+
+
+def map_groups(fc, property_name, fn):
+    """
+    Apply fn separately to the points of every distinct value of a property, e.g. of SHARD_PROPERTY
+    after add_grid_cell, so that every server side call made by fn only covers one group.
+
+    Args:
+        fc (ee.FeatureCollection):
+        property_name (str):
+        fn (Callable[[ee.FeatureCollection, ee.ComputedObject], ee.FeatureCollection]):  Called with the
+            points of a group and the value of property_name they share.
+    Returns:
+        (ee.FeatureCollection):  The flattened outputs of fn.
+    """
+    values = ee.List(fc.aggregate_array(property_name)).distinct()
+    groups = values.map(lambda value: fn(fc.filter(ee.Filter.eq(property_name, value)), value))
+    return ee.FeatureCollection(groups).flatten()
+
+
+def _random_column(fc, column, seed, id_property):
+    if id_property is None:
+        return fc.randomColumn(column, seed)
+    return fc.randomColumn(column, seed, 'uniform', [id_property])
+
+
+def add_hash_bucket(fc, num_buckets, key_property=None, seed=0, id_property=None):
+    """
+    Set SHARD_PROPERTY to a bucket in [0, num_buckets) for every point.
+
+    Args:
+        fc (ee.FeatureCollection):
+        num_buckets (int):
+        key_property (Optional[str]):  An integer property, the bucket is its value modulo num_buckets,
+            also for negative values.  If None, points are bucketed by the deterministic pseudorandom number
+            randomColumn derives from their system:index, so buckets are stable as long as the collection is.
+            To shard by a string key, pass it as id_property instead.
+        seed (int):  The seed of randomColumn.
+        id_property (Optional[str]):  A property uniquely identifying every point, used instead of
+            system:index to derive the pseudorandom number, so buckets do not depend on the collection order.
+    Returns:
+        (ee.FeatureCollection):
+    """
+    if key_property is not None:
+        # EE's mod has the sign of the dividend, ((k % n) + n) % n is in [0, n) for negative keys too.
+        return fc.map(lambda f: f.set(
+            SHARD_PROPERTY, ee.Number(f.get(key_property)).int().mod(num_buckets).add(num_buckets).mod(num_buckets)
+        ))
+
+    column = SHARD_PROPERTY + '_random'
+    fc = _random_column(fc, column, seed, id_property)
+    return fc.map(lambda f: f.set(
+        SHARD_PROPERTY, ee.Number(f.get(column)).multiply(num_buckets).floor().int()
+    ))
+
+
+def add_split(fc, splits, seed=0, id_property=None):
+    """
+    Set SPLIT_PROPERTY to the name of a split for every point, e.g. train, val or test.
+
+    Args:
+        fc (ee.FeatureCollection):
+        splits (List[Tuple[str, float]]):  The name and fraction of every split.  Fractions must sum to 1.
+        seed (int):  The seed of randomColumn.  Use a different seed than add_hash_bucket, so that
+            splits and buckets are independent.
+        id_property (Optional[str]):  See add_hash_bucket.
+    Returns:
+        (ee.FeatureCollection):
+    """
+    fractions = [fraction for _, fraction in splits]
+    if len(splits) == 0 or min(fractions) < 0 or abs(sum(fractions) - 1.0) > 1e-6:
+        raise ShardingError('Split fractions must be non negative and sum to 1, got {}'.format(splits))
+    # The upper bounds of all but the last split.
+    bounds = [sum(fractions[:i + 1]) for i in range(len(fractions) - 1)]
+    names = ee.List([name for name, _ in splits])
+
+    column = SPLIT_PROPERTY + '_random'
+    fc = _random_column(fc, column, seed, id_property)
+
+    def set_split(f):
+        value = ee.Number(f.get(column))
+        index = ee.List([value.gte(bound) for bound in bounds]).reduce(ee.Reducer.sum()) if bounds else 0
+        return f.set(SPLIT_PROPERTY, names.get(ee.Number(index).int()))
+    return fc.map(set_split)
+
+
+def _cell_order(cell_id):
+    x, y = cell_id.split('_')
+    return int(y), int(x)
+
+
+def plan_grid_shards(cell_counts, max_points_per_shard):
+    """
+    Pack grid cells into shards of at most max_points_per_shard points.
+    Cells are visited row by row so that shards are spatially compact.
+    A cell with more points than max_points_per_shard becomes a shard of its own.
+
+    Args:
+        cell_counts (Dict[str, int]):  The number of points of every grid cell,
+            e.g. from add_grid_cell(fc).aggregate_histogram(SHARD_PROPERTY).
+        max_points_per_shard (int):
+    Returns:
+        (List[Shard]):
+    """
+    if max_points_per_shard < 1:
+        raise ShardingError('max_points_per_shard must be at least 1.')
+    shards = []
+    values, num_points = [], 0
+    for cell_id in sorted(cell_counts, key=_cell_order):
+        count = int(cell_counts[cell_id])
+        if count > max_points_per_shard:
+            logger.warning('Grid cell {} has {} points, more than max_points_per_shard.  '
+                           'Use a smaller cell_size to split it.'.format(cell_id, count))
+        if len(values) > 0 and num_points + count > max_points_per_shard:
+            shards.append(Shard(len(shards), values, num_points))
+            values, num_points = [], 0
+        values.append(cell_id)
+        num_points += count
+    if len(values) > 0:
+        shards.append(Shard(len(shards), values, num_points))
+    return shards
+
+
+def plan_hash_shards(num_points=None, max_points_per_shard=None, num_shards=None):
+    """
+    One shard per hash bucket.  The number of points per shard is only bounded in expectation.
+
+    Args:
+        num_points (Optional[int]):  Required if num_shards is None.
+        max_points_per_shard (Optional[int]):  Required if num_shards is None.
+        num_shards (Optional[int]):  Defaults to ceil(num_points / max_points_per_shard).
+    Returns:
+        (List[Shard]):
+    """
+    if num_shards is None:
+        if num_points is None or max_points_per_shard is None:
+            raise ShardingError('Either num_shards or num_points and max_points_per_shard are required.')
+        num_shards = max(int(math.ceil(num_points / float(max_points_per_shard))), 1)
+    if num_shards < 1:
+        raise ShardingError('num_shards must be at least 1.')
+    return [Shard(i, [i]) for i in range(num_shards)]
+
+
+class TableExporter(object):
+    """
+    Exports the shards of a collection as tables, to Cloud Storage or Drive.
+    Can be passed as export_fn to ExportManager.sample_tiles_sharded.
+    """
+
+    def __init__(self, prefix, bucket=None, file_format='TFRecord', selectors=None):
+        """
+        Args:
+            prefix (str):  Prepended to the shard names to form file name prefixes.
+            bucket (Optional[str]):  The Cloud Storage bucket.  If None, shards are exported to Drive.
+            file_format (str):  Defaults to 'TFRecord'.
+            selectors (Optional[List[str]]):  The properties to export.  None for all of them.
+        """
+        self.prefix = prefix
+        self.bucket = bucket
+        self.file_format = file_format
+        self.selectors = selectors
+
+    def output_path(self, shard):
+        """The file name prefix of a shard, a gs:// URI for Cloud Storage."""
+        if self.bucket is None:
+            return self.prefix + shard.name
+        return 'gs://{}/{}{}'.format(self.bucket, self.prefix, shard.name)
+
+    def __call__(self, collection, shard, description):
+        """
+        Args:
+            collection (ee.FeatureCollection):  The samples of the shard.
+            shard (Shard):
+            description (str):  The task description.
+        Returns:
+            (ee.batch.Task):  An unstarted task.
+        """
+        kwargs = {
+            'collection': collection,
+            'description': description,
+            'fileNamePrefix': self.prefix + shard.name,
+            'fileFormat': self.file_format,
+        }
+        if self.selectors is not None:
+            kwargs['selectors'] = self.selectors
+        if self.bucket is None:
+            return ee.batch.Export.table.toDrive(**kwargs)
+        return ee.batch.Export.table.toCloudStorage(bucket=self.bucket, **kwargs)
+
+
+def write_manifest(path, shards, jids, export_fn=None, **metadata):
+    """
+    Write a JSON manifest of the shards of an export.
+
+    Args:
+        path (str):
+        shards (List[Shard]):
+        jids (List[Hashable]):  The TaskScheduler job id of every shard.
+        export_fn (Optional[Any]):  If it has an output_path method, like TableExporter,
+            the output of every shard is recorded.
+        metadata:  Other JSON serializable values to record, e.g. the output bands.
+    """
+    records = []
+    for shard, jid in zip(shards, jids):
+        record = shard.to_dict()
+        record['jid'] = jid
+        if hasattr(export_fn, 'output_path'):
+            record['output'] = export_fn.output_path(shard)
+        records.append(record)
+    manifest = dict(metadata)
+    manifest.update({'version': MANIFEST_VERSION, 'shard_property': SHARD_PROPERTY, 'shards': records})
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(manifest, sort_keys=True, indent=2))
+
+
+def read_manifest(path):
+    """
+    Args:
+        path (str):  A manifest written by write_manifest.
+    Returns:
+        (Tuple[Dict[str, Any], List[Shard]]):  The manifest and its shards.  Every shard record in
+            manifest['shards'] also has the 'jid' and, if known, the 'output' of the shard.
+    """
+    with io.open(path, 'r', encoding='utf-8') as f:
+        manifest = json.loads(f.read())
+    if manifest.get('version', None) != MANIFEST_VERSION:
+        raise ShardingError('Unsupported manifest version in {}: {}'.format(path, manifest.get('version', None)))
+    return manifest, [Shard.from_dict(record) for record in manifest['shards']]
@@ -0,0 +1,288 @@
+"""
+A discrete-event simulation of the GEE batch backend, for benchmarking the TaskScheduler.
+
+Everything runs on a VirtualClock: sleeping advances the clock instead of blocking,
+so a run that would take days against GEE finishes in seconds and is fully deterministic.
+The SimulatedBackend models task durations, failures, the number of tasks GEE runs at
+once per account and the latency of start and status RPCs.
+
+Example:
+    python -m gee_tools.exports.simulation --nodes 10 1000 100000 --workers 20
+"""
+import time
+import heapq
+import random
+import argparse
+import itertools
+import collections
+
+import ee
+
+from gee_tools.exports.scheduler_metrics import SchedulerMetrics
+from gee_tools.exports.task_scheduler import TaskScheduler, RetryPolicy
+
+
+class VirtualClock(object):
+    """A clock that only moves forward when sleep is called."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
+
+
+class SimulatedTask(object):
+    """Stand-in for ee.batch.Task that runs on a SimulatedBackend."""
+
+    def __init__(self, backend, duration, fail=False, error_message='Internal error.'):
+        """
+        Args:
+            backend (SimulatedBackend):
+            duration (float):  Seconds the task runs once a worker picks it up.
+            fail (bool):  If True, the task ends FAILED with error_message instead of COMPLETED.
+            error_message (str):
+        """
+        self.backend = backend
+        self.duration = duration
+        self.fail = fail
+        self.error_message = error_message
+        self.id = None
+        self.state = ee.batch.Task.State.UNSUBMITTED
+        self.submitted_at = None
+        self.running_at = None
+        self.finished_at = None
+
+    def start(self):
+        if self.id is not None:
+            raise RuntimeError('Task already started.')
+        self.backend.submit(self)
+
+    def status(self):
+        return self.backend.status([self])[0]
+
+    def _status(self):
+        if self.state == ee.batch.Task.State.FAILED:
+            return {'id': self.id, 'state': self.state, 'error_message': self.error_message}
+        return {'id': self.id, 'state': self.state}
+
+    @property
+    def State(self):
+        return ee.batch.Task.State
+
+
+class SimulatedBackend(object):
+    """
+    A GEE account that runs at most num_workers tasks at a time.
+    Submitted tasks wait READY in a FIFO queue until a worker is free.
+
+    Every RPC advances the clock by its latency.  The instance can be passed
+    to TaskScheduler.run as status_fn, in which case it behaves like batch_task_status.
+    """
+
+    def __init__(self, clock=None, num_workers=None, status_latency=0.0, start_latency=0.0):
+        """
+        Args:
+            clock (Optional[VirtualClock]):  Defaults to a new VirtualClock starting at 0.
+            num_workers (Optional[int]):  The number of tasks run at once.  None for no limit.
+            status_latency (float):  Seconds spent in every status RPC.
+            start_latency (float):  Seconds spent in every task.start() RPC.
+        """
+        self.clock = VirtualClock() if clock is None else clock
+        self.num_workers = num_workers
+        self.status_latency = status_latency
+        self.start_latency = start_latency
+        self.num_status_rpcs = 0
+        self.num_start_rpcs = 0
+        self.max_running = 0
+        self._queue = collections.deque()
+        self._running = []
+        self._seq = itertools.count()
+
+    @property
+    def num_rpcs(self):
+        return self.num_status_rpcs + self.num_start_rpcs
+
+    def _has_free_worker(self):
+        return self.num_workers is None or len(self._running) < self.num_workers
+
+    def _run_task(self, task, now):
+        task.state = ee.batch.Task.State.RUNNING
+        task.running_at = now
+        heapq.heappush(self._running, (now + task.duration, next(self._seq), task))
+        self.max_running = max(self.max_running, len(self._running))
+
+    def _advance(self):
+        """Process every task that finished up to the current time, in order."""
+        now = self.clock()
+        while len(self._running) > 0 and self._running[0][0] <= now:
+            finished_at, _, task = heapq.heappop(self._running)
+            task.state = ee.batch.Task.State.FAILED if task.fail else ee.batch.Task.State.COMPLETED
+            task.finished_at = finished_at
+            if len(self._queue) > 0:
+                self._run_task(self._queue.popleft(), finished_at)
+
+    def submit(self, task):
+        self.clock.sleep(self.start_latency)
+        self.num_start_rpcs += 1
+        self._advance()
+        task.id = 'SIMULATED_TASK_{}'.format(next(self._seq))
+        task.state = ee.batch.Task.State.READY
+        task.submitted_at = self.clock()
+        if self._has_free_worker():
+            self._run_task(task, self.clock())
+        else:
+            self._queue.append(task)
+
+    def status(self, tasks):
+        """
+        One bulk status RPC.
+
+        Args:
+            tasks (List[SimulatedTask]):
+        Returns:
+            (List[Dict[str, Any]]):  The status of every task.
+        """
+        self.clock.sleep(self.status_latency)
+        self.num_status_rpcs += 1
+        self._advance()
+        return [task._status() for task in tasks]
+
+    def __call__(self, tasks):
+        return self.status(tasks)
+
+
+def random_dag(num_nodes, max_dependencies=2, window=100, rng=None):
+    """
+    A random DAG in which every node depends on up to max_dependencies of the window nodes added before it.
+
+    Args:
+        num_nodes (int):
+        max_dependencies (int):
+        window (int):
+        rng (Optional[random.Random]):
+    Returns:
+        (List[Tuple[int, List[int]]]):  (jid, dependencies) pairs in topological order.
+    """
+    rng = random.Random(0) if rng is None else rng
+    dag = []
+    for i in range(num_nodes):
+        candidates = range(max(0, i - window), i)
+        num_dependencies = min(rng.randint(0, max_dependencies), len(candidates))
+        dag.append((i, sorted(rng.sample(candidates, num_dependencies))))
+    return dag
+
+
+def run_benchmark(num_nodes, max_processes=8, sleep_time=120.0, min_sleep_time=None, num_workers=None,
+                  min_duration=60.0, max_duration=600.0, failure_rate=0.0, retry_policy=None,
+                  status_latency=0.5, start_latency=0.5, batch_status=True, max_dependencies=2, seed=0,
+                  clock=None):
+    """
+    Run a TaskScheduler over a random DAG on a SimulatedBackend.
+
+    Args:
+        num_nodes (int):  The number of tasks.
+        max_processes (Union[int, ConcurrencyController]):  See TaskScheduler.run.
+            Controllers must use the same clock as the simulation.
+        sleep_time (float):  See TaskScheduler.run
+        min_sleep_time (Optional[float]):  See TaskScheduler.run
+        num_workers (Optional[int]):  The number of tasks the backend runs at once.  None for no limit.
+        min_duration (float):  Task durations are uniform between min_duration and max_duration seconds.
+        max_duration (float):
+        failure_rate (float):  The probability of every attempt to fail with an internal error.
+        retry_policy (Optional[RetryPolicy]):  If provided, failed tasks are retried.
+            Pass a policy with a seeded rng for reproducible retry delays.
+        status_latency (float):  Seconds spent in every status RPC.
+        start_latency (float):  Seconds spent in every task.start() RPC.
+        batch_status (bool):  If True, the backend is used as status_fn, otherwise task.status() is
+            called once per task.
+        max_dependencies (int):  See random_dag.
+        seed (int):  Seeds the DAG, task durations and failures.
+        clock (Optional[VirtualClock]):  Defaults to a new VirtualClock starting at 0.
+    Returns:
+        (Dict[str, float]):  The SchedulerMetrics summary, plus slot_idle_time, the number of RPCs
+            and the wall time of the simulation in seconds.
+    """
+    rng = random.Random(seed)
+    clock = VirtualClock() if clock is None else clock
+    backend = SimulatedBackend(clock, num_workers=num_workers, status_latency=status_latency,
+                               start_latency=start_latency)
+
+    def make_task():
+        return SimulatedTask(backend, rng.uniform(min_duration, max_duration), fail=rng.random() < failure_rate)
+
+    scheduler = TaskScheduler()
+    for jid, dependencies in random_dag(num_nodes, max_dependencies, rng=rng):
+        if retry_policy is None:
+            scheduler.add_task(make_task(), jid, dependencies)
+        else:
+            scheduler.add_task(None, jid, dependencies, retry_policy=retry_policy, task_factory=make_task)
+
+    metrics = SchedulerMetrics(clock=clock)
+    wall_start = time.time()
+    scheduler.run(max_processes=max_processes, sleep_time=sleep_time, min_sleep_time=min_sleep_time,
+                  status_fn=backend if batch_status else None, metrics=metrics, clock=clock, sleep=clock.sleep)
+
+    result = metrics.summary()
+    result.update({
+        'num_nodes': num_nodes,
+        'num_rpcs': backend.num_rpcs,
+        'num_status_rpcs': backend.num_status_rpcs,
+        'num_start_rpcs': backend.num_start_rpcs,
+        'max_backend_running': backend.max_running,
+        'wall_time': time.time() - wall_start,
+    })
+    return result
+
+
+BENCHMARK_COLUMNS = ['num_nodes', 'makespan', 'slot_idle_time', 'slot_utilization', 'num_rpcs',
+                     'num_polls', 'num_failed', 'num_skipped', 'num_retries', 'wall_time']
+
+
+def format_results(results, columns=None):
+    """
+    Args:
+        results (List[Dict[str, Any]]):  Results of run_benchmark.
+        columns (Optional[List[str]]):  Defaults to BENCHMARK_COLUMNS.
+    Returns:
+        (str):  A fixed width table.
+    """
+    columns = BENCHMARK_COLUMNS if columns is None else columns
+
+    def fmt(value):
+        if isinstance(value, float):
+            return '{:.3f}'.format(value) if abs(value) < 10 else '{:.0f}'.format(value)
+        return str(value)
+
+    rows = [columns] + [[fmt(result.get(column, None)) for column in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the TaskScheduler on a simulated GEE backend.')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--max-processes', type=int, default=8)
+    parser.add_argument('--sleep-time', type=float, default=120.0)
+    parser.add_argument('--min-sleep-time', type=float, default=None)
+    parser.add_argument('--workers', type=int, default=None, help='Tasks run at once by the backend.')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--retries', type=int, default=0, help='Maximum attempts per task, 0 for no retries.')
+    parser.add_argument('--status-latency', type=float, default=0.5)
+    parser.add_argument('--start-latency', type=float, default=0.5)
+    parser.add_argument('--no-batch-status', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    policy = RetryPolicy(max_attempts=args.retries, rng=random.Random(args.seed)) if args.retries > 0 else None
+    print(format_results([
+        run_benchmark(num_nodes, max_processes=args.max_processes, sleep_time=args.sleep_time,
+                      min_sleep_time=args.min_sleep_time, num_workers=args.workers,
+                      failure_rate=args.failure_rate, retry_policy=policy,
+                      status_latency=args.status_latency, start_latency=args.start_latency,
+                      batch_status=not args.no_batch_status, seed=args.seed)
+        for num_nodes in args.nodes
+    ]))
@@ -0,0 +1,136 @@
+"""
+An append-only journal of TaskScheduler runs, stored as JSON lines.
+
+Each line records one event for one job:
+    {"event": "added", "jid": ..., "dependencies": [...]}
+    {"event": "started", "jid": ..., "task_id": ...}
+    {"event": "finished", "jid": ..., "state": "COMPLETED" | "FAILED" | "SKIPPED"}
+
+The journal lets a TaskScheduler resume after the driver process dies:
+completed jobs are skipped and jobs that were still running are re-attached
+to their GEE task by ID instead of being exported again.
+"""
+import io
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+SKIPPED = 'SKIPPED'
+
+
+def _to_json_jid(jid):
+    if isinstance(jid, tuple):
+        return [_to_json_jid(j) for j in jid]
+    return jid
+
+
+def _from_json_jid(jid):
+    """JSON turns tuples into lists, turn them back so that jids are hashable."""
+    if isinstance(jid, list):
+        return tuple(_from_json_jid(j) for j in jid)
+    return jid
+
+
+class JournalEntry(object):
+    """The latest known state of one job in a journal."""
+
+    def __init__(self, jid):
+        self.jid = jid
+        self.dependencies = []
+        self.task_id = None
+        self.state = None
+
+    def in_flight(self):
+        """True if the job was started but no terminal state was recorded."""
+        return self.task_id is not None and self.state is None
+
+    def __repr__(self):
+        return 'JournalEntry({}, {}, {})'.format(self.jid, self.task_id, self.state)
+
+
+class TaskJournal(object):
+    """
+    Append-only JSON-lines journal of job ids, GEE task ids,
+    dependencies and terminal states.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str):  The journal file.  It is created on the first write and never truncated.
+        """
+        self.path = path
+
+    def _append(self, records):
+        lines = [json.dumps(record, sort_keys=True) + '\n' for record in records]
+        if len(lines) == 0:
+            return
+        with io.open(self.path, 'a', encoding='utf-8') as f:
+            f.write(u''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_jobs(self, jobs):
+        """
+        Args:
+            jobs (Iterable[Job]):  Jobs whose ids and dependencies will be recorded.
+        """
+        self._append([
+            {'event': 'added', 'jid': _to_json_jid(job.jid),
+             'dependencies': [_to_json_jid(dep_jid) for dep_jid in job.dependencies]}
+            for job in jobs
+        ])
+
+    def record_started(self, jid, task_id):
+        self._append([{'event': 'started', 'jid': _to_json_jid(jid), 'task_id': task_id}])
+
+    def record_finished(self, jid, state):
+        """
+        Args:
+            jid (Hashable):  The job id.
+            state (str):  One of COMPLETED, FAILED or SKIPPED.
+        """
+        self._append([{'event': 'finished', 'jid': _to_json_jid(jid), 'state': state}])
+
+    def load(self):
+        """
+        Replay the journal.
+
+        Returns:
+            (Dict[Hashable, JournalEntry]):  The latest known state of every job in the journal.
+                Empty if the journal does not exist yet.
+        """
+        entries = dict()
+        if not os.path.exists(self.path):
+            return entries
+
+        with io.open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f):
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash in the middle of a write can leave a truncated last line.
+                    logger.warning('Ignoring malformed line {} in {}'.format(line_number + 1, self.path))
+                    continue
+
+                jid = _from_json_jid(record['jid'])
+                entry = entries.get(jid, None)
+                if entry is None:
+                    entry = entries[jid] = JournalEntry(jid)
+
+                event = record['event']
+                if event == 'added':
+                    entry.dependencies = [_from_json_jid(dep_jid) for dep_jid in record['dependencies']]
+                elif event == 'started':
+                    entry.task_id = record['task_id']
+                    entry.state = None
+                elif event == 'finished':
+                    entry.state = record['state']
+        return entries
@@ -2,29 +2,204 @@
 Author: Anthony Perez
 """
 import time
+import heapq
+import random
+import logging
 import itertools
+import collections
 
 import ee
 
+from gee_tools.exports import task_journal, scheduler_metrics
+from gee_tools.exports.concurrency import ConcurrencyController, FixedConcurrency
+
+logger = logging.getLogger(__name__)
+
 
 class TaskSchedulerError(RuntimeError):
     pass
 
 
+class BatchTaskStatus(object):
+    """
+    Look up the status of many tasks with a single ee.data.getTaskList call,
+    instead of one task.status() call per task.
+
+    Tasks missing from the task list (e.g. tasks that were started moments ago) are reported as READY.
+    A task that is still missing after max_missing_polls consecutive lookups, e.g. because it dropped
+    off the list, is looked up by id with ee.data.getTaskStatus, so that it cannot stay READY forever.
+    Tasks that do not exist anymore are reported as FAILED.
+    """
+
+    def __init__(self, max_missing_polls=3):
+        """
+        Args:
+            max_missing_polls (int):  The number of lookups a task may be missing from the task list.
+        """
+        self.max_missing_polls = max_missing_polls
+        self.missing_polls = collections.Counter()
+
+    def _lookup(self, task_ids):
+        statuses = {}
+        for status in ee.data.getTaskStatus(task_ids):
+            if status['state'] == 'UNKNOWN':
+                status = {'id': status['id'], 'state': ee.batch.Task.State.FAILED,
+                          'error_message': 'Task {} was not found.'.format(status['id'])}
+            statuses[status['id']] = status
+        for task_id in task_ids:
+            del self.missing_polls[task_id]
+        return statuses
+
+    def __call__(self, tasks):
+        """
+        Args:
+            tasks (List[ee.batch.Task]):  Tasks that have already been started.
+        Returns:
+            (List[Dict[str, Any]]):  One status dict per task, in the same order as tasks.
+        """
+        statuses = {status['id']: status for status in ee.data.getTaskList()}
+        missing = []
+        for task in tasks:
+            if task.id in statuses:
+                self.missing_polls.pop(task.id, None)
+                continue
+            self.missing_polls[task.id] += 1
+            if self.missing_polls[task.id] >= self.max_missing_polls:
+                missing.append(task.id)
+        if len(missing) > 0:
+            statuses.update(self._lookup(missing))
+        return [statuses.get(task.id, {'state': ee.batch.Task.State.READY}) for task in tasks]
+
+
+# Missing tasks are counted by task id, so one instance can be shared by all schedulers.
+batch_task_status = BatchTaskStatus()
+
+
+def _list_tasks_by_id(task_ids):
+    """
+    Look up started tasks by id with a single ee.batch.Task.list call.
+    Returns:
+        (Dict[str, ee.batch.Task]):  The tasks that were found.
+    """
+    task_ids = set(task_ids)
+    return {task.id: task for task in ee.batch.Task.list() if task.id in task_ids}
+
+
+def _backoff_sleep_times(sleep_time, min_sleep_time=None, factor=2.0):
+    """
+    Yield the time to sleep between consecutive polls.
+    Starts at min_sleep_time and grows geometrically up to sleep_time.
+    If min_sleep_time is None, always yields sleep_time.
+    """
+    current = sleep_time if min_sleep_time is None else min(min_sleep_time, sleep_time)
+    while True:
+        yield current
+        current = min(current * factor, sleep_time)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed task should be submitted again and how long to wait before doing so.
+    """
+
+    # Lower case substrings of error messages of failures that are usually transient.
+    DEFAULT_RETRYABLE_ERRORS = (
+        'internal error',
+        'computation timed out',
+        'quota exceeded',
+        'capacity exceeded',
+        'too many',
+        'rate limit',
+        'service unavailable',
+        'deadline exceeded',
+        'backend error',
+        'try again',
+    )
+
+    def __init__(self, max_attempts=3, base_delay=60.0, max_delay=3600.0, jitter=0.5,
+                 retryable_errors=DEFAULT_RETRYABLE_ERRORS, classifier=None, rng=None):
+        """
+        Args:
+            max_attempts (int):  The maximum number of times a job is started, including the first attempt.
+            base_delay (float):  Delay before the first retry, in seconds.  Doubles with each retry.
+            max_delay (float):  The maximum delay between retries, in seconds.
+            jitter (float):  Between 0 and 1.  Each delay is drawn uniformly from
+                [(1 - jitter) * delay, delay] so that many failed tasks are not resubmitted at once.
+            retryable_errors (Iterable[str]):  A failure is retryable if its error message contains
+                one of these strings (case insensitive).
+            classifier (Optional[Callable[[Dict[str, Any]], bool]]):  If provided, used instead of
+                retryable_errors.  Takes the status dict of the failed task (see ee.batch.Task.status)
+                and returns True if the failure is retryable.
+            rng (Optional[random.Random]):  Draws the jitter.  Defaults to the random module.
+        """
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1, got {}'.format(max_attempts))
+        if not 0 <= jitter <= 1:
+            raise ValueError('jitter must be between 0 and 1, got {}'.format(jitter))
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retryable_errors = [error.lower() for error in retryable_errors]
+        self.classifier = classifier
+        self.rng = random if rng is None else rng
+
+    def is_retryable(self, status):
+        """
+        Args:
+            status (Dict[str, Any]):  The status dict of a failed task.
+        Returns:
+            (bool):  True if the failure is transient.  Cancelled tasks are never retried.
+        """
+        if status.get('state', None) != ee.batch.Task.State.FAILED:
+            return False
+        if self.classifier is not None:
+            return self.classifier(status)
+        error_message = (status.get('error_message', None) or '').lower()
+        return any(error in error_message for error in self.retryable_errors)
+
+    def delay(self, attempt):
+        """
+        Args:
+            attempt (int):  The number of attempts made so far (>= 1).
+        Returns:
+            (float):  The time to wait before the next attempt, in seconds.
+        """
+        delay = min(self.base_delay * 2.0 ** (attempt - 1), self.max_delay)
+        return self.rng.uniform((1.0 - self.jitter) * delay, delay)
+
+
 class Job(object):
 
-    def __init__(self, task, jid, dependencies):
+    def __init__(self, task, jid, dependencies, started=False, priority=0, group=None,
+                 retry_policy=None, task_factory=None):
         self.task = task
         self.jid = jid
         self.dependencies = dependencies
+        self.priority = priority
+        self.group = group
+        self.retry_policy = retry_policy
+        self.task_factory = task_factory
+        self.attempts = 0
+        self.last_status = None
+        self._started = started
         self._failed = False
         self._success = False
         self._finished = False
 
-    def _update_state(self):
-        if self._finished:
+    def _update_state(self, status=None):
+        """
+        Refresh the job state.
+        Args:
+            status (Optional[Dict[str, Any]]):  A status dict as returned by task.status().
+                If None, task.status() is called.  Unstarted tasks are never looked up.
+        """
+        if self._finished or not self._started:
             return
-        status = self.task.status()['state']
+        if status is None:
+            status = self.task.status()
+        self.last_status = status
+        status = status['state']
         self._finished = status not in [self.task.State.UNSUBMITTED, self.task.State.READY, self.task.State.RUNNING]
         self._failed = status in [self.task.State.FAILED, self.task.State.CANCEL_REQUESTED, self.task.State.CANCELLED]
         self._success = status == self.task.State.COMPLETED
@@ -48,6 +223,30 @@ class Job(object):
 
     def start(self):
         self.task.start()
+        self._started = True
+        self.attempts += 1
+
+    def can_retry(self):
+        """True if the job failed with a retryable error and has attempts left."""
+        return (
+            self._failed and self.retry_policy is not None and self.last_status is not None and
+            self.attempts < self.retry_policy.max_attempts and
+            self.retry_policy.is_retryable(self.last_status)
+        )
+
+    def restart(self):
+        """Replace the failed task by a new task from task_factory, since started tasks cannot be restarted."""
+        self.task = self.task_factory()
+        self.last_status = None
+        self._started = False
+        self._failed = False
+        self._success = False
+        self._finished = False
+
+    def reattach(self, task):
+        """Replace the unstarted task by a task that was already started, e.g. by a previous run."""
+        self.task = task
+        self._started = True
 
     def failed(self):
         self._update_state()
@@ -59,16 +258,177 @@ class Job(object):
     def __repr__(self):
         return 'Job({}, {}, {})'.format(self.task, self.jid, self.dependencies)
 
+
+class _FairQueue(object):
+    """
+    Ready jobs, split into groups that share the concurrency slots by weighted fair queueing.
+
+    Each group keeps a virtual time that advances by 1 / weight every time one of its jobs
+    is handed out, and the next job comes from the non-empty group with the smallest virtual time.
+    Over time, a group with weight 2 gets twice as many jobs started as a group with weight 1,
+    and a group with many queued jobs cannot starve the others.
+    Within a group, jobs with a higher priority come first, then jobs that became ready first.
+    """
+
+    def __init__(self, group_weights=None):
+        """
+        Args:
+            group_weights (Optional[Dict[Hashable, float]]):  Weight of each group, defaults to 1.
+        """
+        self.group_weights = dict() if group_weights is None else group_weights
+        self._queues = dict()
+        self._virtual_times = dict()
+        self._virtual_time = 0.0
+        self._counter = itertools.count()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _weight(self, group):
+        weight = self.group_weights.get(group, 1.0)
+        if weight <= 0:
+            raise TaskSchedulerError('Group {} has a non-positive weight {}.'.format(group, weight))
+        return weight
+
+    def push(self, job):
+        queue = self._queues.get(job.group, None)
+        if queue is None:
+            queue = self._queues[job.group] = []
+            # A group that was idle does not get credit for the time it was idle.
+            self._virtual_times[job.group] = max(self._virtual_times.get(job.group, 0.0), self._virtual_time)
+        heapq.heappush(queue, (-job.priority, next(self._counter), job))
+        self._size += 1
+
+    def pop(self):
+        """Return the next job, or None if the queue is empty."""
+        if self._size == 0:
+            return None
+        group = min(self._queues, key=lambda g: self._virtual_times[g])
+        queue = self._queues[group]
+        _, _, job = heapq.heappop(queue)
+        if len(queue) == 0:
+            del self._queues[group]
+        self._virtual_time = self._virtual_times[group]
+        self._virtual_times[group] += 1.0 / self._weight(group)
+        self._size -= 1
+        return job
+
+
+class _DependencyTracker(object):
+    """
+    Keeps track of how many unfinished dependencies each unfinished job has.
+    A job becomes ready once all of its dependencies have completed sucessfully.
+    When a job fails, every job that depends on it (directly or transitively) is marked as failed.
+    Each job and each dependency edge is visited a constant number of times.
+    """
+
+    def __init__(self, jobs, group_weights=None, metrics=None):
+        """
+        Args:
+            jobs (Dict[Hashable, Job]):  All jobs, including finished jobs.
+                Every dependency must refer to a key of jobs.
+            group_weights (Optional[Dict[Hashable, float]]):  See _FairQueue.
+            metrics (Optional[SchedulerMetrics]):  Notified when jobs become ready.
+        """
+        self.jobs = jobs
+        self.metrics = metrics
+        self.dependents = collections.defaultdict(list)
+        self.ready = _FairQueue(group_weights)
+        self._remaining = dict()
+        self._retries = []
+        self._retry_counter = itertools.count()
+
+        failed = []
+        for jid, job in jobs.items():
+            for dep_jid in job.dependencies:
+                self.dependents[dep_jid].append(jid)
+            if job._finished:
+                if job._failed:
+                    failed.append(jid)
+                continue
+            if job._started:
+                # Already running, it will be reported through job_finished.
+                continue
+            self._remaining[jid] = sum(1 for dep_jid in job.dependencies if not jobs[dep_jid]._finished)
+
+        for jid in failed:
+            self._fail_dependents(jid)
+        for jid, remaining in self._remaining.items():
+            if remaining == 0:
+                self._push_ready(jobs[jid])
+
+    def _push_ready(self, job):
+        self.ready.push(job)
+        if self.metrics is not None:
+            self.metrics.job_enqueued(job)
+
+    def __len__(self):
+        """The number of jobs that have not been handed out yet."""
+        return len(self._remaining)
+
+    def pop_ready(self):
+        """Return the next job whose dependencies have all completed, or None."""
+        job = self.ready.pop()
+        if job is not None:
+            del self._remaining[job.jid]
+        return job
+
+    def retry_later(self, job, ready_at):
+        """Queue a restarted job, it becomes ready again once the clock reaches ready_at."""
+        self._remaining[job.jid] = 0
+        heapq.heappush(self._retries, (ready_at, next(self._retry_counter), job))
+
+    def release_retries(self, now):
+        """Move the jobs whose retry delay has passed to the ready queue."""
+        while len(self._retries) > 0 and self._retries[0][0] <= now:
+            _, _, job = heapq.heappop(self._retries)
+            self._push_ready(job)
+
+    def next_retry_time(self):
+        """The time at which the next job waiting for a retry becomes ready, or None."""
+        return self._retries[0][0] if len(self._retries) > 0 else None
+
+    def job_finished(self, job):
+        """
+        Update the dependents of a finished job.
+        Returns:
+            (List[Job]):  The jobs marked as failed because job failed.
+        """
+        if job._failed:
+            return self._fail_dependents(job.jid)
+        for dep_jid in self.dependents.get(job.jid, []):
+            if dep_jid not in self._remaining:
+                continue
+            self._remaining[dep_jid] -= 1
+            if self._remaining[dep_jid] == 0:
+                self._push_ready(self.jobs[dep_jid])
+        return []
+
+    def _fail_dependents(self, jid):
+        skipped = []
+        stack = [jid]
+        while len(stack) > 0:
+            for dep_jid in self.dependents.get(stack.pop(), []):
+                if dep_jid not in self._remaining:
+                    continue
+                del self._remaining[dep_jid]
+                job = self.jobs[dep_jid]
+                job.mark_failed()
+                skipped.append(job)
+                stack.append(dep_jid)
+        return skipped
+
 # pylint: disable=E1601
 
 class TaskScheduler(object):
 
     @staticmethod
-    def wait_for_existing_tasks(sleep_time=120.0, verbose=0):
+    def wait_for_existing_tasks(sleep_time=120.0, verbose=0, min_sleep_time=None):
         """
         Block until all tasks have finished in the currently
         authenticated GEE account.  This involves looking up the
-        task list from GEE.
+        task list from GEE once per polling cycle.
         """
         def task_is_queued(task):
             status = task.config.get('state', None)
@@ -76,44 +436,96 @@ class TaskScheduler(object):
             return status in queued_states
 
         task_list = [
-            Job(task=task, jid=i, dependencies=[])
+            Job(task=task, jid=i, dependencies=[], started=True)
             for i, task in enumerate(ee.batch.Task.list())
             if task_is_queued(task)
         ]
-        TaskScheduler._wait_all_tasks(task_list, sleep_time=sleep_time, verbose=verbose)
+        TaskScheduler._wait_all_tasks(task_list, sleep_time=sleep_time, verbose=verbose,
+                                      status_fn=batch_task_status, min_sleep_time=min_sleep_time)
+
+    @staticmethod
+    def _poll_jobs(jobs, status_fn=None, metrics=None, clock=time.time):
+        """
+        Refresh the state of all unfinished jobs.
+        If status_fn is provided, all jobs are looked up with a single call to status_fn,
+        otherwise task.status() is called once per job.
+        """
+        jobs = [job for job in jobs if job._started and not job._finished]
+        if len(jobs) == 0:
+            return
+        start = clock()
+        if status_fn is None:
+            for job in jobs:
+                job._update_state()
+            num_lookups = len(jobs)
+        else:
+            statuses = status_fn([job.task for job in jobs])
+            for job, status in zip(jobs, statuses):
+                job._update_state(status)
+            num_lookups = 1
+        if metrics is not None:
+            metrics.poll(len(jobs), num_lookups, clock() - start)
+            for job in jobs:
+                metrics.observe(job)
 
     @staticmethod
-    def _wait_all_tasks(jobs, sleep_time=120.0, verbose=0):
+    def _wait_all_tasks(jobs, sleep_time=120.0, verbose=0, status_fn=None, min_sleep_time=None):
         # TODO - Potential infinite loop for unstarted jobs
         jobs = list(jobs)
-        while len(jobs) > 0:
-            job = jobs.pop()
-            if job.queued():
-                jobs.append(job)
-                if verbose > 0:
-                    print('Tasks remaining: {}'.format(len(jobs)))
-                time.sleep(sleep_time)   # TODO, find a better way to do this.
+        sleep_times = _backoff_sleep_times(sleep_time, min_sleep_time)
+        while True:
+            TaskScheduler._poll_jobs(jobs, status_fn)
+            remaining = [job for job in jobs if not job._finished]
+            if len(remaining) == 0:
+                return
+            if len(remaining) < len(jobs):
+                sleep_times = _backoff_sleep_times(sleep_time, min_sleep_time)
+            jobs = remaining
+            if verbose > 0:
+                print('Tasks remaining: {}'.format(len(jobs)))
+            time.sleep(next(sleep_times))
 
     @staticmethod
-    def _wait_any_tasks(jobs, sleep_time=120.0):
+    def _wait_any_tasks(jobs, sleep_time=120.0, status_fn=None, min_sleep_time=None, wake_fn=None,
+                        metrics=None, clock=time.time, sleep=time.sleep):
+        """
+        Block until at least one job has finished.
+        Polls every sleep_time seconds, or with a backoff from
+        min_sleep_time up to sleep_time if min_sleep_time is provided.
+
+        Args:
+            wake_fn (Optional[Callable[[], bool]]):  Called once after every poll,
+                return early if it returns True even if no job has finished.
+            metrics (Optional[SchedulerMetrics]):  Records every poll.
+            clock (Callable[[], float]):  Returns the current time in seconds.
+            sleep (Callable[[float], None]):  Waits for a number of seconds.
+        Returns:
+            (Tuple[List[Job], List[Job]]):  The running and the finished jobs.
+        """
         # TODO - Potential infinite loop for unstarted jobs
         if len(jobs) == 0:
             return [], []
+        sleep_times = _backoff_sleep_times(sleep_time, min_sleep_time)
         while True:
+            TaskScheduler._poll_jobs(jobs, status_fn, metrics, clock)
             finished_tasks = []
             running_tasks = []
             for job in jobs:
-                if job.queued():
-                    running_tasks.append(job)
-                else:
+                if job._finished:
                     finished_tasks.append(job)
-            if len(finished_tasks) > 0:
+                else:
+                    running_tasks.append(job)
+            woken = wake_fn is not None and wake_fn()
+            if len(finished_tasks) > 0 or woken:
                 return running_tasks, finished_tasks
 
-            time.sleep(sleep_time)   # TODO, find a better way to do this.
+            sleep(next(sleep_times))
 
     def __init__(self):
         self.tasks = dict()
+        self.group_weights = dict()
+        # Maps a jid to the jids of the jobs that depend on it, used to reject cycles in add_task.
+        self._dependents = collections.defaultdict(set)
 
     def __len__(self):
         return len(self.tasks)
@@ -127,18 +539,96 @@ class TaskScheduler(object):
         for job in self.tasks.values():
             yield job.task
 
-    def add_task(self, task, jid, dependencies=None):
+    def add_task(self, task, jid, dependencies=None, priority=0, group=None,
+                 retry_policy=None, task_factory=None):
         """
         Add a new task to the Task Scheduler.
+        Raises a TaskSchedulerError if the task would create a circular dependency.
         :param task: Task from ee.batch.Export
         :param jid: immutable type to be used as a job id
         :param dependencies: Any iterable containing job ids of tasks that should be completed before task is started.
+            Dependencies may be added after the task that depends on them.
+        :param priority: Among the ready tasks of the same group, tasks with a higher priority are started first.
+        :param group: immutable type, e.g. an ExportManager tag.  Groups share the concurrency slots
+            according to their weight, see set_group_weight.
+        :param retry_policy: A RetryPolicy.  If provided, tasks that fail with a retryable error are
+            replaced by a new task from task_factory and started again after a backoff delay.
+        :param task_factory: A function with no arguments returning a new, unstarted task equivalent to task,
+            e.g. lambda: ee.batch.Export.image.toAsset(**export_kwargs).  Required with retry_policy since
+            an ee.batch.Task cannot be started twice.  If task is None, the first task is created with task_factory.
         """
         if jid in self.tasks:
             raise TaskSchedulerError('jid already exists.')
+        if retry_policy is not None and task_factory is None:
+            raise TaskSchedulerError('A task_factory is required to retry job {}.'.format(jid))
+        if task is None:
+            if task_factory is None:
+                raise TaskSchedulerError('Either task or task_factory must be provided for job {}.'.format(jid))
+            task = task_factory()
         if dependencies is None:
             dependencies = set()
-        self.tasks[jid] = Job(task, jid, set(dependencies))
+        dependencies = set(dependencies)
+        if jid in dependencies:
+            raise TaskSchedulerError('Job {} depends on itself.'.format(jid))
+        if jid in self._dependents:
+            # Jobs that were already added depend on jid, so the new job may close a cycle.
+            self._check_no_path(dependencies, jid)
+        self.tasks[jid] = Job(task, jid, dependencies, priority=priority, group=group,
+                              retry_policy=retry_policy, task_factory=task_factory)
+        for dep_jid in dependencies:
+            self._dependents[dep_jid].add(jid)
+
+    def set_group_weight(self, group, weight):
+        """
+        Set the share of concurrency slots of a group of tasks (see add_task).
+        Ready tasks are started by weighted fair queueing, so while several groups have
+        tasks waiting, a group with weight 2 gets twice as many tasks started as a group with weight 1.
+        Groups default to a weight of 1.
+        """
+        if weight <= 0:
+            raise TaskSchedulerError('Group weights must be positive, got {}.'.format(weight))
+        self.group_weights[group] = weight
+
+    def _check_no_path(self, start_jids, jid):
+        """Raise a TaskSchedulerError if jid is reachable by following dependencies from start_jids."""
+        stack = list(start_jids)
+        seen = set()
+        while len(stack) > 0:
+            dep_jid = stack.pop()
+            if dep_jid == jid:
+                raise TaskSchedulerError('Adding job {} would create a circular dependency.'.format(jid))
+            if dep_jid in seen or dep_jid not in self.tasks:
+                continue
+            seen.add(dep_jid)
+            stack.extend(self.tasks[dep_jid].dependencies)
+
+    def _validate(self):
+        """
+        Check that every dependency exists and that there are no circular dependencies.
+        Uses Kahn's algorithm, so it is linear in the number of jobs and dependencies.
+        """
+        dependents = collections.defaultdict(list)
+        in_degree = dict()
+        for jid, job in self.tasks.items():
+            for dep_jid in job.dependencies:
+                if dep_jid not in self.tasks:
+                    raise TaskSchedulerError('Job {} depends on unknown job {}.'.format(jid, dep_jid))
+                dependents[dep_jid].append(jid)
+            in_degree[jid] = len(job.dependencies)
+
+        queue = collections.deque(jid for jid, degree in in_degree.items() if degree == 0)
+        visited = 0
+        while len(queue) > 0:
+            jid = queue.popleft()
+            visited += 1
+            for dep_jid in dependents[jid]:
+                in_degree[dep_jid] -= 1
+                if in_degree[dep_jid] == 0:
+                    queue.append(dep_jid)
+
+        if visited < len(self.tasks):
+            cycle_jids = [jid for jid, degree in in_degree.items() if degree > 0]
+            raise TaskSchedulerError('Circular dependency between jobs: {}'.format(cycle_jids))
 
     def mark_all_completed(self):
         for jid in list(self.tasks.keys()):
@@ -154,13 +644,98 @@ class TaskScheduler(object):
         Note that this is a shallow copy.  Marking a job as completed in one task scheduler will
         mark it as completed in the combined task scheduler.
         """
-        new_scheduler = TaskScheduler()
+        new_scheduler = type(self)()
+        new_scheduler.group_weights.update(self.group_weights)
+        new_scheduler.group_weights.update(task_scheduler.group_weights)
         for jid, job in itertools.chain(self.tasks.items(), task_scheduler.tasks.items()):
             if jid in new_scheduler.tasks:
                 raise TaskSchedulerError('Duplicate jid "{}" during merge.'.format(jid))
             new_scheduler.tasks[jid] = job
+            for dep_jid in job.dependencies:
+                new_scheduler._dependents[dep_jid].add(jid)
         return new_scheduler
 
+    def resume(self, journal, task_lookup=None):
+        """
+        Restore the state of jobs recorded in a journal written by a previous run, e.g. after
+        the driver process died.  Must be called after all tasks have been added and before run.
+
+        Jobs recorded as completed are marked as completed.  Jobs that were started but did not
+        finish are re-attached to their GEE task by ID instead of being exported again.
+        Failed and skipped jobs will be run again.
+
+        Args:
+            journal (TaskJournal):  The journal passed to a previous call to run.
+            task_lookup (Optional[Callable[[List[str]], Dict[str, ee.batch.Task]]]):  Maps task ids to
+                started tasks.  Defaults to a single ee.batch.Task.list call.
+        """
+        if task_lookup is None:
+            task_lookup = _list_tasks_by_id
+
+        entries = journal.load()
+        in_flight = dict()
+        num_completed = 0
+        for jid, entry in entries.items():
+            job = self.tasks.get(jid, None)
+            if job is None:
+                continue
+            if entry.state == task_journal.COMPLETED:
+                job.mark_completed()
+                num_completed += 1
+            elif entry.in_flight():
+                in_flight[entry.task_id] = job
+
+        tasks = task_lookup(list(in_flight.keys())) if len(in_flight) > 0 else {}
+        for task_id, job in in_flight.items():
+            task = tasks.get(task_id, None)
+            if task is None:
+                logger.warning('Could not find task {} of job {}.  It will be run again.'.format(task_id, job.jid))
+                continue
+            job.reattach(task)
+        logger.info('Resumed {} completed and {} running jobs.'.format(
+            num_completed, sum(1 for job in in_flight.values() if job._started)
+        ))
+
+    def _job_started(self, job, verbose=0, journal=None, metrics=None):
+        if verbose > 0:
+            print('Running task: {}'.format(job.jid))
+        if journal is not None:
+            journal.record_started(job.jid, getattr(job.task, 'id', None))
+        if metrics is not None:
+            metrics.job_started(job)
+
+    def _job_finished(self, job, tracker, verbose=0, error_on_fail=False, journal=None, metrics=None,
+                      clock=time.time):
+        """Record a finished job and update its dependents, or queue it again if it can be retried."""
+        if job.can_retry():
+            delay = job.retry_policy.delay(job.attempts)
+            if verbose > 2:
+                print('Job {} failed ({}), retrying in {:.0f} seconds'.format(
+                    job.jid, job.last_status.get('error_message', None), delay
+                ))
+            if metrics is not None:
+                metrics.job_finished(job, scheduler_metrics.RETRY)
+            job.restart()
+            tracker.retry_later(job, clock() + delay)
+            return
+        state = task_journal.FAILED if job._failed else task_journal.COMPLETED
+        if verbose > 2:
+            print('Job {} {}'.format(job.jid, 'failed' if job._failed else 'sucessful'))
+        if journal is not None:
+            journal.record_finished(job.jid, state)
+        if metrics is not None:
+            metrics.job_finished(job, state)
+        if error_on_fail and job._failed:
+            raise TaskSchedulerError('Job {} failed'.format(job.jid))
+        skipped = tracker.job_finished(job)
+        for skipped_job in skipped:
+            if verbose > 2:
+                print('Job {} skipped since a dependency failed'.format(skipped_job.jid))
+            if journal is not None:
+                journal.record_finished(skipped_job.jid, task_journal.SKIPPED)
+            if metrics is not None:
+                metrics.job_finished(skipped_job, scheduler_metrics.SKIPPED)
+
     def start_and_remove_all(self):
         """
         Starts all tasks in the scheduler
@@ -172,6 +747,7 @@ class TaskScheduler(object):
             job.start()
         tasks = [job.task for job in self.tasks.values()]
         self.tasks = dict()
+        self._dependents = collections.defaultdict(set)
         return tasks
 
     def cancel_all(self):
@@ -186,86 +762,104 @@ class TaskScheduler(object):
                 pass
 
     def run(self, max_processes=8, sleep_time=120.0, verbose=0,
-            error_on_fail=False):
+            error_on_fail=False, status_fn=None, min_sleep_time=None, journal=None,
+            metrics=None, clock=time.time, sleep=time.sleep):
         """
         Run all tasks in order of dependency.
         Blocks until all tasks have finished.
 
         Will run max_processes tasks at a time.
-        If a task fails, its dependents will not be run.
-
-        TODO:  Detect dependency loops.
-        Currently dependency loops will be detected after some tasks may have already been run.
+        If a task fails, its dependents will not be run, unless the task was added
+        with a retry_policy and the failure is retryable.
+        Circular dependencies are detected before any task is started.
+        Slots are shared between groups of tasks by weighted fair queueing, see add_task and set_group_weight.
 
         Args:
-            max_processes (int):  The maximum number of tasks that are allowed to run simultaneously.
-                Defaults to 8.  8 is a good choice for most applications since it allows the next set of tasks
-                to begin immediately after the first batch of 4 ends.
+            max_processes (Union[int, ConcurrencyController]):  The maximum number of tasks that are allowed
+                to run simultaneously.  Defaults to 8.  8 is a good choice for most applications since it allows
+                the next set of tasks to begin immediately after the first batch of 4 ends.
+                Pass an AIMDConcurrency controller to adapt the limit to how many tasks GEE actually runs at a time.
             sleep_time (float):  The time to wait between checking if a task has finished, in seconds.
+                If min_sleep_time is provided, this is the maximum time to wait between checks.
             verbose (int):  An integer affecting verbosity.  Uses print.
                 > 0  to alter on starting tasks
                 > 2  to alter on job finished
                 > 6 for details
-                > 9 for a dump of info on if a circular dependency is detected.
             error_on_fail (bool): raises an error if any task fails.
+            status_fn (Optional[Callable[[List[ee.batch.Task]], List[Dict[str, Any]]]]):  If provided, the states
+                of all running tasks are looked up with one call to status_fn per polling cycle instead of
+                one task.status() call per task.  Use batch_task_status for ee.batch.Task objects.
+            min_sleep_time (Optional[float]):  If provided, the time between checks starts at min_sleep_time
+                after every change and doubles while nothing finishes, up to sleep_time.  This allows
+                freed slots to be refilled quickly without polling GEE more often when tasks are long.
+            journal (Optional[TaskJournal]):  If provided, job ids, task ids, dependencies and terminal
+                states are appended to the journal.  Pass the same journal to resume after a crash.
+            metrics (Optional[SchedulerMetrics]):  If provided, records job timestamps, queue depth,
+                slot utilization and status lookups.
+            clock (Callable[[], float]):  Returns the current time in seconds.  Defaults to time.time.
+            sleep (Callable[[float], None]):  Waits for a number of seconds.  Defaults to time.sleep.
+                Together with clock, allows running the scheduler on a virtual clock, see simulation.py.
         """
         if len(self.tasks) == 0:
             raise TaskSchedulerError('Tried to run tasks with no tasks')
+        self._validate()
+        if journal is not None:
+            journal.record_jobs(self.tasks.values())
+        if not isinstance(max_processes, ConcurrencyController):
+            max_processes = FixedConcurrency(max_processes)
+        if metrics is not None:
+            metrics.run_started(max_processes.limit)
+            try:
+                return self._run(max_processes, sleep_time, verbose, error_on_fail,
+                                 status_fn, min_sleep_time, journal, metrics, clock, sleep)
+            finally:
+                metrics.run_finished()
+        return self._run(max_processes, sleep_time, verbose, error_on_fail,
+                         status_fn, min_sleep_time, journal, metrics, clock, sleep)
+
+    def _run(self, concurrency, sleep_time, verbose, error_on_fail,
+             status_fn, min_sleep_time, journal, metrics, clock, sleep):
+        tracker = _DependencyTracker(self.tasks, self.group_weights, metrics)
+        running = [job for job in self.tasks.values() if job._started and not job._finished]
 
-        jid_order = [jid for jid, job in self.tasks.items() if job.queued()]
-        running = []
-
-        def job_run(jid):
-            """Return True if the job started or was marked as failed"""
-            if len(running) >= max_processes:
-                return False
-            job = self.tasks[jid]
-
-            for dep_jid in job.dependencies:
-                dep_job = self.tasks[dep_jid]
-                if dep_job.finished():
-                    if dep_job.failed():
-                        job.mark_failed()
-                        return True
-                else:
-                    return False
-
-            job.start()
-            running.append(job)
-            if verbose > 0:
-                print('Running task: {}'.format(job.jid))
-            return True
+        while True:
+            tracker.release_retries(clock())
+            while len(running) < concurrency.limit:
+                job = tracker.pop_ready()
+                if job is None:
+                    break
+                job.start()
+                running.append(job)
+                self._job_started(job, verbose=verbose, journal=journal, metrics=metrics)
+            if metrics is not None:
+                metrics.sample(len(tracker.ready), len(running), concurrency.limit)
+
+            next_retry_time = tracker.next_retry_time()
+            if len(running) == 0:
+                if next_retry_time is None:
+                    break
+                sleep(max(next_retry_time - clock(), 0.0))
+                continue
+
+            def wake_fn():
+                # Wake up early if more slots become available or a job waiting for a retry becomes ready.
+                if concurrency.update(running, len(tracker.ready)) and len(tracker.ready) > 0:
+                    return True
+                return (next_retry_time is not None and len(running) < concurrency.limit and
+                        clock() >= next_retry_time)
 
-        def wait_tasks_helper():
             if verbose > 6:
                 print('Waiting for a task to finish')
-            _running, finished = TaskScheduler._wait_any_tasks(running, sleep_time=sleep_time)
+            running, finished = TaskScheduler._wait_any_tasks(
+                running, sleep_time=sleep_time, status_fn=status_fn, min_sleep_time=min_sleep_time,
+                wake_fn=wake_fn, metrics=metrics, clock=clock, sleep=sleep
+            )
             for job in finished:
-                if verbose > 2:
-                    print('Job {} {}'.format(job.jid, 'failed' if job.failed() else 'sucessful'))
-                if error_on_fail and job.failed():
-                    raise TaskSchedulerError('Job {} failed'.format(job.jid))
-            return _running
-
-        while len(jid_order) > 0:
-            old_size = len(jid_order)
-            old_running_size = len(running)
-            jid_order = [jid for jid in jid_order if not job_run(jid)]
-            if len(jid_order) >= old_size and old_running_size >= len(running):
-                if len(running) == 0:
-                    err_msg = 'Possible circular dependency'
-                    if verbose > 9:
-                        finished_tasks = [job for jid, job in self.tasks.items() if job.finished()]
-                        remaining_tasks = [self.tasks[jid] for jid in jid_order]
-                        err_msg = '{}\nRunning tasks:\n{}\nFinished tasks:\n{}\nRemaining tasks:\n{}\nAll task ids:\n{}' \
-                                  .format(err_msg, running, finished_tasks, remaining_tasks, self.tasks.keys())
-                    raise TaskSchedulerError(err_msg)
-                running = wait_tasks_helper()
-
-        if verbose > 6:
-            print('All tasks have been started')
-
-        while len(running) > 0:
-            running = wait_tasks_helper()
+                self._job_finished(job, tracker, verbose=verbose, error_on_fail=error_on_fail,
+                                   journal=journal, metrics=metrics, clock=clock)
+
+        if len(tracker) > 0:
+            # This should be unreachable since the dependency graph was validated.
+            raise TaskSchedulerError('{} jobs could not be run'.format(len(tracker)))
 
         return [job.task for job in self.tasks.values()]
@@ -3,10 +3,13 @@ Author: Anthony Perez
 
 Utility functions for loading data.
 """
+import json
+import hashlib
 import datetime
 
 import ee
 
+from gee_tools import imgtools
 from gee_tools.exports import constants
 
 def check_empty_bands(scene):
@@ -19,10 +22,32 @@ def stack_feature_colls(feature_colls):
     """Return a feature collection with elements from all feature collections in the list feature_colls."""
     if len(feature_colls) == 0:
         raise ValueError("feature_colls was empty.")
-    output = feature_colls.pop(0)
-    for fc in feature_colls:
-        output = output.merge(fc)
-    return output
+    return imgtools.merge_collections(feature_colls)
+
+
+def _fingerprint_default(value):
+    if isinstance(value, ee.ComputedObject):
+        return {'ee': ee.serializer.encode(value, for_cloud_api=True)}
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, type) or callable(value):
+        return '{}.{}'.format(value.__module__, getattr(value, '__qualname__', value.__name__))
+    raise TypeError('Cannot fingerprint {!r}'.format(value))
+
+
+def fingerprint(*values):
+    """
+    A stable hash of values.  ee objects are hashed through their serialized expression graph,
+    so two objects have the same fingerprint if and only if they describe the same computation.
+    Args:
+        *values:  ee objects, JSON serializable values, dates, sets, classes or functions (by name).
+    Returns:
+        (str):  A SHA-256 hex digest.
+    """
+    encoded = json.dumps(list(values), sort_keys=True, separators=(',', ':'), default=_fingerprint_default)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
 
 
 def start_date_before_end(start_date, end_date):
@@ -86,6 +86,54 @@ def appendBand(current, previous):
     return accum
 
 
+def balanced_fold(items, combine):
+    """
+    Combine items pairwise into a balanced tree, i.e. combine(combine(a, b), combine(c, d)) rather than
+    combine(combine(combine(a, b), c), d), so that the depth of the resulting expression graph grows
+    with log2(len(items)) instead of len(items).  combine must be associative, the order of items is kept.
+
+    Args:
+        items (List[Any]):  Must not be empty.
+        combine (Callable[[Any, Any], Any]):
+    Returns:
+        (Any):
+    """
+    items = list(items)
+    if len(items) == 0:
+        raise ValueError("Cannot combine an empty list.")
+    while len(items) > 1:
+        paired = [combine(items[i], items[i + 1]) for i in range(0, len(items) - 1, 2)]
+        if len(items) % 2 == 1:
+            paired.append(items[-1])
+        items = paired
+    return items[0]
+
+
+def concat_bands(images):
+    """
+    The bands of all images, in order, with the properties of the first image.
+    Same result as images[0].addBands(images[1]).addBands(images[2])..., but see balanced_fold.
+
+    Args:
+        images (List[ee.Image]):
+    Returns:
+        (ee.Image):
+    """
+    return balanced_fold(images, lambda first, second: first.addBands(second))
+
+
+def merge_collections(collections):
+    """
+    The elements of all collections, in order, merged with a balanced tree of merge calls, see balanced_fold.
+
+    Args:
+        collections (List[Union[ee.ImageCollection, ee.FeatureCollection]]):
+    Returns:
+        (Union[ee.ImageCollection, ee.FeatureCollection]):
+    """
+    return balanced_fold(collections, lambda first, second: first.merge(second))
+
+
 def getScaledImage(img, scaler):
     """
     The "scaler" parameter is a ee.Dictionary with bands name and corresponding scaling factors.
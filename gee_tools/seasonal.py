@@ -266,7 +266,7 @@ def seasonMedians(imgcoll, bandnames, year, asimgcoll, addtexture, glcmvars):
         ]).filter(ee.Filter.neq('nbands', 0))
 
     else:
-        medcomp = renameBands(bim0, 'S1').addBands(renameBands(bim1, 'S2')).addBands(renameBands(bim2, 'S3'))\
+        medcomp = imgtools.concat_bands([renameBands(bim0, 'S1'), renameBands(bim1, 'S2'), renameBands(bim2, 'S3')])\
             .set('year', year)
 
         if addtexture:
@@ -0,0 +1,226 @@
+"""
+python -m tests.ai_io.test_ee_tf_exports
+
+Also a benchmark of the number of sampling operations EE runs for each sampling path, on a
+mocked ee module that evaluates collection operations eagerly.
+"""
+import os
+import types
+import shutil
+import tempfile
+import unittest
+import collections
+from unittest import mock
+
+from gee_tools.ai_io import ee_tf_exports
+from gee_tools.ai_io.tile_schema import BandSpec, TileSchema
+from gee_tools.exports import sharding
+from gee_tools.exports.sharding import SHARD_PROPERTY
+from tests.exports.test_task_scheduler import FakeTask
+from tests.fake_ee import FakeFeature, FakeCollection, fake_add_grid_cell, fake_ee as make_fake_ee
+
+
+class FakeImage(object):
+    """An image whose sampling calls are counted in ops."""
+
+    def __init__(self, ops, projections=None):
+        self.ops = ops
+        self.projections = collections.Counter() if projections is None else projections
+
+    def neighborhoodToArray(self, kernel):
+        return self
+
+    def reduceNeighborhood(self, reducer, kernel, **kwargs):
+        return self
+
+    def sample(self, region, **kwargs):
+        self.ops['sample'] += 1
+        self.projections[kwargs['projection']] += 1
+        return FakeCollection([FakeFeature({'B1': [region.coords[0]]})])
+
+    def sampleRegions(self, collection, properties=None, **kwargs):
+        self.ops['sampleRegions'] += 1
+        self.projections[kwargs['projection']] += 1
+        return FakeCollection(
+            FakeFeature(dict({p: f.properties[p] for p in properties or f.properties}, B1=[f.coords[0]]),
+                        f.coords)
+            for f in collection.features
+        )
+
+
+def fake_ee():
+    return make_fake_ee(
+        Kernel=types.SimpleNamespace(square=lambda radius, units: ('square', radius)),
+        Reducer=mock.MagicMock(),
+        Projection=lambda crs: ('projection', crs),
+    )
+
+
+def fake_add_utm_crs(fc):
+    return fc.map(lambda f: f.set(ee_tf_exports.UTM_PROPERTY, ee_tf_exports.utm_crs(*f.coords)))
+
+
+def points(num_points):
+    """Points on a 0.01 degree grid, 100 points per row.  Every third point has a label."""
+    return FakeCollection(
+        FakeFeature(dict({'id': i}, **({'label': i % 5} if i % 3 == 1 else {})), ((i % 100) * 0.01, (i // 100) * 0.01))
+        for i in range(num_points)
+    )
+
+
+class SamplePatchesUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        ee = fake_ee()
+        patches = [
+            mock.patch.object(ee_tf_exports, 'ee', ee),
+            mock.patch.object(sharding, 'ee', ee),
+            mock.patch.object(ee_tf_exports, 'add_grid_cell', fake_add_grid_cell),
+            mock.patch.object(ee_tf_exports, 'add_utm_crs', fake_add_utm_crs),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def sample(self, num_points, batched, cell_size=None, reduced=False):
+        ops = collections.Counter()
+        get_patches = ee_tf_exports.get_reduced_patches if reduced else ee_tf_exports.get_array_patches
+        samples = get_patches(FakeImage(ops), 30, 2, points(num_points), False, False, None, None, None, None, None,
+                              batched=batched, cell_size=cell_size)
+        return samples, ops
+
+    def assert_same_samples(self, samples, expected):
+        key = lambda f: f.properties['id']
+        self.assertEqual([(f.properties, f.coords) for f in sorted(samples.features, key=key)],
+                         [(f.properties, f.coords) for f in sorted(expected.features, key=key)])
+
+    def test_batched(self):
+        expected, ops = self.sample(250, batched=False)
+        self.assertEqual(ops, {'sample': 250})
+
+        samples, ops = self.sample(250, batched=True)
+        self.assertEqual(ops, {'sampleRegions': 1})
+        self.assert_same_samples(samples, expected)
+
+        # 100 columns of points 0.01 degrees apart, in 2 cells of 0.5 degrees.
+        samples, ops = self.sample(250, batched=True, cell_size=0.5, reduced=True)
+        self.assertEqual(ops, {'sampleRegions': 2})
+        self.assertNotIn(SHARD_PROPERTY, samples.features[0].properties)
+        self.assert_same_samples(samples, expected)
+        # Properties of some points only are kept, not only those of the first point.
+        self.assertEqual(sum('label' in f.properties for f in samples.features), 83)
+
+    def test_utm_crs(self):
+        self.assertEqual(ee_tf_exports.utm_crs(36.8, -1.3), 'EPSG:32737')
+        self.assertEqual(ee_tf_exports.utm_crs(-122.4, 37.8), 'EPSG:32610')
+        self.assertEqual(ee_tf_exports.utm_crs(180.0, 0.0), 'EPSG:32660')
+
+    def test_by_zone(self):
+        # Two points in zone 31N, one in zone 37S.
+        fc = FakeCollection([
+            FakeFeature({'id': 0}, (2.0, 1.0)), FakeFeature({'id': 1}, (38.0, -1.0)), FakeFeature({'id': 2}, (3.0, 2.0)),
+        ])
+        for batched, op in [(False, 'sample'), (True, 'sampleRegions')]:
+            ops, projections = collections.Counter(), collections.Counter()
+            samples = ee_tf_exports.get_array_patches_by_zone(FakeImage(ops, projections), 30, 2, fc, batched=batched)
+            self.assertEqual(sorted(f.properties['id'] for f in samples.features), [0, 1, 2])
+            self.assertEqual(projections, {('projection', 'EPSG:32631'): 2 if op == 'sample' else 1,
+                                           ('projection', 'EPSG:32737'): 1})
+            self.assertEqual(samples.features[0].properties[ee_tf_exports.UTM_PROPERTY], 'EPSG:32631')
+
+    def test_benchmark(self):
+        """100k points are sampled by a handful of sampleRegions calls instead of 100k sample calls."""
+        num_points = 100000
+        _, per_point = self.sample(num_points, batched=False)
+        _, batched = self.sample(num_points, batched=True, cell_size=1.0)
+        print('\n{} points: per point {}, batched {}'.format(num_points, dict(per_point), dict(batched)))
+        self.assertEqual(per_point, {'sample': num_points})
+        self.assertEqual(batched, {'sampleRegions': 10})
+
+class ExportTFRecordShardsUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.info = {
+            'first': {'B1': [[0.5, 1.0], [1.5, 2.0]], 'id': 7, 'name': 'a', 'LAT': 1.5,
+                      SHARD_PROPERTY: 'train_0', SHARD_PROPERTY + '_random': 0.1,
+                      sharding.SPLIT_PROPERTY: 'train', sharding.SPLIT_PROPERTY + '_random': 0.2},
+            'counts': {'train_0': 40, 'train_1': 38, 'val_0': 6, 'val_1': 4},
+        }
+        self.exports = []
+
+        def to_cloud_storage(**kwargs):
+            self.exports.append(kwargs)
+            return FakeTask(1)
+
+        patches = [
+            mock.patch.object(sharding, 'add_hash_bucket', side_effect=lambda fc, *args, **kwargs: fc),
+            mock.patch.object(sharding, 'add_split', side_effect=lambda fc, *args, **kwargs: fc),
+            mock.patch('ee.Feature'),
+            mock.patch('ee.Dictionary', side_effect=lambda d: types.SimpleNamespace(getInfo=lambda: self.info)),
+            mock.patch('ee.Filter.inList', side_effect=lambda name, values: (name, tuple(values))),
+            mock.patch('ee.batch.Export.table.toCloudStorage', side_effect=to_cloud_storage),
+            mock.patch('ee.batch.Export.table.toDrive', side_effect=to_cloud_storage),
+        ]
+        self.mocks = [patch.start() for patch in patches]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def test_splits(self):
+        samples = mock.MagicMock()
+        manifest_path = os.path.join(self.directory, 'manifest.json')
+        scheduler, shards, schema = ee_tf_exports.export_tfrecord_shards(
+            samples, 'tiles/run1_', 'id', 2, splits=[('train', 0.9), ('val', 0.1)], bucket='my-bucket',
+            manifest_path=manifest_path,
+        )
+        add_hash_bucket, add_split = self.mocks[:2]
+        self.assertEqual(add_hash_bucket.call_args[1], {'seed': 0, 'id_property': 'id'})
+        self.assertEqual(add_split.call_args[1], {'seed': 1, 'id_property': 'id'})
+
+        names = ['train-00000-of-00002', 'train-00001-of-00002', 'val-00000-of-00002', 'val-00001-of-00002']
+        self.assertEqual([shard.name for shard in shards], names)
+        self.assertEqual([shard.num_points for shard in shards], [40, 38, 6, 4])
+        self.assertEqual(sorted(scheduler.tasks), ['tfrecord_' + name for name in names])
+        self.assertFalse(any(job.task.started for job in scheduler.tasks.values()))
+
+        self.assertEqual(schema, {
+            'B1': {'dtype': 'float32', 'shape': [2, 2]}, 'id': {'dtype': 'int64', 'shape': []},
+            'name': {'dtype': 'string', 'shape': []}, 'LAT': {'dtype': 'float32', 'shape': []},
+        })
+        self.assertEqual(self.exports[2]['fileNamePrefix'], 'tiles/run1_val-00000-of-00002')
+        self.assertEqual(self.exports[2]['selectors'], ['B1', 'LAT', 'id', 'name'])
+        self.assertEqual(self.exports[2]['fileFormat'], 'TFRecord')
+
+        manifest, loaded = sharding.read_manifest(manifest_path)
+        self.assertEqual([shard.values for shard in loaded], [['train_0'], ['train_1'], ['val_0'], ['val_1']])
+        self.assertEqual(manifest['shards'][3]['output'], 'gs://my-bucket/tiles/run1_val-00001-of-00002')
+        self.assertEqual((manifest['schema'], manifest['splits']), (schema, [['train', 0.9], ['val', 0.1]]))
+
+    def test_tile_schema(self):
+        schema = TileSchema([BandSpec('RED', 'int16', 1e-4)], 1, properties={'id': 'int64'})
+        _, shards, parse_spec = ee_tf_exports.export_tfrecord_shards(
+            mock.MagicMock(), 'run1_', 'id', 2, count_records=False, tile_schema=schema,
+        )
+        # Neither the first sample nor the counts are requested.
+        self.mocks[3].assert_not_called()
+        self.assertEqual(parse_spec, schema.parse_spec())
+        self.assertEqual(self.exports[0]['selectors'], ['RED', 'id'])
+
+    def test_no_splits(self):
+        self.info = {'first': {'B1': [1.0], 'id': 1}}
+        scheduler, shards, schema = ee_tf_exports.export_tfrecord_shards(
+            mock.MagicMock(), 'run1_', 'id', 3, selectors=['B1'], count_records=False,
+        )
+        self.mocks[1].assert_not_called()
+        self.assertEqual([shard.values for shard in shards], [[0], [1], [2]])
+        self.assertEqual([shard.name for shard in shards][0], '00000-of-00003')
+        self.assertIsNone(shards[0].num_points)
+        self.assertEqual(schema, {'B1': {'dtype': 'float32', 'shape': [1]}})
+        self.assertEqual(self.exports[0]['fileNamePrefix'], 'run1_00000-of-00003')
+        with self.assertRaises(sharding.ShardingError):
+            ee_tf_exports.export_tfrecord_shards(mock.MagicMock(), 'run1_', 'id', 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
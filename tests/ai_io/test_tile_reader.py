@@ -0,0 +1,152 @@
+"""
+python -m tests.ai_io.test_tile_reader
+"""
+import io
+import os
+import csv
+import gzip
+import json
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from gee_tools.ai_io.tile_reader import (
+    TileReaderError, iter_tiles, read_tiles, count_records, parse_example, file_format, TFRECORD, CSV,
+)
+
+BANDS = ['B1', 'B2', 'LAT']
+RADIUS = 1
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def field(number, payload):
+    return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+
+def encode_example(features):
+    """Serialize a tf.train.Example of packed float, int64 and bytes lists."""
+    entries = b''
+    for name, values in features.items():
+        if isinstance(values, list) and isinstance(values[0], bytes):
+            feature = field(1, b''.join(field(1, v) for v in values))
+        elif np.asarray(values).dtype.kind == 'i':
+            feature = field(3, field(1, b''.join(varint(int(v) & (2 ** 64 - 1)) for v in values)))
+        else:
+            feature = field(2, field(1, np.asarray(values, dtype='<f4').tobytes()))
+        entries += field(1, field(1, name.encode('utf-8')) + field(2, feature))
+    return field(1, entries)
+
+
+def write_tfrecord(path, records):
+    opener = gzip.open if path.endswith('.gz') else io.open
+    with opener(path, 'wb') as f:
+        for record in records:
+            f.write(struct.pack('<Q', len(record)) + b'\0' * 4 + record + b'\0' * 4)
+
+
+def tile(index, band):
+    """The expected pixels of a band of the index-th tile."""
+    return np.arange(9, dtype=np.float32).reshape(3, 3) + 100 * index + band
+
+
+def tile_features(index):
+    features = {name: tile(index, j).ravel() for j, name in enumerate(BANDS)}
+    features['label'] = np.array([index, -1])
+    features['id'] = [str(index).encode('utf-8')]
+    return features
+
+
+class TileReaderUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def expected(self, indices):
+        return np.stack([np.stack([tile(i, j) for j in range(len(BANDS))]) for i in indices])
+
+    def write_files(self):
+        write_tfrecord(self.path('tiles-0.tfrecord.gz'), [encode_example(tile_features(i)) for i in range(5)])
+        write_tfrecord(self.path('tiles-1.tfrecord'), [encode_example(tile_features(i)) for i in range(5, 7)])
+        return self.path('tiles-*.tfrecord*')
+
+    def test_parse_example(self):
+        features = parse_example(encode_example(tile_features(3)))
+        np.testing.assert_array_equal(features['B2'], tile(3, 1).ravel())
+        np.testing.assert_array_equal(features['label'], [3, -1])
+        self.assertEqual(features['id'], [b'3'])
+        self.assertEqual(sorted(parse_example(encode_example(tile_features(3)), ['B1'])), ['B1'])
+
+    def test_batches(self):
+        pattern = self.write_files()
+        batches = list(iter_tiles(pattern, BANDS, RADIUS, batch_size=3))
+        # Batches span files.
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual(batches[0].shape, (3, 3, 3, 3))
+        self.assertEqual(batches[0].dtype, np.float32)
+        np.testing.assert_array_equal(np.concatenate(batches), self.expected(range(7)))
+        self.assertEqual(count_records(pattern), 7)
+
+    def test_parallel(self):
+        pattern = self.write_files()
+        tiles = read_tiles(pattern, ['LAT', 'B1'], RADIUS, batch_size=2, num_workers=2)
+        np.testing.assert_array_equal(tiles, self.expected(range(7))[:, [2, 0]])
+
+    def test_memmap(self):
+        pattern = self.write_files()
+        tiles = read_tiles(pattern, BANDS, RADIUS, memmap_path=self.path('tiles.npy'), batch_size=4)
+        self.assertIsInstance(tiles, np.memmap)
+        np.testing.assert_array_equal(np.load(self.path('tiles.npy')), self.expected(range(7)))
+
+    def test_csv(self):
+        with io.open(self.path('tiles.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['system:index'] + BANDS)
+            writer.writeheader()
+            for i in range(3):
+                row = {name: json.dumps(tile(i, j).tolist()) for j, name in enumerate(BANDS)}
+                row['system:index'] = str(i)
+                if i == 1:
+                    row['B2'] = ''
+                writer.writerow(row)
+        self.assertEqual(file_format(self.path('tiles.csv')), CSV)
+        tiles = read_tiles(self.path('tiles.csv'), BANDS, RADIUS, fill_value=np.nan)
+        expected = self.expected(range(3))
+        expected[1, 1] = np.nan
+        np.testing.assert_array_equal(tiles, expected)
+        with self.assertRaises(TileReaderError):
+            read_tiles(self.path('tiles.csv'), BANDS, RADIUS)
+
+    def test_errors(self):
+        pattern = self.write_files()
+        self.assertEqual(file_format('a/b.tfrecord.gz'), TFRECORD)
+        with self.assertRaises(TileReaderError):
+            read_tiles(pattern, BANDS, export_radius=2)
+        with self.assertRaises(TileReaderError):
+            file_format('tiles.json')
+        with self.assertRaises(TileReaderError):
+            read_tiles(self.path('missing-*'), BANDS, RADIUS)
+        with io.open(self.path('truncated.tfrecord'), 'wb') as f:
+            f.write(struct.pack('<Q', 100) + b'\0' * 20)
+        with self.assertRaises(TileReaderError):
+            read_tiles(self.path('truncated.tfrecord'), BANDS, RADIUS)
+
+
+if __name__ == '__main__':
+    unittest.main()
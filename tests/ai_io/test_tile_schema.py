@@ -0,0 +1,93 @@
+"""
+python -m tests.ai_io.test_tile_schema
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from gee_tools.ai_io import ee_tf_exports
+from gee_tools.ai_io.tile_reader import read_tiles
+from gee_tools.ai_io.tile_schema import BandSpec, TileSchema, TileSchemaError
+from tests.ai_io.test_tile_reader import encode_example, write_tfrecord
+from tests.exports.test_task_scheduler import FakeTask
+
+
+class FakeImage(object):
+    """Records the operations applied to an ee.Image."""
+
+    def __init__(self, ops=()):
+        self.ops = tuple(ops)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args: FakeImage(self.ops + ((name,) + args,))
+
+    def addBands(self, other):
+        return FakeImage(self.ops + (('addBands', other.ops),))
+
+
+SCHEMA = TileSchema(
+    [BandSpec('RED', 'int16', scale=1e-4), BandSpec('QA', 'uint8'), 'LAT'], export_radius=1,
+    properties={'id': 'int64'},
+)
+
+
+class TileSchemaUnitTest(unittest.TestCase):
+
+    def test_band_spec(self):
+        self.assertEqual(BandSpec('NDVI', 'int16', 1e-4, -1.0).dequantize(np.array([0, 10000, 20000])).tolist(),
+                         [-1.0, 0.0, 1.0])
+        with self.assertRaises(TileSchemaError):
+            BandSpec('RED', 'float64')
+        with self.assertRaises(TileSchemaError):
+            BandSpec('RED', 'int16', scale=0)
+        with self.assertRaises(TileSchemaError):
+            TileSchema(['RED', 'RED'], 1)
+
+    def test_cast(self):
+        cast = SCHEMA.cast(FakeImage())
+        red, (_, qa), (_, lat) = cast.ops[:-2], cast.ops[-2], cast.ops[-1]
+        self.assertEqual(red, (
+            ('select', ['RED']), ('subtract', 0.0), ('divide', 1e-4), ('round',), ('clamp', -32768, 32767),
+            ('toInt16',),
+        ))
+        self.assertEqual(qa, (('select', ['QA']), ('round',), ('clamp', 0, 255), ('toUint8',)))
+        self.assertEqual(lat, (('select', ['LAT']), ('toFloat',)))
+
+    def test_parse_spec(self):
+        spec = SCHEMA.parse_spec()
+        self.assertEqual(spec['RED'], {'dtype': 'int64', 'shape': [3, 3], 'scale': 1e-4, 'offset': 0.0})
+        self.assertEqual(spec['LAT']['dtype'], 'float32')
+        self.assertEqual(spec['id'], {'dtype': 'int64', 'shape': []})
+        self.assertEqual(SCHEMA.selectors, ['RED', 'QA', 'LAT', 'id'])
+        loaded = TileSchema.from_dict(SCHEMA.to_dict())
+        self.assertEqual(loaded.parse_spec(), spec)
+
+    def test_exports(self):
+        with mock.patch('ee.batch.Export.table.toCloudStorage', return_value=FakeTask(1)) as export, \
+                mock.patch('ee.List', side_effect=list):
+            ee_tf_exports.tfexporter(None, True, None, None, 'bucket', 'tiles/', 'run1', start=False, schema=SCHEMA)
+        self.assertEqual(export.call_args[1]['selectors'], ['RED', 'QA', 'LAT', 'id'])
+        self.assertFalse(export.return_value.started)
+
+    def test_read_quantized(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'tiles.tfrecord')
+        red = np.arange(9) * 100
+        write_tfrecord(path, [encode_example({
+            'RED': red, 'QA': np.full(9, 3), 'LAT': np.full(9, 1.5, dtype=np.float32), 'id': np.array([4]),
+        })])
+        tiles = read_tiles(path, SCHEMA.band_names, SCHEMA.export_radius, schema=SCHEMA)
+        np.testing.assert_allclose(tiles[0, 0], (red * 1e-4).reshape(3, 3), rtol=1e-6)
+        np.testing.assert_array_equal(tiles[0, 1:], [np.full((3, 3), 3.0), np.full((3, 3), 1.5)])
+        self.assertEqual(tiles.dtype, np.float32)
+
+
+if __name__ == '__main__':
+    unittest.main()
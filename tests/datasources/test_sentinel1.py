@@ -7,6 +7,7 @@ import ee
 
 from gee_tools.datasources import sentinel1
 from tests.test_utils import compare_bands
+from tests.datasources.test_sentinel2 import FakeCollection
 
 
 class Sentinel1TestCase(unittest.TestCase):
@@ -126,5 +127,32 @@ class Sentinel1TestCase(unittest.TestCase):
         compare_bands(self, testimg_s1glcm, expected_bands, {'msg': 'Sentinel 1 with speckle-correction and GLCM texture had the wrong bands'})
 
 
+class Sentinel1PushdownUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s1 = object.__new__(sentinel1.Sentinel1)
+        self.s1._correctlia, self.s1._addbands, self.s1._addspeckle = False, True, True
+        self.s1._addtexture, self.s1._orbit = False, 'ascending'
+        self.s1._filter_iw = lambda orbit, correctlia: FakeCollection(('iw',))
+        self.s1.RefinedLeeMulti = lambda steps, polbands=None: steps + (('speckle', tuple(polbands or ())),)
+        self.s1.addBands = lambda steps, sufx: steps + (('extras', sufx),)
+
+    def test_raw_bands(self):
+        self.assertEqual(self.s1.get_img_coll_bands(['VV', 'angle']).steps, ('iw', ('select', ('VV', 'angle'))))
+
+    def test_speckle_bands(self):
+        self.assertEqual(self.s1.get_img_coll_bands(['VH_RLSPCK']).steps,
+                         ('iw', ('speckle', ('VH',)), ('select', ('VH_RLSPCK',))))
+        # RATIO_RLSPCK is computed from both filtered polarizations.
+        self.assertEqual(self.s1.get_img_coll_bands(['RATIO_RLSPCK', 'DIFF']).steps,
+                         ('iw', ('speckle', ('VV', 'VH')), ('extras', ''), ('extras', '_RLSPCK'),
+                          ('select', ('RATIO_RLSPCK', 'DIFF'))))
+
+    def test_fallback(self):
+        self.s1.get_img_coll = lambda *args: FakeCollection(('full',))
+        self.assertEqual(self.s1.get_img_coll_bands(['VV_RLSPCK_contrast']).steps,
+                         ('full', ('select', ('VV_RLSPCK_contrast',))))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -94,5 +94,47 @@ class Sentinel2TestCase(unittest.TestCase):
         compare_bands(self, testimg_s2qa, expected_bands, {'msg': 'Sentinel 2 with VIs and cloud masks had the wrong bands'})
 
 
+class FakeCollection(object):
+    """Records the steps mapped over a collection as a tuple of names."""
+
+    def __init__(self, steps=()):
+        self.steps = tuple(steps)
+
+    def map(self, fn):
+        return FakeCollection(fn(self.steps))
+
+    def select(self, bands):
+        return FakeCollection(self.steps + (('select', tuple(bands)),))
+
+
+def recorder(name):
+    return lambda steps, *args: steps + (name,)
+
+
+class Sentinel2PushdownUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s2 = object.__new__(sentinel2.Sentinel2TOA)
+        self.s2.coll = FakeCollection()
+        self.s2._addVIs, self.s2._addCloudMasks, self.s2._corr_coeffs = True, True, None
+        for step in ['addAllQAMaps', 'refl_scale', 'addSWVIs', 'correctBands'] + \
+                [step for step, _ in sentinel2.Sentinel2TOA.REDEDGE_STEPS]:
+            setattr(self.s2, step, recorder(step))
+
+    def test_base_bands(self):
+        self.assertEqual(self.s2.get_img_coll_bands(['RED', 'NIR']).steps,
+                         ('refl_scale', ('select', ('RED', 'NIR'))))
+        self.assertEqual(self.s2.get_img_coll_bands(['RED'], addVIs=False).steps, (('select', ('RED',)),))
+
+    def test_derived_bands(self):
+        steps = self.s2.get_img_coll_bands(['DOY', 'MTCI', 'NBR1']).steps
+        self.assertEqual(steps, ('addAllQAMaps', 'refl_scale', 'addSWVIs', 'addMTCI',
+                                 ('select', ('DOY', 'MTCI', 'NBR1'))))
+
+    def test_all_bands(self):
+        bands = sentinel2.Sentinel2TOA.QA_MAP_BANDS + ['NDVI', 'REIP', 'MTCI', 'WDRVI', 'GCVI', 'CRC']
+        self.assertEqual(self.s2.get_img_coll_bands(bands).steps[:-1], self.s2.get_img_coll().steps)
+
+
 if __name__ == '__main__':
     unittest.main()
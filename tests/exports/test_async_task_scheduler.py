@@ -0,0 +1,144 @@
+"""
+python -m tests.exports.test_async_task_scheduler
+"""
+import asyncio
+import unittest
+import random
+
+from gee_tools.exports.async_task_scheduler import AsyncTaskScheduler
+from gee_tools.exports.task_scheduler import TaskSchedulerError, RetryPolicy
+from tests.exports.test_task_scheduler import FakeTask, FlakyTaskFactory, add_task
+
+
+class CountingTask(FakeTask):
+    """FakeTask that records how many CountingTasks sharing counter are running at once."""
+
+    def __init__(self, time_until_finished, counter, fail=False):
+        super(CountingTask, self).__init__(time_until_finished, fail=fail)
+        self.counter = counter
+        self.done = False
+
+    def start(self):
+        super(CountingTask, self).start()
+        self.counter['running'] += 1
+        self.counter['max_running'] = max(self.counter['max_running'], self.counter['running'])
+
+    def status(self):
+        status = super(CountingTask, self).status()
+        if not self.done and status['state'] in (self.State.COMPLETED, self.State.FAILED):
+            self.done = True
+            self.counter['running'] -= 1
+        return status
+
+
+class AsyncTaskSchedulerUnitTest(unittest.TestCase):
+
+    def test(self):
+        random.seed(0)
+        for _ in range(10):
+            scheduler = AsyncTaskScheduler()
+            for i in range(100):
+                add_task(scheduler, i, list(range(i)))
+            asyncio.run(scheduler.run_async(max_processes=8, sleep_time=0.0))
+            for job in scheduler.tasks.values():
+                self.assertTrue(job._finished)
+
+    def test_failure_propagation(self):
+        scheduler = AsyncTaskScheduler()
+        scheduler.add_task(FakeTask(2, fail=True), 'a')
+        scheduler.add_task(FakeTask(2), 'b', ['a'])
+        scheduler.add_task(FakeTask(2), 'c', ['b'])
+        scheduler.add_task(FakeTask(2), 'd')
+        asyncio.run(scheduler.run_async(sleep_time=0.0))
+        self.assertTrue(scheduler.tasks['a'].failed())
+        self.assertTrue(scheduler.tasks['c'].failed())
+        self.assertFalse(scheduler.tasks['b'].task.started)
+        self.assertFalse(scheduler.tasks['d'].failed())
+
+        scheduler = AsyncTaskScheduler()
+        scheduler.add_task(FakeTask(2, fail=True), 'a')
+        with self.assertRaises(TaskSchedulerError):
+            asyncio.run(scheduler.run_async(sleep_time=0.0, error_on_fail=True))
+
+    def test_retry(self):
+        scheduler = AsyncTaskScheduler()
+        flaky = FlakyTaskFactory(1)
+        scheduler.add_task(None, 'a', retry_policy=RetryPolicy(base_delay=0.0), task_factory=flaky)
+        scheduler.add_task(FakeTask(1), 'b', ['a'])
+        asyncio.run(scheduler.run_async(sleep_time=0.0, error_on_fail=True))
+        self.assertEqual(len(flaky.tasks), 2)
+        self.assertTrue(scheduler.tasks['b']._success)
+
+    def test_shared_semaphore(self):
+        counter = {'running': 0, 'max_running': 0}
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(5)
+            schedulers = []
+            for _ in range(3):
+                scheduler = AsyncTaskScheduler()
+                for i in range(20):
+                    scheduler.add_task(CountingTask(random.randint(1, 5), counter), i)
+                schedulers.append(scheduler)
+            await asyncio.gather(*[
+                scheduler.run_async(max_processes=4, sleep_time=0.0, semaphore=semaphore)
+                for scheduler in schedulers
+            ])
+            return schedulers
+
+        random.seed(0)
+        schedulers = asyncio.run(run_all())
+        self.assertEqual(counter['running'], 0)
+        self.assertEqual(counter['max_running'], 5)
+        for scheduler in schedulers:
+            for job in scheduler.tasks.values():
+                self.assertTrue(job.task.started)
+                self.assertTrue(job._finished)
+
+    def test_failing_start(self):
+        class BrokenTask(FakeTask):
+            def start(self):
+                raise RuntimeError('Quota exceeded.')
+
+        async def run(semaphore):
+            scheduler = AsyncTaskScheduler()
+            scheduler.add_task(FakeTask(1), 'a')
+            scheduler.add_task(BrokenTask(1), 'b')
+            with self.assertRaises(RuntimeError):
+                await scheduler.run_async(sleep_time=0.0, semaphore=semaphore)
+
+        semaphore = asyncio.Semaphore(2)
+        asyncio.run(run(semaphore))
+        # The slots acquired for both jobs are released.
+        self.assertEqual(semaphore._value, 2)
+
+    def test_reattached_over_cap(self):
+        async def run(semaphore):
+            scheduler = AsyncTaskScheduler()
+            for i in range(3):
+                task = FakeTask(1)
+                task.start()
+                scheduler.add_task(FakeTask(1), i)
+                scheduler.tasks[i].reattach(task)
+            scheduler.add_task(FakeTask(1), 'new')
+            await asyncio.wait_for(scheduler.run_async(sleep_time=0.0, semaphore=semaphore), 5.0)
+            return scheduler
+
+        semaphore = asyncio.Semaphore(1)
+        scheduler = asyncio.run(run(semaphore))
+        self.assertTrue(all(job._success for job in scheduler.tasks.values()))
+        self.assertEqual(semaphore._value, 1)
+
+    def test_circular_dependency(self):
+        first = AsyncTaskScheduler()
+        first.add_task(FakeTask(1), 'a', ['b'])
+        second = AsyncTaskScheduler()
+        second.add_task(FakeTask(1), 'b', ['a'])
+        scheduler = first.merge(second)
+        with self.assertRaises(TaskSchedulerError):
+            asyncio.run(scheduler.run_async(sleep_time=0.0))
+        self.assertFalse(scheduler.tasks['a'].task.started)
+
+
+if __name__ == '__main__':
+    unittest.main()
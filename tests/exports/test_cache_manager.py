@@ -0,0 +1,111 @@
+"""
+python -m tests.exports.test_cache_manager
+"""
+import unittest
+
+import ee
+
+from gee_tools.assetsmanager import LocalAssetAPI, get_assets
+from gee_tools.exports.cache_manager import (
+    CacheManager, CACHE_KEY_PROPERTY, CACHE_CREATED_PROPERTY, CACHE_LAST_USED_PROPERTY
+)
+from tests.exports.test_scheduler_metrics import FakeClock
+
+PREFIX = 'users/someone/cache'
+
+
+def add_cache_asset(api, name, size_bytes, created, last_used=None):
+    properties = {CACHE_KEY_PROPERTY: 'key_' + name, CACHE_CREATED_PROPERTY: created}
+    if last_used is not None:
+        properties[CACHE_LAST_USED_PROPERTY] = last_used
+    api.add_asset('{}/{}'.format(PREFIX, name), size_bytes=size_bytes, properties=properties)
+
+
+class LocalAssetAPIUnitTest(unittest.TestCase):
+
+    def test_local_api(self):
+        api = LocalAssetAPI()
+        api.add_asset('users/someone/a/x', size_bytes=10, properties={'p': 1})
+        api.add_asset('users/someone/a/sub/y')
+        self.assertEqual([(a['id'], a['type']) for a in api.list_assets('users/someone/a')], [
+            ('users/someone/a/sub', 'FOLDER'), ('users/someone/a/x', 'IMAGE')
+        ])
+        self.assertEqual(api.list_assets('users/missing'), [])
+
+        api.set_properties('users/someone/a/x', {'p': None, 'q': 2})
+        self.assertEqual(get_assets(['users/someone/a/x'], api=api)['users/someone/a/x']['properties'], {'q': 2})
+
+        api.delete_asset('users/someone/a/x')
+        with self.assertRaises(ee.EEException):
+            api.delete_asset('users/someone/a/x')
+        with self.assertRaises(ee.EEException):
+            api.set_properties('users/someone/a/x', {'p': 1})
+
+
+class CacheManagerUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = LocalAssetAPI()
+        self.clock = FakeClock()
+        self.clock.now = 1000.0
+        add_cache_asset(self.api, 'a', 100, created=10.0, last_used=500.0)
+        add_cache_asset(self.api, 'b', 200, created=20.0)
+        add_cache_asset(self.api, 'sub/c', 300, created=30.0, last_used=900.0)
+        # Not exported by the cache, never managed.
+        self.api.add_asset(PREFIX + '/other', size_bytes=10000)
+
+    def manager(self, **kwargs):
+        return CacheManager(PREFIX, api=self.api, clock=self.clock, **kwargs)
+
+    def remaining(self):
+        return sorted(self.api.assets.keys())
+
+    def test_entries(self):
+        entries = {entry.asset_id: entry for entry in self.manager().entries()}
+        self.assertEqual(sorted(entries), [PREFIX + '/a', PREFIX + '/b', PREFIX + '/sub/c'])
+        self.assertEqual(entries[PREFIX + '/b'].size_bytes, 200)
+        # Assets that were never used count as used when they were exported.
+        self.assertEqual(entries[PREFIX + '/b'].last_used, 20.0)
+        self.assertEqual(self.manager().usage(), (3, 600))
+
+    def test_lru_byte_budget(self):
+        evicted = self.manager(max_bytes=350).enforce_budget()
+        self.assertEqual([entry.asset_id for entry in evicted], [PREFIX + '/b', PREFIX + '/a'])
+        self.assertEqual(self.remaining(), [PREFIX + '/other', PREFIX + '/sub/c'])
+
+    def test_touch_and_count_budget(self):
+        manager = self.manager(max_count=2)
+        manager.touch([PREFIX + '/b'])
+        self.assertEqual(self.api.assets[PREFIX + '/b']['properties'][CACHE_LAST_USED_PROPERTY], 1000.0)
+        evicted = manager.enforce_budget(dry_run=True)
+        self.assertEqual([entry.asset_id for entry in evicted], [PREFIX + '/a'])
+        self.assertEqual(len(self.remaining()), 4)
+
+        evicted = manager.enforce_budget(protected=[PREFIX + '/a'])
+        self.assertEqual([entry.asset_id for entry in evicted], [PREFIX + '/sub/c'])
+        self.assertEqual(self.remaining(), [PREFIX + '/a', PREFIX + '/b', PREFIX + '/other'])
+
+    def test_protected_over_budget(self):
+        evicted = self.manager(max_count=0).enforce_budget(protected=[PREFIX + '/a', PREFIX + '/b', PREFIX + '/sub/c'])
+        self.assertEqual(evicted, [])
+        self.assertEqual(len(self.remaining()), 4)
+
+    def test_collect_garbage(self):
+        manager = self.manager()
+        orphans = manager.collect_garbage([PREFIX + '/a'], min_age=200.0)
+        # c was used recently and may belong to a concurrent run.
+        self.assertEqual([entry.asset_id for entry in orphans], [PREFIX + '/b'])
+        self.assertEqual(self.remaining(), [PREFIX + '/a', PREFIX + '/other', PREFIX + '/sub/c'])
+
+        orphans = manager.collect_garbage([], min_age=0.0)
+        self.assertEqual(sorted(entry.asset_id for entry in orphans), [PREFIX + '/a', PREFIX + '/sub/c'])
+        self.assertEqual(self.remaining(), [PREFIX + '/other'])
+
+    def test_export_properties(self):
+        self.assertEqual(self.manager().export_properties('k'), {
+            CACHE_KEY_PROPERTY: 'k', CACHE_CREATED_PROPERTY: 1000.0, CACHE_LAST_USED_PROPERTY: 1000.0
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+python -m tests.exports.test_concurrency
+"""
+import unittest
+
+import ee
+
+from gee_tools.exports.concurrency import AIMDConcurrency
+from gee_tools.exports.task_scheduler import TaskScheduler
+from tests.exports.test_scheduler_metrics import FakeClock
+
+
+class WorkerPoolBackend(object):
+    """
+    Simulates a GEE account that runs at most num_workers tasks at a time.
+    Submitted tasks wait READY in a FIFO queue until a worker is free.
+    The clock advances by one second per bulk status lookup.
+    """
+
+    def __init__(self, num_workers, clock):
+        self.num_workers = num_workers
+        self.clock = clock
+        self.queue = []
+        self.running = []
+        self.max_running = 0
+        self.max_queued = 0
+
+    def submit(self, task):
+        self.queue.append(task)
+
+    def tick(self):
+        self.clock.now += 1.0
+        for task in list(self.running):
+            task.remaining -= 1
+            if task.remaining <= 0:
+                task.state = ee.batch.Task.State.COMPLETED
+                self.running.remove(task)
+        while len(self.running) < self.num_workers and len(self.queue) > 0:
+            task = self.queue.pop(0)
+            task.state = ee.batch.Task.State.RUNNING
+            self.running.append(task)
+        self.max_running = max(self.max_running, len(self.running))
+        self.max_queued = max(self.max_queued, len(self.queue))
+
+    def __call__(self, tasks):
+        self.tick()
+        return [{'state': task.state} for task in tasks]
+
+
+class PooledTask(object):
+
+    def __init__(self, duration, backend):
+        self.id = None
+        self.remaining = duration
+        self.backend = backend
+        self.state = ee.batch.Task.State.UNSUBMITTED
+
+    def start(self):
+        self.state = ee.batch.Task.State.READY
+        self.backend.submit(self)
+
+    def status(self):
+        return {'state': self.state}
+
+    @property
+    def State(self):
+        return ee.batch.Task.State
+
+
+class AIMDConcurrencyUnitTest(unittest.TestCase):
+
+    def run_backend(self, num_workers, controller, clock, num_tasks=300, duration=10):
+        backend = WorkerPoolBackend(num_workers, clock)
+        scheduler = TaskScheduler()
+        for i in range(num_tasks):
+            scheduler.add_task(PooledTask(duration, backend), i)
+        scheduler.run(max_processes=controller, sleep_time=0.0, status_fn=backend)
+        for job in scheduler.tasks.values():
+            self.assertTrue(job._success)
+        return backend
+
+    def test_converges_to_worker_pool(self):
+        clock = FakeClock()
+        controller = AIMDConcurrency(min_processes=1, max_processes=64, initial=2, ready_threshold=5.0,
+                                     increase_interval=2.0, clock=clock)
+        backend = self.run_backend(8, controller, clock)
+
+        limits = [limit for _, limit in controller.history]
+        # The limit grows until the worker pool is saturated...
+        self.assertGreaterEqual(max(limits), 8)
+        self.assertEqual(backend.max_running, 8)
+        # ...then backs off instead of growing up to max_processes.
+        self.assertLess(max(limits), 20)
+        self.assertTrue(any(b < a for a, b in zip(limits, limits[1:])))
+        self.assertLess(backend.max_queued, 12)
+
+    def test_decrease(self):
+        clock = FakeClock()
+        controller = AIMDConcurrency(min_processes=2, max_processes=64, initial=32, ready_threshold=5.0,
+                                     increase_interval=2.0, clock=clock)
+        self.run_backend(4, controller, clock)
+        limits = [limit for _, limit in controller.history]
+        first_decrease = next(b for a, b in zip(limits, limits[1:]) if b < a)
+        self.assertLessEqual(first_decrease, 17)
+        self.assertLess(min(limits), 8)
+        self.assertGreaterEqual(min(limits), 2)
+
+    def test_fixed_limit(self):
+        clock = FakeClock()
+        backend = WorkerPoolBackend(4, clock)
+        scheduler = TaskScheduler()
+        for i in range(20):
+            scheduler.add_task(PooledTask(3, backend), i)
+        scheduler.run(max_processes=2, sleep_time=0.0, status_fn=backend)
+        self.assertEqual(backend.max_running, 2)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            AIMDConcurrency(min_processes=4, initial=2)
+        with self.assertRaises(ValueError):
+            AIMDConcurrency(decrease_factor=1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+python -m tests.exports.test_cost_estimate
+"""
+import unittest
+from unittest import mock
+
+from gee_tools.exports.cost_estimate import graph_stats, CostEstimate, DatasourceCost, tile_pixels, BYTES_PER_BAND
+from gee_tools.exports.export_manager import ExportManager, ExportManagerError
+from gee_tools.exports.image_spec import ImageSpec, clear_datasource_cache
+from tests.exports.test_image_spec import CountingDatasource, FakeImage, fake_geometry, first
+
+
+class FakeCollection(FakeImage):
+
+    def size(self):
+        return ('size', self.ops[0][1])
+
+
+class SizedDatasource(CountingDatasource):
+
+    def get_img_coll(self):
+        return FakeCollection([('coll', self.name)])
+
+
+class FakeDictionary(object):
+    """Stand-in for ee.Dictionary whose getInfo resolves the fake size() and area() results."""
+
+    SIZES = {'a': 12, 'b': 3}
+
+    def __init__(self, d):
+        self.d = d
+
+    def getInfo(self):
+        def resolve(value):
+            if isinstance(value, FakeDictionary):
+                return value.getInfo()
+            if isinstance(value, tuple) and value[0] == 'size':
+                return self.SIZES[value[1]]
+            return value
+        return {key: resolve(value) for key, value in self.d.items()}
+
+
+def invocation(name, **arguments):
+    return {'functionInvocationValue': {'functionName': name, 'arguments': arguments}}
+
+
+def fake_encode(obj, for_cloud_api=True):
+    """A serialized graph with one invocation per operation of a FakeImage, including added bands."""
+    def encode_ops(ops):
+        return [
+            invocation(op[0], srcImg=encode_ops(op[1])) if op[0] == 'addBands' else invocation(op[0])
+            for op in ops
+        ]
+    return {'result': '0', 'values': {'0': encode_ops(obj.ops)}}
+
+
+class GraphStatsUnitTest(unittest.TestCase):
+
+    def test_graph_stats(self):
+        encoded = {'result': '0', 'values': {
+            '0': invocation('Image.addBands', dstImg={'valueReference': '1'}, srcImg=invocation(
+                'Image.reproject', image={'valueReference': '1'}, scale={'constantValue': 30}
+            )),
+            '1': invocation('ImageCollection.median', collection=invocation('ImageCollection.load')),
+        }}
+        self.assertEqual(graph_stats(encoded), {
+            'Image.addBands': 1, 'Image.reproject': 1, 'ImageCollection.median': 1, 'ImageCollection.load': 1
+        })
+        self.assertEqual(graph_stats({'constantValue': 1}), {})
+
+    def test_cost_estimate(self):
+        estimate = CostEstimate(
+            [DatasourceCost('a', 2, 3, 100, 4), DatasourceCost('b', 20, 1, 50, 2)], 6, tile_pixels(10, 2), 500,
+            graph_stats(invocation('Image.load')), num_points=10, export_radius=2,
+        )
+        self.assertEqual(estimate.num_pixels, 250)
+        self.assertEqual(estimate.output_bytes, 250 * 6 * BYTES_PER_BAND)
+        self.assertEqual([ds.name for ds in estimate.cache_candidates()], ['b', 'a'])
+        summary = estimate.summary()
+        self.assertEqual((summary['num_images'], summary['num_invocations']), (22, 1))
+        self.assertEqual(summary['datasources'][0]['name'], 'a')
+
+
+class EstimateCostUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_datasource_cache()
+        self.addCleanup(clear_datasource_cache)
+        config = {
+            name: {'class': SizedDatasource, 'args': {'name': name}, 'composite_fn': first, 'bands': bands}
+            for name, bands in [('a', ['A1', 'A2']), ('b', ['B1'])]
+        }
+        self.export_manager = ExportManager(config)
+        self.region = fake_geometry()
+        self.region.area = lambda max_error: 9e6
+        patches = [
+            mock.patch('ee.Dictionary', FakeDictionary),
+            mock.patch('ee.serializer.encode', side_effect=fake_encode),
+            mock.patch.object(ImageSpec, '_add_latlon', staticmethod(lambda scene: scene)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def image_spec(self):
+        return {'start_date': '2018-01-01', 'end_date': '2019-01-01', 'filterpoly': self.region, 'scale': 30}
+
+    def test_scene(self):
+        estimate = self.export_manager.estimate_cost(self.image_spec())
+        self.assertEqual([(ds.name, ds.num_images, ds.num_bands) for ds in estimate.datasources],
+                         [('a', 12, 2), ('b', 3, 1)])
+        self.assertEqual(estimate.num_bands, 5)
+        self.assertEqual(estimate.num_pixels, 10000)
+        # coll and reproject per datasource, plus one addBands.
+        self.assertEqual(dict(estimate.functions), {'coll': 2, 'reproject': 2, 'addBands': 1})
+        self.assertEqual(estimate.datasources[0].num_invocations, 2)
+        self.assertGreater(estimate.request_bytes, estimate.datasources[0].request_bytes)
+        self.assertIsNone(estimate.num_points)
+
+    def test_missing_cache_asset(self):
+        # The cache asset of 'a' was never exported, the estimate reads what its cache export computes.
+        self.export_manager.datasources_config['a']['cache_asset_id'] = 'users/someone/cache/a'
+        with mock.patch('gee_tools.exports.export_manager.get_assets', return_value={}) as get_assets:
+            estimate = self.export_manager.estimate_cost(self.image_spec())
+        get_assets.assert_not_called()
+        self.assertEqual([(ds.name, ds.num_images) for ds in estimate.datasources], [('a', 12), ('b', 3)])
+        self.assertEqual(dict(estimate.functions), {'coll': 2, 'reproject': 2, 'addBands': 1})
+
+    def test_sample_tiles(self):
+        fc = mock.MagicMock()
+        fc.size.return_value = 40
+        with mock.patch('gee_tools.exports.export_manager.add_imagery',
+                        side_effect=lambda fc, image_spec, output_size: image_spec.get_scene()) as add_imagery:
+            estimate = self.export_manager.estimate_cost(self.image_spec(), fc=fc, export_radius=3)
+        self.assertEqual(add_imagery.call_args[1]['output_size'], 3)
+        self.assertEqual(estimate.num_pixels, 40 * 49)
+        self.assertEqual((estimate.num_points, estimate.export_radius), (40, 3))
+
+        with self.assertRaises(ExportManagerError):
+            self.export_manager.estimate_cost(self.image_spec(), fc=fc)
+
+
+if __name__ == '__main__':
+    unittest.main()
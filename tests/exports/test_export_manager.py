@@ -3,15 +3,26 @@ Author: Anthony Perez
 
 python -m tests.exports.test_export_manager
 """
+import os
+import shutil
+import hashlib
+import tempfile
 import unittest
 import itertools
+from unittest import mock
 
 import ee
 
 from gee_tools.datasources.optical_datasources import LandsatSR, MODISnbar
 from gee_tools.datasources.pop_and_urban_datasources import GHSLPop, CityAccessibility
-from gee_tools.exports.export_manager import ExportManager
-from gee_tools.exports.constants import EPSG3857
+from gee_tools.datasources.generic_datasources import GenericSingleImageDatasource
+from gee_tools.exports.export_manager import (
+    ExportManager, ExportManagerError, CACHE_KEY_PROPERTY, CACHE_KEY_LENGTH
+)
+from gee_tools.exports.task_scheduler import TaskScheduler, RetryPolicy
+from gee_tools.exports.constants import EPSG3857, UTM
+from gee_tools.exports import sharding
+from tests.exports.test_task_scheduler import FakeTask
 
 
 IN_MODIS_BANDS = [u'RED', u'NIR', u'BLUE', u'GREEN', u'SWIR1', u'SWIR2']
@@ -355,5 +366,259 @@ class ExportManagerTestCase(unittest.TestCase):
             self.assertFalse(band in props)
 
 
+class FakeScene(object):
+    """Stand-in for the ee.Image of an ImageSpec, identified by its datasources and dates."""
+
+    def __init__(self, key):
+        self.key = key
+        self.properties = {}
+
+    def clip(self, geometry):
+        return self
+
+    def set(self, properties):
+        self.properties.update(properties)
+        return self
+
+
+def fake_fingerprint(*values):
+    return hashlib.sha256(repr([getattr(v, 'key', v) for v in values]).encode('utf-8')).hexdigest()
+
+
+class FakeImageSpec(object):
+    """Stand-in for ImageSpec that records datasources without building ee objects."""
+
+    def __init__(self, start_date, end_date, filterpoly, scale, projection=EPSG3857):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.region = filterpoly
+        self.scale = scale
+        self.projection = projection
+        self.datasources = []
+        self.bands = []
+
+    def add_datasource(self, datasource_class, composite_function, ds_kwargs=None, bands=None):
+        self.datasources.append((datasource_class, ds_kwargs))
+        self.bands.append(bands)
+
+    def get_scene(self, add_latlon=True):
+        return FakeScene(repr((sorted(self.datasources[0][1].items()), self.start_date, self.end_date)))
+
+
+class ExportManagerCacheUnitTest(unittest.TestCase):
+    """Tests cache population without GEE, asset lookups and exports are mocked."""
+
+    def setUp(self):
+        self.config = {
+            name: {
+                "class": GenericSingleImageDatasource,
+                "args": {'image_args': name},
+                "composite_fn": None,
+                "bands": [name.upper()],
+                "cache_asset_id": 'users/someone/cache/{}'.format(name),
+            }
+            for name in ['a', 'b', 'c']
+        }
+        self.config['d'] = {
+            "class": GenericSingleImageDatasource,
+            "args": {},
+            "composite_fn": None,
+            "bands": ['D'],
+        }
+        self.image_spec_kwargs = {
+            'start_date': '2018-01-01', 'end_date': '2018-12-31', 'filterpoly': mock.MagicMock(), 'scale': 30
+        }
+        self.assets = {}
+        self.exported = []
+
+        def to_asset(**kwargs):
+            self.exported.append(kwargs)
+            return FakeTask(1)
+
+        patches = [
+            mock.patch('gee_tools.exports.export_manager.ImageSpec', FakeImageSpec),
+            mock.patch('gee_tools.exports.export_manager.fingerprint', fake_fingerprint),
+            mock.patch('gee_tools.exports.export_manager.get_assets',
+                       side_effect=lambda asset_ids: {i: self.assets[i] for i in asset_ids if i in self.assets}),
+            mock.patch('ee.batch.Export.image.toAsset', side_effect=to_asset),
+        ]
+        self.mocks = [patch.start() for patch in patches]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def image_spec(self, **kwargs):
+        return FakeImageSpec(**dict(self.image_spec_kwargs, **kwargs))
+
+    def cache_key(self, name, start_date='2018-01-01'):
+        scene = FakeImageSpec(start_date, '2018-12-31', None, 30)
+        scene.add_datasource(GenericSingleImageDatasource, None, {'image_args': name})
+        return fake_fingerprint(scene.get_scene(), 30, EPSG3857)
+
+    def cache_id(self, name, start_date='2018-01-01'):
+        return 'users/someone/cache/{}_{}'.format(name, self.cache_key(name, start_date)[:CACHE_KEY_LENGTH])
+
+    def test_utm_not_cached(self):
+        with self.assertRaises(ExportManagerError):
+            ExportManager._populate_cache(self.image_spec(projection=UTM), self.config, TaskScheduler())
+
+    def test_populate_cache_with_scheduler(self):
+        get_assets = self.mocks[2]
+        self.assets[self.cache_id('b')] = {'properties': {CACHE_KEY_PROPERTY: self.cache_key('b')}}
+        scheduler = TaskScheduler()
+        cache_asset_ids, dependencies = ExportManager._populate_cache(self.image_spec(), self.config, scheduler)
+
+        self.assertEqual(cache_asset_ids, {name: self.cache_id(name) for name in ['a', 'b', 'c']})
+        self.assertEqual(sorted(dependencies), [self.cache_id('a'), self.cache_id('c')])
+        self.assertEqual(sorted(scheduler.tasks.keys()), sorted(dependencies))
+        self.assertFalse(any(job.task.started for job in scheduler.tasks.values()))
+        # One batched lookup for all cached datasources.
+        get_assets.assert_called_once()
+        self.assertEqual(sorted(get_assets.call_args[0][0]), sorted(cache_asset_ids.values()))
+        # The cache key is stored in the exported asset.
+        self.assertEqual(
+            sorted((e['assetId'], e['image'].properties[CACHE_KEY_PROPERTY]) for e in self.exported),
+            [(self.cache_id('a'), self.cache_key('a')), (self.cache_id('c'), self.cache_key('c'))]
+        )
+
+        # Exports already in the scheduler are returned as dependencies without being checked or exported again.
+        _, dependencies = ExportManager._populate_cache(self.image_spec(), self.config, scheduler)
+        self.assertEqual(sorted(dependencies), [self.cache_id('a'), self.cache_id('c')])
+        self.assertEqual(get_assets.call_args[0][0], [self.cache_id('b')])
+        self.assertEqual(len(self.exported), 2)
+
+    def test_changed_inputs(self):
+        scheduler = TaskScheduler()
+        first, _ = ExportManager._populate_cache(self.image_spec(), self.config, scheduler)
+        second, _ = ExportManager._populate_cache(self.image_spec(start_date='2017-01-01'), self.config, scheduler)
+        self.assertEqual(second['a'], self.cache_id('a', start_date='2017-01-01'))
+        self.assertNotEqual(first['a'], second['a'])
+        self.assertEqual(len(scheduler), 6)
+
+    def test_key_mismatch(self):
+        self.assets[self.cache_id('a')] = {'properties': {CACHE_KEY_PROPERTY: 'something else'}}
+        with self.assertRaises(ExportManagerError):
+            ExportManager._populate_cache(self.image_spec(), self.config, TaskScheduler())
+
+    def test_not_content_addressed(self):
+        self.assets['users/someone/cache/a'] = {'properties': {CACHE_KEY_PROPERTY: 'stale'}}
+        scheduler = TaskScheduler()
+        cache_asset_ids, dependencies = ExportManager._populate_cache(
+            self.image_spec(), self.config, scheduler, content_addressed=False
+        )
+        self.assertEqual(cache_asset_ids, {name: 'users/someone/cache/{}'.format(name) for name in ['a', 'b', 'c']})
+        self.assertEqual(sorted(dependencies), ['users/someone/cache/b', 'users/someone/cache/c'])
+
+    def test_cache_manager(self):
+        self.assets[self.cache_id('b')] = {'properties': {CACHE_KEY_PROPERTY: self.cache_key('b')}}
+        cache_manager = mock.MagicMock()
+        cache_manager.export_properties.side_effect = lambda cache_key: {CACHE_KEY_PROPERTY: cache_key}
+        cache_asset_ids, _ = ExportManager._populate_cache(
+            self.image_spec(), self.config, TaskScheduler(), cache_manager=cache_manager
+        )
+        cache_manager.touch.assert_called_once_with([self.cache_id('b')])
+        self.assertEqual(sorted(cache_manager.enforce_budget.call_args[1]['protected']),
+                         sorted(cache_asset_ids.values()))
+        self.assertEqual(cache_manager.export_properties.call_count, 2)
+
+    def test_unstacked_cache_budget(self):
+        cache_manager = mock.MagicMock()
+        cache_manager.export_properties.side_effect = lambda cache_key: {CACHE_KEY_PROPERTY: cache_key}
+        export_manager = ExportManager(self.config, cache_manager=cache_manager)
+        with mock.patch('gee_tools.exports.export_manager.add_imagery', side_effect=lambda fc, *args, **kwargs: fc):
+            export_manager.sample_tiles_unstacked(mock.MagicMock(), self.image_spec(), 16, scheduler=TaskScheduler())
+        # Enforced once, never with only the cache asset of one datasource protected.
+        cache_manager.enforce_budget.assert_called_once()
+        self.assertEqual(sorted(cache_manager.enforce_budget.call_args[1]['protected']),
+                         ['users/someone/cache/{}'.format(name) for name in ['a', 'b', 'c']])
+        # One batched lookup for all datasources, not another one per datasource.
+        self.mocks[2].assert_called_once()
+
+    def test_populate_cache_blocking(self):
+        with mock.patch.object(TaskScheduler, 'run') as run:
+            cache_asset_ids, dependencies = ExportManager._populate_cache(self.image_spec(), self.config)
+        self.assertEqual(dependencies, [])
+        self.assertEqual(len(cache_asset_ids), 3)
+        run.assert_called_once()
+
+    def test_get_scene_with_scheduler(self):
+        scheduler = TaskScheduler()
+        export_manager = ExportManager(self.config, content_addressed_cache=True)
+        with mock.patch.object(TaskScheduler, 'run') as run:
+            scene, output_bands, dependencies = export_manager.get_scene(self.image_spec_kwargs, scheduler=scheduler)
+        run.assert_not_called()
+        self.assertEqual(sorted(dependencies), [self.cache_id(name) for name in ['a', 'b', 'c']])
+        self.assertEqual(sorted(output_bands), ['A', 'B', 'C', 'D', 'LAT', 'LON'])
+
+    def test_image_spec_reads_cache(self):
+        export_manager = ExportManager(self.config, content_addressed_cache=True)
+        image_spec, _, _ = export_manager._get_image_spec_helper(self.image_spec_kwargs, scheduler=TaskScheduler())
+        image_args = sorted(kwargs.get('image_args', None) for _, kwargs in image_spec.datasources if kwargs)
+        self.assertEqual(image_args, [self.cache_id(name) for name in ['a', 'b', 'c']])
+
+        # By default the cache assets exported before cache keys existed are used as is.
+        export_manager = ExportManager(self.config)
+        image_spec, _, _ = export_manager._get_image_spec_helper(self.image_spec_kwargs, scheduler=TaskScheduler())
+        image_args = sorted(kwargs.get('image_args', None) for _, kwargs in image_spec.datasources if kwargs)
+        self.assertEqual(image_args, ['users/someone/cache/{}'.format(name) for name in ['a', 'b', 'c']])
+
+    def test_input_bands(self):
+        self.config['d']['input_bands'] = ['b1', 'b2']
+        export_manager = ExportManager(self.config)
+        image_spec, _, _ = export_manager._get_image_spec_helper(self.image_spec_kwargs, scheduler=TaskScheduler())
+        self.assertEqual(sorted(image_spec.bands, key=str), [None, None, None, ['b1', 'b2']])
+
+    def test_sample_tiles_sharded(self):
+        fc = mock.MagicMock()
+        fc.map.return_value = fc
+        exports = []
+
+        def export_fn(samples, shard, description):
+            exports.append((shard.name, description))
+            return FakeTask(1)
+
+        export_manager = ExportManager(self.config, content_addressed_cache=True)
+        with mock.patch('gee_tools.exports.export_manager.add_imagery') as add_imagery, \
+                mock.patch('ee.Filter.inList', side_effect=lambda prop, values: (prop, tuple(values))):
+            scheduler, shards, output_bands = export_manager.sample_tiles_sharded(
+                fc, self.image_spec_kwargs, 16, export_fn, max_points_per_shard=10,
+                cell_counts={'0_0': 6, '1_0': 3, '0_1': 8, '5_5': 20}, retry_policy=RetryPolicy(),
+            )
+        self.assertEqual([shard.values for shard in shards], [['0_0', '1_0'], ['0_1'], ['5_5']])
+        self.assertEqual(sorted(output_bands), ['A', 'B', 'C', 'D', 'LAT', 'LON'])
+        self.assertEqual([call[0][0] for call in fc.filter.call_args_list], [
+            (sharding.SHARD_PROPERTY, ('0_0', '1_0')), (sharding.SHARD_PROPERTY, ('0_1',)),
+            (sharding.SHARD_PROPERTY, ('5_5',)),
+        ])
+        self.assertEqual(add_imagery.call_count, 3)
+        # Every shard depends on the cache exports, and the scene is resolved once for all shards.
+        cache_ids = sorted(self.cache_id(name) for name in ['a', 'b', 'c'])
+        for shard in shards:
+            job = scheduler.tasks['sample_tiles_' + shard.name]
+            self.assertEqual(sorted(job.dependencies), cache_ids)
+            self.assertIsNotNone(job.task_factory)
+        self.assertEqual(len(scheduler), len(shards) + 3)
+        self.assertEqual(exports, [(s.name, 'sample_tiles_' + s.name) for s in shards])
+
+        with self.assertRaises(ExportManagerError):
+            export_manager.sample_tiles_sharded(fc, self.image_spec_kwargs, 16, export_fn, shard_by='other')
+
+    def test_sample_tiles_sharded_by_id(self):
+        fc = mock.MagicMock()
+        manifest_path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(manifest_path))
+        export_manager = ExportManager(self.config)
+        with mock.patch('gee_tools.exports.export_manager.add_imagery'), \
+                mock.patch('ee.Filter.inList', side_effect=lambda prop, values: (prop, tuple(values))), \
+                mock.patch.object(sharding, 'add_hash_bucket', return_value=fc) as add_hash_bucket:
+            _, shards, _ = export_manager.sample_tiles_sharded(
+                fc, self.image_spec_kwargs, 16, lambda samples, shard, description: FakeTask(1),
+                shard_by=sharding.HASH, num_shards=4, id_property='name', manifest_path=manifest_path,
+            )
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(add_hash_bucket.call_args, mock.call(fc, 4, None, id_property='name'))
+        manifest, _ = sharding.read_manifest(manifest_path)
+        self.assertEqual((manifest['shard_by'], manifest['id_property']), (sharding.HASH, 'name'))
+
+
 if __name__ == '__main__':
     unittest.main()
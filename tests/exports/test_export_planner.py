@@ -0,0 +1,191 @@
+"""
+python -m tests.exports.test_export_planner
+"""
+import types
+import unittest
+from unittest import mock
+
+from gee_tools.exports.export_planner import (
+    ExportPlanner, ExportPlannerError, PlannedRegion, estimate_pixels, plan_groups, union_bounds, fetch_regions,
+    MAX_PIXELS_MARGIN,
+)
+from gee_tools.exports.constants import UTM, EPSG3857, EPSG4326
+from tests.exports.test_export_manager import FakeScene
+from tests.exports.test_image_spec import fake_geometry
+from tests.exports.test_task_scheduler import FakeTask
+
+# About 1.1km at the equator, i.e. 37 pixels at 30m.
+CELL = 0.01
+
+
+def grid_regions(rows, cols, size=CELL):
+    """Adjacent square regions on a grid at the equator."""
+    return [
+        PlannedRegion('r{}_{}'.format(row, col), (col * size, row * size, (col + 1) * size, (row + 1) * size))
+        for row in range(rows) for col in range(cols)
+    ]
+
+
+class FakeExportManager(object):
+    """Records the get_scene calls of the planner."""
+
+    def __init__(self, cache_dependencies=()):
+        self.cache_dependencies = list(cache_dependencies)
+        self.calls = []
+
+    def get_scene(self, image_spec, tags=None, scheduler=None):
+        self.calls.append((image_spec, tags))
+        for jid in self.cache_dependencies:
+            if jid not in scheduler.tasks:
+                scheduler.add_task(FakeTask(1), jid)
+        return FakeScene('scene'), ['B1', 'LAT', 'LON'], list(self.cache_dependencies)
+
+
+class PlanGroupsUnitTest(unittest.TestCase):
+
+    def test_estimate_pixels(self):
+        self.assertEqual(estimate_pixels((0.0, 0.0, CELL, CELL), 30), 38 * 38)
+        self.assertEqual(estimate_pixels((0.0, 0.0, CELL, CELL), 30, None), 38 * 37)
+        # On the ground, degrees of longitude shrink away from the equator.
+        self.assertLess(estimate_pixels((0.0, 60.0, CELL, 60.0 + CELL), 30, None), 20 * 37)
+        # EPSG:4326 pixels are a fixed number of degrees.
+        self.assertEqual(estimate_pixels((0.0, 60.0, CELL, 60.0 + CELL), 30, EPSG4326), 38 * 38)
+
+    def test_high_latitude(self):
+        # EPSG:3857 stretches ground distances by sec(lat) in both directions, 4 times the pixels at 60 degrees.
+        bounds = (0.0, 59.5, 1.0, 60.5)
+        ground = estimate_pixels(bounds, 30, None)
+        self.assertAlmostEqual(estimate_pixels(bounds, 30, EPSG3857) / float(ground), 4.0, delta=0.05)
+
+        region = PlannedRegion('north', bounds)
+        max_pixels = 1e7
+        # Under the limit on the ground, but not in the export CRS.
+        self.assertEqual(len(plan_groups([region], 30, max_pixels, projection=None)), 1)
+        tiles = plan_groups([region], 30, max_pixels)
+        self.assertGreater(len(tiles), 1)
+        for tile in tiles:
+            self.assertLessEqual(estimate_pixels(tile.bounds, 30, EPSG3857), max_pixels)
+
+    def test_groups_under_limit(self):
+        regions = grid_regions(10, 10)
+        one_region = estimate_pixels(regions[0].bounds, 30)
+        groups = plan_groups(regions, 30, max_pixels=one_region * 16)
+        self.assertEqual(sorted(r for g in groups for r in g.region_ids), sorted(r.region_id for r in regions))
+        for group in groups:
+            self.assertLessEqual(group.num_pixels, one_region * 16)
+            self.assertEqual(group.bounds, union_bounds([r.bounds for r in regions if r.region_id in group.region_ids]))
+        # Neighbours are grouped, so a lot fewer tasks than regions.
+        self.assertLess(len(groups), 20)
+        self.assertEqual(len(set(g.name for g in groups)), len(groups))
+
+    def test_max_regions_per_group(self):
+        groups = plan_groups(grid_regions(4, 4), 30, max_pixels=1e9, max_regions_per_group=4)
+        self.assertEqual([len(g.region_ids) for g in groups], [4, 4, 4, 4])
+        self.assertEqual(len(plan_groups(grid_regions(4, 4), 30, max_pixels=1e9)), 1)
+
+    def test_split_large_regions(self):
+        big = PlannedRegion('big/one', (0.0, 0.0, 1.0, 1.0))
+        small = PlannedRegion('small', (2.0, 2.0, 2.0 + CELL, 2.0 + CELL))
+        groups = plan_groups([big, small], 30, max_pixels=1e6)
+        tiles = [g for g in groups if g.tile is not None]
+        self.assertEqual(len(tiles) + 1, len(groups))
+        self.assertGreaterEqual(len(tiles), estimate_pixels(big.bounds, 30) / 1e6)
+        for tile in tiles:
+            self.assertEqual(tile.region_ids, ['big/one'])
+            self.assertLessEqual(tile.num_pixels, 1e6)
+            self.assertTrue(tile.name.startswith('big_one_group'))
+        self.assertEqual(union_bounds([t.bounds for t in tiles]), big.bounds)
+
+    def test_unique_tile_names(self):
+        # The ids are the same once sanitized.
+        regions = [PlannedRegion('a b', (0, 0, 1, 1)), PlannedRegion('a/b', (5, 5, 6, 6))]
+        groups = plan_groups(regions, 30, max_pixels=1e6)
+        self.assertEqual(set(r for g in groups for r in g.region_ids), {'a b', 'a/b'})
+        self.assertEqual(len(set(g.name for g in groups)), len(groups))
+
+    def test_invalid(self):
+        with self.assertRaises(ExportPlannerError):
+            plan_groups([PlannedRegion('a', (0, 0, 1, 1)), PlannedRegion('a', (1, 1, 2, 2))], 30)
+        with self.assertRaises(ExportPlannerError):
+            plan_groups(grid_regions(1, 1), 30, max_regions_per_group=0)
+        self.assertEqual(plan_groups([], 30), [])
+
+
+class FakeSummaries(object):
+    """The mapped regions collection of fetch_regions, records the toList pages."""
+
+    def __init__(self, num_regions):
+        self.features = [
+            {'properties': {'id': i, 'bounds': [[i, 0], [i + 1, 0], [i + 1, 1], [i, 1], [i, 0]]}}
+            for i in range(num_regions)
+        ]
+        self.pages = []
+
+    def toList(self, count, offset):
+        self.pages.append((count, offset))
+        return types.SimpleNamespace(getInfo=lambda: self.features[offset:offset + count])
+
+
+class FetchRegionsUnitTest(unittest.TestCase):
+
+    def test_pages(self):
+        summaries = FakeSummaries(7)
+        regions_fc = mock.MagicMock()
+        regions_fc.map.return_value = summaries
+        regions = fetch_regions(regions_fc, 'id', page_size=3)
+        self.assertEqual([region.region_id for region in regions], list(range(7)))
+        self.assertEqual(regions[6].bounds, (6, 0, 7, 1))
+        self.assertEqual(summaries.pages, [(3, 0), (3, 3), (3, 6)])
+
+        summaries = FakeSummaries(6)
+        regions_fc.map.return_value = summaries
+        self.assertEqual(len(fetch_regions(regions_fc, 'id', page_size=3)), 6)
+        self.assertEqual(summaries.pages, [(3, 0), (3, 3), (3, 6)])
+
+
+class ExportPlannerUnitTest(unittest.TestCase):
+
+    def test_schedule(self):
+        manager = FakeExportManager(cache_dependencies=['cache_a'])
+        planner = ExportPlanner(manager, max_pixels=1e5, tags=['T'])
+        image_spec = {'start_date': '2018-01-01', 'end_date': '2019-01-01', 'filterpoly': fake_geometry(),
+                      'scale': 30, 'projection': 'EPSG:4326'}
+        exports = []
+
+        def export_fn(image, group, export_kwargs):
+            exports.append((image, group, export_kwargs))
+            return FakeTask(1)
+
+        scheduler, groups = planner.schedule(None, image_spec, export_fn, regions=grid_regions(20, 20),
+                                             clip=False, jid_prefix='adm_')
+        # The scene is built once for all regions.
+        self.assertEqual(len(manager.calls), 1)
+        self.assertEqual(manager.calls[0][1], ['T'])
+        self.assertEqual(len(exports), len(groups))
+        self.assertLess(len(groups), 400)
+        self.assertEqual(len(scheduler), len(groups) + 1)
+        for image, group, export_kwargs in exports:
+            jid = 'adm_' + group.name
+            self.assertEqual(scheduler.tasks[jid].dependencies, {'cache_a'})
+            self.assertEqual(export_kwargs['description'], jid)
+            self.assertEqual(export_kwargs['region'], group.coordinates)
+            self.assertEqual((export_kwargs['scale'], export_kwargs['crs']), (30, 'EPSG:4326'))
+            self.assertEqual(export_kwargs['maxPixels'], int(1e5 * MAX_PIXELS_MARGIN))
+
+        for job in scheduler.tasks.values():
+            job.task.remaining = 0
+        scheduler.run(sleep_time=0.0, error_on_fail=True)
+
+    def test_utm(self):
+        image_spec = {'scale': 30, 'projection': UTM, 'filterpoly': fake_geometry()}
+        with self.assertRaises(ExportPlannerError):
+            ExportPlanner(FakeExportManager()).schedule(None, image_spec, None, regions=grid_regions(1, 1))
+
+    def test_no_regions(self):
+        manager = FakeExportManager()
+        scheduler, groups = ExportPlanner(manager).schedule(None, {'scale': 30}, None, regions=[])
+        self.assertEqual((len(scheduler), groups, manager.calls), (0, [], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
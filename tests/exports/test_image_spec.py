@@ -0,0 +1,221 @@
+"""
+python -m tests.exports.test_image_spec
+"""
+import json
+import unittest
+from unittest import mock
+
+import ee
+
+from gee_tools.datasources.interface import GlobalImageDatasource
+from gee_tools.exports import image_spec as image_spec_module
+from gee_tools.exports import util, constants
+from gee_tools.exports.image_spec import ImageSpec, clear_datasource_cache, register, registered_name, resolve
+
+
+class FakeImage(object):
+    """Stand-in for ee.Image that records the operations applied to it."""
+
+    def __init__(self, ops):
+        self.ops = tuple(ops)
+
+    def reproject(self, crs, crsTransform=None, scale=None):
+        return FakeImage(self.ops + (('reproject', crs, scale),))
+
+    def addBands(self, other):
+        return FakeImage(self.ops + (('addBands', other.ops),))
+
+    def __eq__(self, other):
+        return isinstance(other, FakeImage) and self.ops == other.ops
+
+    def __hash__(self):
+        return hash(self.ops)
+
+
+class CountingDatasource(GlobalImageDatasource):
+    """A datasource that counts how many times it was constructed."""
+
+    num_built = 0
+
+    def build_img_coll(self, name='a', **kwargs):
+        CountingDatasource.num_built += 1
+        self.name = name
+
+    def get_img_coll(self):
+        return FakeImage([('coll', self.name, self.start_date, self.end_date)])
+
+    def get_img_coll_bands(self, bands):
+        return FakeImage([('coll', self.name, self.start_date, self.end_date, tuple(bands))])
+
+
+def first(img_coll):
+    return img_coll
+
+
+def fake_geometry():
+    # ee.Geometry can not be built without ee.Initialize, but ImageSpec only checks the type.
+    return object.__new__(ee.Geometry)
+
+
+class ImageSpecMemoizationUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_datasource_cache()
+        CountingDatasource.num_built = 0
+        self.region = fake_geometry()
+        self.add_latlon = ImageSpec._add_latlon
+        ImageSpec._add_latlon = staticmethod(lambda scene: FakeImage(scene.ops + (('latlon',),)))
+
+    def tearDown(self):
+        ImageSpec._add_latlon = staticmethod(self.add_latlon)
+        clear_datasource_cache()
+
+    def image_spec(self, start_date='2018-01-01', name='a'):
+        spec = ImageSpec(start_date, '2019-01-01', self.region, 30)
+        spec.add_datasource(CountingDatasource, first, {'name': name})
+        return spec
+
+    def test_shared_across_image_specs(self):
+        scene = self.image_spec().get_scene(add_latlon=False)
+        self.assertEqual(self.image_spec().get_scene(add_latlon=False), scene)
+        self.assertEqual(CountingDatasource.num_built, 1)
+
+        self.image_spec(name='b').get_scene(add_latlon=False)
+        self.image_spec(start_date='2017-01-01').get_scene(add_latlon=False)
+        self.assertEqual(CountingDatasource.num_built, 3)
+
+    def test_latlon_toggle(self):
+        spec = self.image_spec()
+        with_latlon = spec.get_scene()
+        without_latlon = spec.get_scene(add_latlon=False)
+        self.assertEqual(with_latlon.ops[-1], ('latlon',))
+        self.assertEqual(with_latlon.ops[:-1], without_latlon.ops)
+        self.assertIs(spec.get_scene(), with_latlon)
+        self.assertIs(spec.scene, with_latlon)
+        self.assertEqual(CountingDatasource.num_built, 1)
+
+    def test_invalidation(self):
+        spec = self.image_spec()
+        scene = spec.get_scene(add_latlon=False)
+        spec.add_static_scene(FakeImage([('static',)]))
+        self.assertIsNone(spec.scene)
+        self.assertNotEqual(spec.get_scene(add_latlon=False), scene)
+        spec.set_specification(scale=10)
+        self.assertEqual(spec.get_scene(add_latlon=False).ops[1], ('reproject', spec.projection, 10))
+        self.assertEqual(CountingDatasource.num_built, 2)
+
+    def test_bands(self):
+        spec = self.image_spec()
+        spec.add_datasource(CountingDatasource, first, {'name': 'a'}, bands=['B1', 'B2'])
+        ops = spec.get_scene(add_latlon=False).ops
+        self.assertEqual(ops[0], ('coll', 'a', '2018-01-01', '2019-01-01'))
+        self.assertEqual(ops[-1][1][0], ('coll', 'a', '2018-01-01', '2019-01-01', ('B1', 'B2')))
+        # The band subset is part of the memoization key.
+        self.assertEqual(CountingDatasource.num_built, 2)
+
+    def test_utm(self):
+        spec = ImageSpec('2018-01-01', '2019-01-01', self.region, 30, projection=constants.UTM)
+        spec.add_datasource(CountingDatasource, first, {'name': 'a'})
+        spec.add_static_scene(FakeImage([('static',)]))
+        # Images are sampled in the UTM zone of every point, not reprojected.
+        self.assertEqual(spec.get_scene(add_latlon=False).ops,
+                         (('coll', 'a', '2018-01-01', '2019-01-01'), ('addBands', (('static',),))))
+
+        fc, scene = object(), FakeImage([])
+        with mock.patch.object(image_spec_module.tfexp, 'get_array_patches_by_zone') as by_zone, \
+                mock.patch.object(image_spec_module.tfexp, 'get_array_patches') as patches, \
+                mock.patch('ee.Algorithms.If', side_effect=lambda condition, empty, samples: samples, create=True), \
+                mock.patch('ee.FeatureCollection', side_effect=lambda samples: samples):
+            scene.bandNames = mock.MagicMock()
+            self.assertIs(image_spec_module.add_imagery_scene(fc, scene, 30, constants.UTM, 2), by_zone.return_value)
+            by_zone.assert_called_once_with(scene, 30, 2, fc)
+            self.assertIs(image_spec_module.add_imagery_scene(fc, scene, 30, 'EPSG:32637', 2), patches.return_value)
+            self.assertEqual(patches.call_args[1], {'projection': 'EPSG:32637'})
+
+    def test_unhashable_kwargs(self):
+        spec = ImageSpec('2018-01-01', '2019-01-01', self.region, 30)
+        spec.add_datasource(CountingDatasource, first, {'name': bytearray(b'a')})
+        spec.get_scene(add_latlon=False)
+        ImageSpec._get_scene(spec, add_latlon=False)
+        self.assertEqual(CountingDatasource.num_built, 2)
+
+    def test_bounded(self):
+        size = image_spec_module.DATASOURCE_CACHE_SIZE
+        image_spec_module.DATASOURCE_CACHE_SIZE = 2
+        try:
+            for name in ['a', 'b', 'c', 'a']:
+                self.image_spec(name=name).get_scene(add_latlon=False)
+        finally:
+            image_spec_module.DATASOURCE_CACHE_SIZE = size
+        self.assertEqual(CountingDatasource.num_built, 4)
+
+
+class ImageSpecSerializationUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_datasource_cache()
+        self.addCleanup(clear_datasource_cache)
+        self.region = fake_geometry()
+        # Encode ee objects by reference, since they can not be serialized without ee.Initialize.
+        self.objects = {}
+
+        def encode(value, for_cloud_api=True):
+            self.objects[str(id(value))] = value
+            return {'ref': str(id(value))}
+
+        patches = [
+            mock.patch('ee.serializer.encode', side_effect=encode),
+            mock.patch('ee.deserializer.decodeCloudApi', side_effect=lambda encoded: self.objects[encoded['ref']]),
+            mock.patch.object(ImageSpec, '_add_latlon', staticmethod(lambda scene: scene)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def image_spec(self, name='a', comp_fn=first):
+        spec = ImageSpec('2018-01-01', '2019-01-01', self.region, 30)
+        spec.add_datasource(CountingDatasource, comp_fn, {'name': name, 'extra': [1, None]}, bands=['B1'])
+        spec.add_datasource(CountingDatasource, first, {'name': 'c', 'region': self.region})
+        return spec
+
+    def test_round_trip(self):
+        spec = self.image_spec()
+        d = json.loads(json.dumps(spec.to_dict()))
+        self.assertEqual(d['datasources'][0]['class'], 'tests.exports.test_image_spec:CountingDatasource')
+        loaded = ImageSpec.from_dict(d)
+        self.assertIs(loaded.region, self.region)
+        self.assertEqual(loaded.data_sources, [
+            (CountingDatasource, {'name': 'a', 'extra': [1, None]}, first, ('B1',)),
+            (CountingDatasource, {'name': 'c', 'region': self.region}, first, None),
+        ])
+        self.assertEqual((loaded.start_date, loaded.scale, loaded.projection), ('2018-01-01', 30, spec.projection))
+        self.assertEqual(loaded.fingerprint(), spec.fingerprint())
+        self.assertNotEqual(self.image_spec(name='b').fingerprint(), spec.fingerprint())
+        with self.assertRaises(ValueError):
+            ImageSpec.from_dict(dict(d, version=0))
+
+    def test_registry(self):
+        composite = lambda img_coll: img_coll
+        spec = self.image_spec(comp_fn=composite)
+        with self.assertRaises(ValueError):
+            spec.to_dict()
+        register(composite, 'test_image_spec.identity')
+        self.addCleanup(image_spec_module._registry.pop, 'test_image_spec.identity')
+        self.assertEqual(registered_name(composite), 'test_image_spec.identity')
+        self.assertIs(ImageSpec.from_dict(spec.to_dict()).data_sources[0][2], composite)
+        with self.assertRaises(ValueError):
+            register(first, 'test_image_spec.identity')
+        with self.assertRaises(ValueError):
+            resolve('tests.exports.test_image_spec:missing')
+
+    def test_scene_fingerprint(self):
+        with mock.patch.object(util, '_fingerprint_default', side_effect=lambda value: repr(value.ops)):
+            fingerprint = self.image_spec().scene_fingerprint()
+            clear_datasource_cache()
+            # Specs built separately describe the same computation.
+            self.assertEqual(self.image_spec().scene_fingerprint(), fingerprint)
+            self.assertNotEqual(self.image_spec(name='b').scene_fingerprint(), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+python -m tests.exports.test_scheduler_metrics
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from gee_tools.exports.scheduler_metrics import SchedulerMetrics
+from gee_tools.exports.task_scheduler import TaskScheduler, RetryPolicy
+from tests.exports.test_task_scheduler import FakeTask, FakeBatchStatus, FlakyTaskFactory
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ClockedBatchStatus(FakeBatchStatus):
+    """Advances the clock by one second per bulk lookup."""
+
+    def __init__(self, clock):
+        super(ClockedBatchStatus, self).__init__()
+        self.clock = clock
+
+    def __call__(self, tasks):
+        self.clock.now += 1.0
+        return super(ClockedBatchStatus, self).__call__(tasks)
+
+
+def build_scheduler():
+    scheduler = TaskScheduler()
+    scheduler.add_task(FakeTask(2), 'a')
+    scheduler.add_task(FakeTask(2), 'b', ['a'])
+    scheduler.add_task(FakeTask(2, fail=True, error_message='User memory limit exceeded.'), 'c')
+    scheduler.add_task(FakeTask(2), 'd', ['c'])
+    scheduler.add_task(None, 'e', retry_policy=RetryPolicy(base_delay=0.0), task_factory=FlakyTaskFactory(1))
+    return scheduler
+
+
+class SchedulerMetricsUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_scheduler(self):
+        clock = FakeClock()
+        events = []
+        metrics = SchedulerMetrics(callback=events.append, clock=clock)
+        status_fn = ClockedBatchStatus(clock)
+        build_scheduler().run(max_processes=2, sleep_time=0.0, status_fn=status_fn, metrics=metrics)
+        return metrics, events, status_fn
+
+    def test_summary(self):
+        metrics, events, status_fn = self.run_scheduler()
+        summary = metrics.summary()
+        self.assertEqual(summary['num_jobs'], 5)
+        self.assertEqual(summary['num_completed'], 3)
+        self.assertEqual(summary['num_failed'], 1)
+        self.assertEqual(summary['num_skipped'], 1)
+        self.assertEqual(summary['num_retries'], 1)
+        self.assertEqual(summary['num_polls'], status_fn.calls)
+        self.assertEqual(summary['num_status_lookups'], status_fn.calls)
+        self.assertEqual(summary['makespan'], status_fn.calls)
+        self.assertTrue(0 < summary['slot_utilization'] <= 1)
+        # FakeTasks report RUNNING on the first lookup after they start.
+        self.assertEqual(summary['mean_gee_queue_wait'], 1.0)
+
+        names = set(event['name'] for event in events)
+        self.assertEqual(names, set([
+            'run_started', 'job_enqueued', 'job_started', 'job_running', 'job_finished', 'poll', 'sample', 'run_finished'
+        ]))
+        self.assertEqual(metrics.jobs['b']['enqueued'], metrics.jobs['a']['attempts'][0]['finished'])
+        self.assertEqual(len(metrics.jobs['e']['attempts']), 2)
+        self.assertEqual(metrics.jobs['d']['attempts'], [])
+
+    def test_dumps(self):
+        metrics, _, _ = self.run_scheduler()
+
+        json_path = os.path.join(self.tmp_dir, 'timeline.json')
+        metrics.to_json(json_path)
+        with open(json_path) as f:
+            timeline = json.load(f)
+        self.assertEqual(len(timeline['jobs']), 5)
+        self.assertEqual(timeline['summary']['num_completed'], 3)
+
+        trace_path = os.path.join(self.tmp_dir, 'trace.json')
+        metrics.to_chrome_trace(trace_path)
+        with open(trace_path) as f:
+            trace = json.load(f)
+        spans = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        counters = [event for event in trace['traceEvents'] if event['ph'] == 'C']
+        self.assertEqual(len(counters), len(metrics.samples))
+        self.assertEqual(set(span['name'] for span in spans), set(['a', 'b', 'c', 'e']))
+        # Rows are reused once the jobs drawn on them have finished.
+        self.assertLessEqual(max(span['tid'] for span in spans), 3)
+        for span in spans:
+            self.assertGreaterEqual(span['dur'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+python -m tests.exports.test_sharding
+"""
+import os
+import shutil
+import math
+import tempfile
+import unittest
+from unittest import mock
+
+from gee_tools.exports.sharding import (
+    Shard, ShardingError, TableExporter, grid_cell_id, plan_grid_shards, plan_hash_shards,
+    write_manifest, read_manifest, add_split, add_hash_bucket, GRID, SHARD_PROPERTY,
+)
+
+
+class FakeNumber(object):
+    """ee.Number whose mod has the sign of the dividend, like EE's."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def int(self):
+        return FakeNumber(int(self.value))
+
+    def mod(self, other):
+        return FakeNumber(int(math.fmod(self.value, other)))
+
+    def add(self, other):
+        return FakeNumber(self.value + other)
+
+
+class FakeFeatures(object):
+
+    def __init__(self, properties):
+        self.properties = properties
+
+    def map(self, fn):
+        return FakeFeatures([fn(p) for p in self.properties])
+
+
+class FakeProperties(dict):
+
+    def set(self, name, value):
+        return FakeProperties(self, **{name: value})
+
+
+class ShardPlanningUnitTest(unittest.TestCase):
+
+    def test_grid_cell_id(self):
+        self.assertEqual(grid_cell_id(12.5, -0.5, 1.0), '12_-1')
+        self.assertEqual(grid_cell_id(-0.25, 0.75, 0.5), '-1_1')
+
+    def test_grid_shards(self):
+        counts = {'0_0': 4, '1_0': 4, '2_0': 4, '0_1': 30, '1_1': 1}
+        shards = plan_grid_shards(counts, max_points_per_shard=10)
+        # Row by row, cells are packed until the next one would not fit.
+        self.assertEqual([shard.values for shard in shards], [['0_0', '1_0'], ['2_0'], ['0_1'], ['1_1']])
+        self.assertEqual([shard.num_points for shard in shards], [8, 4, 30, 1])
+        self.assertEqual([shard.index for shard in shards], [0, 1, 2, 3])
+        self.assertEqual(plan_grid_shards({}, 10), [])
+        with self.assertRaises(ShardingError):
+            plan_grid_shards(counts, 0)
+
+    def test_hash_shards(self):
+        self.assertEqual([shard.values for shard in plan_hash_shards(25, 10)], [[0], [1], [2]])
+        self.assertEqual(len(plan_hash_shards(num_shards=7)), 7)
+        self.assertEqual(len(plan_hash_shards(0, 10)), 1)
+        with self.assertRaises(ShardingError):
+            plan_hash_shards()
+
+    def test_hash_bucket_negative_keys(self):
+        fc = FakeFeatures([FakeProperties(key=key) for key in [-7, -3, 0, 4, 5]])
+        with mock.patch('ee.Number', FakeNumber):
+            buckets = [p[SHARD_PROPERTY].value for p in add_hash_bucket(fc, 3, key_property='key').properties]
+        self.assertEqual(buckets, [2, 0, 0, 1, 2])
+
+    def test_invalid_splits(self):
+        for splits in [[], [('train', 0.8), ('test', 0.1)], [('train', 1.2), ('test', -0.2)]]:
+            with self.assertRaises(ShardingError):
+                add_split(None, splits)
+
+
+class ManifestUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_round_trip(self):
+        path = os.path.join(self.directory, 'manifest.json')
+        shards = plan_grid_shards({'0_0': 3, '1_0': 3}, 4)
+        exporter = TableExporter('tiles/run1_', bucket='my-bucket')
+        write_manifest(path, shards, ['j0', 'j1'], exporter, shard_by=GRID, output_bands=['B1'])
+
+        manifest, loaded = read_manifest(path)
+        self.assertEqual([shard.to_dict() for shard in loaded], [shard.to_dict() for shard in shards])
+        self.assertEqual([record['jid'] for record in manifest['shards']], ['j0', 'j1'])
+        self.assertEqual(manifest['shards'][1]['output'], 'gs://my-bucket/tiles/run1_shard1')
+        self.assertEqual((manifest['shard_by'], manifest['output_bands']), (GRID, ['B1']))
+
+        # Exporters without output_path are not recorded.
+        write_manifest(path, shards, ['j0', 'j1'], lambda *args: None)
+        manifest, _ = read_manifest(path)
+        self.assertNotIn('output', manifest['shards'][0])
+
+    def test_drive_output_path(self):
+        self.assertEqual(TableExporter('run1_').output_path(Shard(3, [3])), 'run1_shard3')
+
+
+if __name__ == '__main__':
+    unittest.main()
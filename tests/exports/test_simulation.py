@@ -0,0 +1,105 @@
+"""
+python -m tests.exports.test_simulation
+"""
+import random
+import unittest
+
+from gee_tools.exports.concurrency import AIMDConcurrency
+from gee_tools.exports.simulation import (
+    VirtualClock, SimulatedBackend, SimulatedTask, random_dag, run_benchmark, format_results
+)
+from gee_tools.exports.task_scheduler import RetryPolicy
+
+
+class SimulatedBackendUnitTest(unittest.TestCase):
+
+    def test_worker_pool(self):
+        clock = VirtualClock()
+        backend = SimulatedBackend(clock, num_workers=2)
+        tasks = [SimulatedTask(backend, 10.0) for _ in range(3)]
+        for task in tasks:
+            task.start()
+        self.assertEqual([s['state'] for s in backend.status(tasks)], ['RUNNING', 'RUNNING', 'READY'])
+
+        clock.sleep(10.0)
+        self.assertEqual([s['state'] for s in backend.status(tasks)], ['COMPLETED', 'COMPLETED', 'RUNNING'])
+        # The queued task was picked up as soon as a worker became free, not when the status was looked up.
+        self.assertEqual(tasks[2].running_at, 10.0)
+
+        clock.sleep(100.0)
+        self.assertEqual(tasks[2].status()['state'], 'COMPLETED')
+        self.assertEqual(tasks[2].finished_at, 20.0)
+        self.assertEqual(backend.max_running, 2)
+
+    def test_latency_and_failures(self):
+        clock = VirtualClock()
+        backend = SimulatedBackend(clock, status_latency=2.0, start_latency=1.0)
+        task = SimulatedTask(backend, 5.0, fail=True, error_message='Computation timed out.')
+        task.start()
+        self.assertEqual(clock(), 1.0)
+        self.assertEqual(backend([task])[0]['state'], 'RUNNING')
+        self.assertEqual(clock(), 3.0)
+        clock.sleep(5.0)
+        status = backend([task])[0]
+        self.assertEqual(status['state'], 'FAILED')
+        self.assertEqual(status['error_message'], 'Computation timed out.')
+        self.assertEqual((backend.num_start_rpcs, backend.num_status_rpcs, backend.num_rpcs), (1, 2, 3))
+        with self.assertRaises(RuntimeError):
+            task.start()
+
+
+class BenchmarkUnitTest(unittest.TestCase):
+
+    def test_random_dag(self):
+        dag = random_dag(1000, max_dependencies=3, window=10)
+        self.assertEqual([jid for jid, _ in dag], list(range(1000)))
+        for jid, dependencies in dag:
+            self.assertLessEqual(len(dependencies), 3)
+            for dep_jid in dependencies:
+                self.assertTrue(jid - 10 <= dep_jid < jid)
+
+    def test_deterministic(self):
+        first = run_benchmark(200, num_workers=4, failure_rate=0.1, retry_policy=RetryPolicy(rng=random.Random(0)))
+        second = run_benchmark(200, num_workers=4, failure_rate=0.1, retry_policy=RetryPolicy(rng=random.Random(0)))
+        first.pop('wall_time')
+        second.pop('wall_time')
+        self.assertEqual(first, second)
+        self.assertEqual(first['num_jobs'], 200)
+        self.assertGreater(first['num_retries'], 0)
+        self.assertLessEqual(first['max_backend_running'], 4)
+
+    def test_measures_scheduling_changes(self):
+        slow = run_benchmark(500, sleep_time=120.0)
+        fast = run_benchmark(500, sleep_time=120.0, min_sleep_time=5.0)
+        self.assertEqual(slow['num_completed'], 500)
+        self.assertEqual(fast['num_completed'], 500)
+        self.assertLess(fast['makespan'], slow['makespan'])
+        self.assertLess(fast['slot_idle_time'], slow['slot_idle_time'])
+
+        unbatched = run_benchmark(500, sleep_time=120.0, batch_status=False)
+        self.assertGreaterEqual(unbatched['makespan'], slow['makespan'])
+        self.assertGreater(unbatched['num_status_rpcs'], 2 * slow['num_status_rpcs'])
+        self.assertEqual(unbatched['num_start_rpcs'], 500)
+
+    def test_adaptive_concurrency(self):
+        clock = VirtualClock()
+        controller = AIMDConcurrency(initial=2, max_processes=64, ready_threshold=60.0, increase_interval=60.0,
+                                     clock=clock)
+        result = run_benchmark(500, max_processes=controller, num_workers=10, min_sleep_time=5.0, clock=clock)
+        self.assertEqual(result['num_completed'], 500)
+        self.assertEqual(result['max_backend_running'], 10)
+
+    def test_failures_skip_dependents(self):
+        result = run_benchmark(300, failure_rate=0.2, status_latency=0.0, start_latency=0.0)
+        self.assertGreater(result['num_failed'], 0)
+        self.assertGreater(result['num_skipped'], 0)
+        self.assertEqual(result['num_completed'] + result['num_failed'] + result['num_skipped'], 300)
+
+    def test_format_results(self):
+        table = format_results([run_benchmark(10)]).splitlines()
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table[0].split()[0], 'num_nodes')
+
+
+if __name__ == '__main__':
+    unittest.main()
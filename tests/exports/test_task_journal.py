@@ -0,0 +1,115 @@
+"""
+python -m tests.exports.test_task_journal
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from gee_tools.exports.task_journal import TaskJournal, COMPLETED, FAILED, SKIPPED
+from gee_tools.exports.task_scheduler import TaskScheduler
+from tests.exports.test_task_scheduler import FakeTask, FakeBatchStatus
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingBatchStatus(FakeBatchStatus):
+    """Raises after a number of lookups to simulate the driver process dying."""
+
+    def __init__(self, max_calls):
+        super(CrashingBatchStatus, self).__init__()
+        self.max_calls = max_calls
+
+    def __call__(self, tasks):
+        if self.calls >= self.max_calls:
+            raise Crash()
+        return super(CrashingBatchStatus, self).__call__(tasks)
+
+
+def build_scheduler():
+    scheduler = TaskScheduler()
+    scheduler.add_task(FakeTask(1), 'a')
+    scheduler.add_task(FakeTask(1), ('b', 1), ['a'])
+    scheduler.add_task(FakeTask(10), 'c', [('b', 1)])
+    scheduler.add_task(FakeTask(10), 'd')
+    scheduler.add_task(FakeTask(1, fail=True), 'e')
+    scheduler.add_task(FakeTask(1), 'f', ['e'])
+    return scheduler
+
+
+class TaskJournalUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load(self):
+        journal = TaskJournal(self.path)
+        self.assertEqual(journal.load(), {})
+
+        scheduler = build_scheduler()
+        scheduler.run(sleep_time=0.0, journal=journal)
+        with open(self.path, 'a') as f:
+            f.write('{"event": "fini')
+
+        entries = journal.load()
+        self.assertEqual(set(entries.keys()), set(scheduler.tasks.keys()))
+        self.assertEqual(entries[('b', 1)].dependencies, ['a'])
+        self.assertEqual(entries['c'].state, COMPLETED)
+        self.assertEqual(entries['c'].task_id, scheduler.tasks['c'].task.id)
+        self.assertEqual(entries['e'].state, FAILED)
+        self.assertEqual(entries['f'].state, SKIPPED)
+        self.assertIsNone(entries['f'].task_id)
+
+    def test_resume(self):
+        journal = TaskJournal(self.path)
+        scheduler = build_scheduler()
+        with self.assertRaises(Crash):
+            scheduler.run(sleep_time=0.0, status_fn=CrashingBatchStatus(4), journal=journal)
+
+        entries = journal.load()
+        self.assertEqual(entries['a'].state, COMPLETED)
+        self.assertTrue(entries['c'].in_flight())
+        self.assertTrue(entries['d'].in_flight())
+
+        # The tasks that were started by the first run keep running on the (fake) server.
+        started_tasks = {job.task.id: job.task for job in scheduler.tasks.values() if job.task.started}
+
+        def task_lookup(task_ids):
+            return {task_id: started_tasks[task_id] for task_id in task_ids}
+
+        restarted = build_scheduler()
+        restarted.resume(journal, task_lookup=task_lookup)
+        restarted.run(sleep_time=0.0, journal=journal)
+
+        self.assertFalse(restarted.tasks['a'].task.started)
+        self.assertFalse(restarted.tasks[('b', 1)].task.started)
+        self.assertIs(restarted.tasks['c'].task, scheduler.tasks['c'].task)
+        self.assertIs(restarted.tasks['d'].task, scheduler.tasks['d'].task)
+        for jid in ['a', ('b', 1), 'c', 'd']:
+            self.assertTrue(restarted.tasks[jid]._success)
+        # Failed jobs are run again.
+        self.assertTrue(restarted.tasks['e'].task.started)
+        self.assertEqual(journal.load()['c'].state, COMPLETED)
+
+    def test_resume_missing_task(self):
+        journal = TaskJournal(self.path)
+        scheduler = build_scheduler()
+        with self.assertRaises(Crash):
+            scheduler.run(sleep_time=0.0, status_fn=CrashingBatchStatus(4), journal=journal)
+
+        restarted = build_scheduler()
+        restarted.resume(journal, task_lookup=lambda task_ids: {})
+        restarted.run(sleep_time=0.0)
+        self.assertFalse(restarted.tasks['a'].task.started)
+        self.assertTrue(restarted.tasks['c'].task.started)
+        self.assertIsNot(restarted.tasks['c'].task, scheduler.tasks['c'].task)
+
+
+if __name__ == '__main__':
+    unittest.main()
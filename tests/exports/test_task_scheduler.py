@@ -1,25 +1,35 @@
 """
 python -m tests.exports.test_task_scheduler
 """
+import time
 import unittest
 import random
+import itertools
+from unittest import mock
 
 import ee
 
-from gee_tools.exports.task_scheduler import TaskScheduler
+from gee_tools.exports.task_scheduler import (
+    TaskScheduler, TaskSchedulerError, RetryPolicy, BatchTaskStatus, _backoff_sleep_times,
+)
 
 # This may need to inherit from Task
 class FakeTask(object):
 
-    def __init__(self, time_until_finished, fail=False):
+    _ids = itertools.count()
+
+    def __init__(self, time_until_finished, fail=False, error_message='Internal error.'):
+        self.id = None
         self.started = False
         self.remaining = time_until_finished
         self.fail = fail
+        self.error_message = error_message
 
     def start(self):
         if self.started:
             raise RuntimeError('Task already started.')
         self.started = True
+        self.id = 'FAKE_TASK_{}'.format(next(FakeTask._ids))
 
     def _status(self):
         if not self.started:
@@ -32,13 +42,55 @@ class FakeTask(object):
         return ee.batch.Task.State.COMPLETED
 
     def status(self):
-        return {'state': self._status()}
+        state = self._status()
+        if state == ee.batch.Task.State.FAILED:
+            return {'state': state, 'error_message': self.error_message}
+        return {'state': state}
 
     @property
     def State(self):
         return ee.batch.Task.State
 
 
+class FakeBatchStatus(object):
+    """Stand-in for batch_task_status that counts how many bulk lookups were made."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, tasks):
+        self.calls += 1
+        return [task.status() for task in tasks]
+
+
+class OrderedTask(FakeTask):
+    """FakeTask that appends its name to start_order when started."""
+
+    def __init__(self, time_until_finished, name, start_order):
+        super(OrderedTask, self).__init__(time_until_finished)
+        self.name = name
+        self.start_order = start_order
+
+    def start(self):
+        super(OrderedTask, self).start()
+        self.start_order.append(self.name)
+
+
+class FlakyTaskFactory(object):
+    """Creates tasks that fail with error_message until num_failures tasks have been created."""
+
+    def __init__(self, num_failures, error_message='Internal error.'):
+        self.num_failures = num_failures
+        self.error_message = error_message
+        self.tasks = []
+
+    def __call__(self):
+        fail = len(self.tasks) < self.num_failures
+        task = FakeTask(1, fail=fail, error_message=self.error_message)
+        self.tasks.append(task)
+        return task
+
+
 def add_task(scheduler, jid, dependencies):
     dependencies = list(dependencies)
     num_dep = 0 if len(dependencies) == 0 else random.randint(0, (len(dependencies) - 1))
@@ -78,6 +130,212 @@ class TaskSchedulerUnitTest(unittest.TestCase):
             scheduler.add_task(task, i)
         scheduler.run(max_processes=4, sleep_time=0.0, verbose=0)
 
+    def test_batch_status(self):
+        random.seed(0)
+        scheduler = TaskScheduler()
+        for i in range(100):
+            add_task(scheduler, i, list(range(i)))
+        status_fn = FakeBatchStatus()
+        scheduler.run(max_processes=8, sleep_time=0.0, verbose=0, status_fn=status_fn)
+
+        # Every task is either finished or was skipped because a dependency failed.
+        for job in scheduler.tasks.values():
+            self.assertTrue(job._finished)
+        # One bulk lookup per polling cycle, each task needs at most 10 polls to finish.
+        self.assertGreater(status_fn.calls, 0)
+        self.assertLessEqual(status_fn.calls, 10 * len(scheduler))
+
+    def test_batch_status_missing_tasks(self):
+        listed, dropped, purged = FakeTask(2), FakeTask(0), FakeTask(0)
+        scheduler = TaskScheduler()
+        for jid, task in [('listed', listed), ('dropped', dropped), ('purged', purged)]:
+            scheduler.add_task(task, jid)
+
+        def get_task_status(task_ids):
+            states = {dropped.id: ee.batch.Task.State.COMPLETED, purged.id: 'UNKNOWN'}
+            return [{'id': task_id, 'state': states[task_id]} for task_id in task_ids]
+
+        with mock.patch('ee.data.getTaskList', side_effect=lambda: [dict(listed.status(), id=listed.id)]), \
+                mock.patch('ee.data.getTaskStatus', side_effect=get_task_status) as lookup:
+            scheduler.run(sleep_time=0.0, status_fn=BatchTaskStatus(max_missing_polls=2))
+        # The missing tasks are looked up by id once, on the second poll.
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(sorted(lookup.call_args[0][0]), sorted([dropped.id, purged.id]))
+        self.assertTrue(scheduler.tasks['listed']._success)
+        self.assertTrue(scheduler.tasks['dropped']._success)
+        self.assertTrue(scheduler.tasks['purged'].failed())
+        self.assertIn('not found', scheduler.tasks['purged'].last_status['error_message'])
+
+    def test_batch_status_independent_tasks(self):
+        scheduler = TaskScheduler()
+        for i in range(64):
+            scheduler.add_task(FakeTask(5, fail=False), i)
+        status_fn = FakeBatchStatus()
+        scheduler.run(max_processes=64, sleep_time=0.0, verbose=0, status_fn=status_fn)
+        # All tasks run concurrently, so the number of lookups does not grow with the number of tasks.
+        self.assertEqual(status_fn.calls, 6)
+
+    def test_circular_dependency(self):
+        scheduler = TaskScheduler()
+        with self.assertRaises(TaskSchedulerError):
+            scheduler.add_task(FakeTask(1), 'a', ['a'])
+
+        scheduler = TaskScheduler()
+        scheduler.add_task(FakeTask(1), 'a', ['c'])
+        scheduler.add_task(FakeTask(1), 'b', ['a'])
+        with self.assertRaises(TaskSchedulerError):
+            scheduler.add_task(FakeTask(1), 'c', ['b'])
+        # Forward references without a cycle are allowed.
+        scheduler.add_task(FakeTask(1), 'c')
+        scheduler.run(sleep_time=0.0)
+
+        # Cycles created by merging schedulers are detected before any task starts.
+        first = TaskScheduler()
+        first.add_task(FakeTask(1), 'a', ['b'])
+        first.add_task(FakeTask(1), 'c')
+        second = TaskScheduler()
+        second.add_task(FakeTask(1), 'b', ['a'])
+        scheduler = first.merge(second)
+        with self.assertRaises(TaskSchedulerError):
+            scheduler.run(sleep_time=0.0)
+        self.assertFalse(any(task.started for task in scheduler))
+
+    def test_unknown_dependency(self):
+        scheduler = TaskScheduler()
+        scheduler.add_task(FakeTask(1), 'a')
+        scheduler.add_task(FakeTask(1), 'b', ['missing'])
+        with self.assertRaises(TaskSchedulerError):
+            scheduler.run(sleep_time=0.0)
+        self.assertFalse(scheduler.tasks['a'].task.started)
+
+    def test_failure_skips_dependents(self):
+        scheduler = TaskScheduler()
+        scheduler.add_task(FakeTask(1, fail=True), 'a')
+        scheduler.add_task(FakeTask(1), 'b', ['a'])
+        scheduler.add_task(FakeTask(1), 'c', ['b'])
+        scheduler.add_task(FakeTask(1), 'd', ['c', 'e'])
+        scheduler.add_task(FakeTask(1), 'e')
+        scheduler.run(sleep_time=0.0)
+        for jid in ['b', 'c', 'd']:
+            self.assertTrue(scheduler.tasks[jid].failed())
+            self.assertFalse(scheduler.tasks[jid].task.started)
+        self.assertFalse(scheduler.tasks['e'].failed())
+
+    def test_large_graph(self):
+        # Layers of 100 jobs where each job depends on a few jobs of the previous layer.
+        random.seed(0)
+        scheduler = TaskScheduler()
+        width = 100
+        for i in range(50000):
+            layer_start = (i // width - 1) * width
+            dependencies = [] if layer_start < 0 else random.sample(range(layer_start, layer_start + width), 3)
+            scheduler.add_task(FakeTask(0), i, dependencies)
+        status_fn = FakeBatchStatus()
+        scheduler.run(max_processes=width, sleep_time=0.0, status_fn=status_fn)
+        self.assertTrue(all(job._success for job in scheduler.tasks.values()))
+
+    def test_fair_share(self):
+        start_order = []
+        scheduler = TaskScheduler()
+        for i in range(100):
+            scheduler.add_task(OrderedTask(1, 'big', start_order), ('big', i), group='big')
+        for i in range(5):
+            scheduler.add_task(OrderedTask(1, 'small', start_order), ('small', i), group='small')
+        scheduler.run(max_processes=2, sleep_time=0.0)
+        # Groups alternate while both have ready tasks, instead of the small group waiting for the big one.
+        self.assertEqual(start_order[:10], ['big', 'small'] * 5)
+
+        start_order = []
+        scheduler = TaskScheduler()
+        for group in ['a', 'b']:
+            for i in range(40):
+                scheduler.add_task(OrderedTask(1, group, start_order), (group, i), group=group)
+        scheduler.set_group_weight('b', 3)
+        scheduler.run(max_processes=4, sleep_time=0.0)
+        self.assertEqual(start_order[:40].count('b'), 30)
+
+        with self.assertRaises(TaskSchedulerError):
+            scheduler.set_group_weight('a', 0)
+
+    def test_priority(self):
+        start_order = []
+        scheduler = TaskScheduler()
+        scheduler.add_task(OrderedTask(1, 'first', start_order), 'first')
+        for i in range(5):
+            scheduler.add_task(OrderedTask(1, i, start_order), i, priority=i)
+        scheduler.add_task(OrderedTask(1, 'dependent', start_order), 'dependent', ['first'], priority=10)
+        scheduler.run(max_processes=1, sleep_time=0.0)
+        # Ties are broken by the order in which tasks became ready.
+        self.assertEqual(start_order, [4, 3, 2, 1, 'first', 'dependent', 0])
+
+    def test_retry_policy(self):
+        policy = RetryPolicy()
+        failed = ee.batch.Task.State.FAILED
+        self.assertTrue(policy.is_retryable({'state': failed, 'error_message': 'Internal error.'}))
+        self.assertTrue(policy.is_retryable({'state': failed, 'error_message': 'Computation timed out.'}))
+        self.assertTrue(policy.is_retryable({'state': failed, 'error_message': 'Earth Engine quota exceeded.'}))
+        self.assertFalse(policy.is_retryable({'state': failed, 'error_message': 'User memory limit exceeded.'}))
+        self.assertFalse(policy.is_retryable({'state': failed}))
+        self.assertFalse(policy.is_retryable({'state': ee.batch.Task.State.CANCELLED}))
+
+        policy = RetryPolicy(classifier=lambda status: 'memory' in status['error_message'])
+        self.assertTrue(policy.is_retryable({'state': failed, 'error_message': 'User memory limit exceeded.'}))
+
+        policy = RetryPolicy(base_delay=10.0, max_delay=30.0, jitter=0.5)
+        for attempt, max_delay in [(1, 10.0), (2, 20.0), (3, 30.0), (10, 30.0)]:
+            delay = policy.delay(attempt)
+            self.assertTrue(max_delay / 2 <= delay <= max_delay)
+
+    def test_retry(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=0.0)
+        scheduler = TaskScheduler()
+        flaky = FlakyTaskFactory(2)
+        scheduler.add_task(None, 'a', retry_policy=policy, task_factory=flaky)
+        scheduler.add_task(FakeTask(1), 'b', ['a'])
+        scheduler.run(sleep_time=0.0, error_on_fail=True)
+        self.assertEqual(len(flaky.tasks), 3)
+        self.assertIs(scheduler.tasks['a'].task, flaky.tasks[-1])
+        self.assertEqual(scheduler.tasks['a'].attempts, 3)
+        self.assertTrue(scheduler.tasks['b']._success)
+
+        # Out of attempts
+        scheduler = TaskScheduler()
+        flaky = FlakyTaskFactory(3)
+        scheduler.add_task(None, 'a', retry_policy=policy, task_factory=flaky)
+        scheduler.add_task(FakeTask(1), 'b', ['a'])
+        scheduler.run(sleep_time=0.0)
+        self.assertEqual(len(flaky.tasks), 3)
+        self.assertTrue(scheduler.tasks['a'].failed())
+        self.assertFalse(scheduler.tasks['b'].task.started)
+
+        # Fatal errors are not retried
+        scheduler = TaskScheduler()
+        flaky = FlakyTaskFactory(1, error_message='User memory limit exceeded.')
+        scheduler.add_task(None, 'a', retry_policy=policy, task_factory=flaky)
+        with self.assertRaises(TaskSchedulerError):
+            scheduler.run(sleep_time=0.0, error_on_fail=True)
+        self.assertEqual(len(flaky.tasks), 1)
+
+        with self.assertRaises(TaskSchedulerError):
+            scheduler.add_task(FakeTask(1), 'c', retry_policy=policy)
+
+    def test_retry_delay(self):
+        policy = RetryPolicy(max_attempts=2, base_delay=0.2, jitter=0.0)
+        scheduler = TaskScheduler()
+        flaky = FlakyTaskFactory(1)
+        scheduler.add_task(None, 'a', retry_policy=policy, task_factory=flaky)
+        scheduler.add_task(FakeTask(1000), 'b')
+        start = time.time()
+        scheduler.run(sleep_time=0.0)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertTrue(scheduler.tasks['a']._success)
+
+    def test_backoff_sleep_times(self):
+        sleep_times = _backoff_sleep_times(120.0, min_sleep_time=5.0)
+        self.assertEqual([next(sleep_times) for _ in range(7)], [5.0, 10.0, 20.0, 40.0, 80.0, 120.0, 120.0])
+        sleep_times = _backoff_sleep_times(120.0)
+        self.assertEqual([next(sleep_times) for _ in range(2)], [120.0, 120.0])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,41 @@
+"""
+python -m tests.exports.test_util
+"""
+import datetime
+import unittest
+
+from gee_tools.exports.util import fingerprint, stack_feature_colls
+from gee_tools.exports.image_spec import ImageSpec
+from tests.test_imgtools import FakeGraph
+
+
+class FingerprintUnitTest(unittest.TestCase):
+
+    def test_stable(self):
+        first = fingerprint({'a': 1, 'b': [1, 2]}, 30, 'EPSG:3857')
+        second = fingerprint({'b': [1, 2], 'a': 1}, 30, 'EPSG:3857')
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 64)
+        self.assertNotEqual(first, fingerprint({'a': 1, 'b': [1, 2]}, 10, 'EPSG:3857'))
+
+    def test_python_values(self):
+        self.assertEqual(fingerprint({'x', 'y'}), fingerprint({'y', 'x'}))
+        self.assertEqual(fingerprint(datetime.date(2018, 1, 1)), fingerprint('2018-01-01'))
+        self.assertEqual(fingerprint(ImageSpec), fingerprint('gee_tools.exports.image_spec.ImageSpec'))
+        with self.assertRaises(TypeError):
+            fingerprint(object())
+
+
+class StackFeatureCollsUnitTest(unittest.TestCase):
+
+    def test_stack(self):
+        colls = [FakeGraph([i]) for i in range(5)]
+        stacked = stack_feature_colls(colls)
+        self.assertEqual((stacked.value, stacked.depth), (list(range(5)), 3))
+        self.assertEqual(len(colls), 5)
+        with self.assertRaises(ValueError):
+            stack_feature_colls([])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Stand-ins for the ee collection classes, evaluated eagerly so that tests can count the
+server side calls a sampling or reduction path makes.  Patch modules with fake_ee().
+"""
+import types
+import collections
+
+from gee_tools.exports.sharding import grid_cell_id, SHARD_PROPERTY
+
+
+class FakeFeature(object):
+    """A point feature, which is also its own geometry."""
+
+    def __init__(self, properties=None, coords=None):
+        self.properties = dict(properties or {})
+        self.coords = coords
+
+    def geometry(self):
+        return self
+
+    def coordinates(self):
+        return FakeList(self.coords)
+
+    def get(self, name):
+        return self.properties[name]
+
+    def set(self, *args):
+        properties = args[0] if len(args) == 1 else {args[0]: args[1]}
+        return FakeFeature(dict(self.properties, **properties), self.coords)
+
+    def setGeometry(self, geometry):
+        return FakeFeature(self.properties, geometry.coords)
+
+    def copyProperties(self, source, properties=None, exclude=None):
+        copied = {k: v for k, v in source.properties.items() if k not in (exclude or [])}
+        return FakeFeature(dict(self.properties, **copied), self.coords)
+
+    def propertyNames(self):
+        return FakeList(self.properties)
+
+    def select(self, names):
+        return FakeFeature({name: self.properties[name] for name in names}, self.coords)
+
+
+def fake_feature(geometry, properties=None):
+    """Stand-in for the ee.Feature constructor."""
+    if isinstance(geometry, FakeFeature) and properties is None:
+        return geometry
+    return FakeFeature(properties, geometry)
+
+
+class FakeCollection(object):
+    """A FeatureCollection whose map calls the function once per feature, like EE does."""
+
+    def __init__(self, features):
+        self.features = list(features)
+
+    def map(self, fn):
+        return FakeCollection(fn(f) for f in self.features)
+
+    def filter(self, condition):
+        name, value = condition
+        return FakeCollection(f for f in self.features if f.properties.get(name) == value)
+
+    def first(self):
+        return self.features[0]
+
+    def aggregate_array(self, name):
+        return [f.properties[name] for f in self.features]
+
+
+class FakeList(list):
+
+    def distinct(self):
+        return FakeList(collections.OrderedDict.fromkeys(self))
+
+    def map(self, fn):
+        return FakeList(fn(value) for value in self)
+
+    def remove(self, value):
+        return FakeList(v for v in self if v != value)
+
+    def get(self, index):
+        return self[index]
+
+    def length(self):
+        return len(self)
+
+
+class FakeFeatureCollectionOfCollections(object):
+
+    def __init__(self, collections):
+        self.collections = collections
+
+    def flatten(self):
+        return FakeCollection(f for coll in self.collections for f in coll.features)
+
+
+def fake_ee(**attributes):
+    """
+    A plain namespace rather than a MagicMock, whose calls are too slow for benchmarks.
+
+    Args:
+        attributes:  Other ee attributes used by the module under test, e.g. Reducer.
+    """
+    return types.SimpleNamespace(**dict({
+        'Feature': fake_feature,
+        'FeatureCollection': FakeFeatureCollectionOfCollections,
+        'List': FakeList,
+        'Number': lambda value: value,
+        'Filter': types.SimpleNamespace(eq=lambda name, value: (name, value)),
+    }, **attributes))
+
+
+def fake_add_grid_cell(fc, cell_size):
+    return fc.map(lambda f: f.set(SHARD_PROPERTY, grid_cell_id(f.coords[0], f.coords[1], cell_size)))
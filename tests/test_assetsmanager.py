@@ -0,0 +1,60 @@
+"""
+python -m tests.test_assetsmanager
+"""
+import unittest
+from unittest import mock
+
+import ee
+
+from gee_tools.assetsmanager import get_assets
+
+
+class GetAssetsUnitTest(unittest.TestCase):
+
+    def test_one_call_per_folder(self):
+        listings = {
+            'users/someone/a': {'assets': [
+                {'id': 'users/someone/a/x', 'name': 'projects/earthengine-legacy/assets/users/someone/a/x'},
+                {'id': 'users/someone/a/y', 'name': 'projects/earthengine-legacy/assets/users/someone/a/y'},
+            ]},
+            'projects/p/assets/b': {'assets': [
+                {'name': 'projects/p/assets/b/z'},
+            ]},
+        }
+
+        def list_assets(params):
+            if params['parent'] not in listings:
+                raise ee.EEException('Asset not found.')
+            return listings[params['parent']]
+
+        asset_ids = [
+            'users/someone/a/x', 'users/someone/a/missing', 'users/someone/a/y',
+            'projects/p/assets/b/z', 'users/someone/missing_folder/x',
+        ]
+        with mock.patch('ee.data.listAssets', side_effect=list_assets) as list_mock:
+            existing = get_assets(asset_ids)
+        self.assertEqual(set(existing), {'users/someone/a/x', 'users/someone/a/y', 'projects/p/assets/b/z'})
+        self.assertEqual(list_mock.call_count, 3)
+        self.assertEqual(
+            sorted(call[0][0]['parent'] for call in list_mock.call_args_list),
+            ['projects/p/assets/b', 'users/someone/a', 'users/someone/missing_folder']
+        )
+
+    def test_empty(self):
+        with mock.patch('ee.data.listAssets') as list_mock:
+            self.assertEqual(get_assets([]), {})
+        list_mock.assert_not_called()
+
+    def test_errors(self):
+        # Only a missing folder is empty, other errors are raised.
+        error = ee.EEException('Quota exceeded.')
+        with mock.patch('ee.data.listAssets', side_effect=error):
+            with self.assertRaises(ee.EEException):
+                get_assets(['users/someone/a/x'])
+        error = ee.EEException("Asset 'users/someone/a' does not exist or doesn't allow this operation.")
+        with mock.patch('ee.data.listAssets', side_effect=error):
+            self.assertEqual(get_assets(['users/someone/a/x']), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
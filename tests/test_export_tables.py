@@ -0,0 +1,86 @@
+"""
+python -m tests.test_export_tables
+"""
+import types
+import unittest
+import collections
+from unittest import mock
+
+from gee_tools import export_tables
+from gee_tools.exports import sharding
+from tests.fake_ee import FakeFeature, FakeCollection, FakeList, fake_add_grid_cell, fake_ee as make_fake_ee
+
+
+class FakeImage(object):
+    """An image with bands B1 and B2 whose values depend on the location, reductions are counted in ops."""
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.properties = {'system:time_start': 0, 'year': 2018, 'B1': 'not a value'}
+
+    def bandNames(self):
+        return FakeList(['B1', 'B2'])
+
+    def values(self, coordinates):
+        return {'B1': coordinates[0] * 10, 'B2': coordinates[1] * 10}
+
+    def reduceRegion(self, reducer, geometry, **kwargs):
+        self.ops['reduceRegion'] += 1
+        return self.values(geometry.coords)
+
+    def reduceRegions(self, collection, reducer, **kwargs):
+        self.ops['reduceRegions'] += 1
+        return FakeCollection(f.set(self.values(f.coords)) for f in collection.features)
+
+
+def fake_ee():
+    return make_fake_ee(
+        Reducer=types.SimpleNamespace(first=lambda: types.SimpleNamespace(forEachBand=lambda image: 'first')),
+    )
+
+
+def grid(num_points):
+    """Points on a 0.01 degree grid, 100 points per row."""
+    return FakeCollection(
+        FakeFeature({'id': i, 'B2': 'dropped'}, ((i % 100) * 0.01, (i // 100) * 0.01)) for i in range(num_points)
+    )
+
+
+class ReduceGridUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        ee = fake_ee()
+        patches = [
+            mock.patch.object(export_tables, 'ee', ee),
+            mock.patch.object(sharding, 'ee', ee),
+            mock.patch.object(export_tables, 'add_grid_cell', fake_add_grid_cell),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def reduce(self, num_points, **kwargs):
+        ops = collections.Counter()
+        samples = export_tables.reducegrid_core(FakeImage(ops), grid(num_points), 30, **kwargs)
+        return sorted((f.properties for f in samples.features), key=lambda p: p['id']), samples, ops
+
+    def test_batched(self):
+        expected, _, ops = self.reduce(250)
+        self.assertEqual(ops, {'reduceRegion': 250})
+        self.assertEqual(expected[101], {
+            'id': 101, 'B1': 0.1, 'B2': 0.1, 'system:time_start': 0, 'year': 2018, 'PTLON': 0.01, 'PTLAT': 0.01
+        })
+
+        samples, fc, ops = self.reduce(250, batched=True)
+        self.assertEqual(ops, {'reduceRegions': 1})
+        self.assertEqual(samples, expected)
+        self.assertIsNone(fc.features[0].coords)
+
+        # 100 columns of points 0.01 degrees apart, in 2 cells of 0.5 degrees.
+        samples, _, ops = self.reduce(250, batched=True, cell_size=0.5)
+        self.assertEqual(ops, {'reduceRegions': 2})
+        self.assertEqual(samples, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
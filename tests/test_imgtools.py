@@ -0,0 +1,40 @@
+"""
+python -m tests.test_imgtools
+"""
+import unittest
+
+from gee_tools.imgtools import balanced_fold, concat_bands, merge_collections
+
+
+class FakeGraph(object):
+    """Records the tree of addBands / merge calls."""
+
+    def __init__(self, value, depth=0):
+        self.value = value
+        self.depth = depth
+
+    def addBands(self, other):
+        return FakeGraph(self.value + other.value, max(self.depth, other.depth) + 1)
+
+    merge = addBands
+
+
+class BalancedFoldUnitTest(unittest.TestCase):
+
+    def test_order(self):
+        self.assertEqual(balanced_fold('abcdefg', lambda a, b: '({}{})'.format(a, b)), '(((ab)(cd))((ef)g))')
+        self.assertEqual(balanced_fold(['a'], lambda a, b: a + b), 'a')
+        with self.assertRaises(ValueError):
+            balanced_fold([], lambda a, b: a + b)
+
+    def test_depth(self):
+        images = [FakeGraph([i]) for i in range(33)]
+        scene = concat_bands(images)
+        self.assertEqual(scene.value, list(range(33)))
+        # Left-deep chaining would be 32 levels deep.
+        self.assertEqual(scene.depth, 6)
+        self.assertEqual(merge_collections(images[:4]).depth, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()